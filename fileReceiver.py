@@ -2,12 +2,19 @@
 File: fileReceiver.py
 
 Description:
-This script defines a function `receive_file` to receive files over TCP/IP.
+This script defines the asyncio based `FileReceiver` to receive files over TCP/IP.
 It listens for incoming connections on a specified IP address and port,
 receives data packets containing files, and writes the files to the 'output' directory.
+Many connections are served at once, so commands are never stuck behind a transfer.
+
+Classes:
+- FileReceiver: Serves the connections of a single port.
 
 Functions:
-- receive_file(server_ip, server_port): Main function to receive files over TCP/IP.
+- receive_file(server_ip, server_port, write_path, mode): Main function to receive files over TCP/IP.
+- sniff_mode(head): Tells a MOV from a CSV file by its first bytes.
+- main(args): Serves the CSV and MOV receivers on one event loop, or a single
+  multiplexing receiver when receive_port is configured.
 
 Usage:
 Ensure the IP address and port in the TCP connection part match the settings in the OSC server.
@@ -22,132 +29,707 @@ import socket
 import struct
 import os
 import asyncio
-import queue
-import threading
 import time
+import tempfile
+import mmap
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from src.config.setup import SetUp
+import src.utils.transferProtocol as tp
+from src.utils.writePipeline import WritePipeline, DEFAULT_MEMORY_BUDGET
+from src.utils.takeStore import TakeStore, HashingFile, new_hash, hash_file, move_file
+from src.utils.transferTelemetry import TransferTelemetry, TimedFile
+from src.utils.blendshapeBinary import write_binary, sidecar_path
+from src.utils.blendshapeLoader import StreamParser, ParsingFile, load_take
+from src.utils.takeIndex import build_index
+from src.utils.takeQC import check_take, write_report
+from src.utils.takeCatalog import TakeCatalog
+
+# Payloads are streamed to disk in chunks of this size, so memory use does not
+# grow with the size of the received file
+CHUNK_SIZE = 64 * 1024
+# Command messages are small, anything larger is always treated as file data
+MAX_COMMAND_SIZE = 64 * 1024
+COMMAND_PREFIX = b"COMMAND:"
+# Videos are received straight into a memory mapped file, this caps a single recv
+MMAP_RECV_SIZE = 1024 * 1024
+# QuickTime atoms a MOV file can start with, found at bytes 4 to 8 of the file
+MOV_ATOMS = (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot")
+# Modality of the received files in the take catalog, by mode
+MODALITIES = {"csv": "blendshapes", "mov": "face_video"}
 
-def handle_queue(write_queue, write_path, mode="csv"):
+def sniff_mode(head):
     """
-    Worker function to handle writing files from the queue to disk.
+    Tell a Live Link Face reference video from a blendshape CSV by its first 8 bytes.
+    """
+    return "mov" if head[4:8] in MOV_ATOMS else "csv"
+
+async def recv_exactly(client_socket, size):
     """
-    while True:
-        # Get a file task from the queue
-        file_name, data = write_queue.get()
-        if file_name is None:  # Sentinel to terminate the worker
+    Receive exactly size bytes, or fewer if the peer closes the connection.
+    """
+    loop = asyncio.get_running_loop()
+    data = bytearray()
+    while len(data) < size:
+        packet = await loop.sock_recv(client_socket, size - len(data))
+        if not packet:
             break
+        data += packet
+    return bytes(data)
 
-        # Create a subdirectory based on the current date
-        date_subdir = os.path.join(write_path, time.strftime("%d-%m-%Y"))
-        os.makedirs(date_subdir, exist_ok=True)
+async def recv_exactly_into(client_socket, view):
+    """
+    Fill view from the socket, or part of it if the peer closes the connection.
 
-        # Write the file to disk
-        file_path = os.path.join(date_subdir, f"{file_name}.{mode}")
-        print(f"[{mode}] Writing to file: {file_path}")
-        try:
-            with open(file_path, 'wb') as f:
-                f.write(data)
-        except Exception as e:
-            print(f"[{mode}] Error writing file: {e}")
-        finally:
-            write_queue.task_done()
+    Returns:
+    The number of bytes received.
+    """
+    loop = asyncio.get_running_loop()
+    received = 0
+    while received < len(view):
+        n = await loop.sock_recv_into(client_socket, view[received:])
+        if not n:
+            break
+        received += n
+    return received
 
-def receive_file(server_ip, server_port, write_path, mode="csv"):
+async def stream_to_mmap(client_socket, mm, offset, hasher=None):
     """
-    Receive file on a given IP and port.
+    Receive the socket data straight into a memory mapped file.
 
     Args:
-    - server_ip (str): The IP address to bind the server socket to.
-    - server_port (int): The port number to bind the server socket to.
+    - client_socket: The socket to read from.
+    - mm: The memory mapped target file, preallocated to the full payload size.
+    - offset (int): The offset to start writing at.
+    - hasher: Optional hash object that is updated with the data as it arrives.
 
     Description:
-    This function creates a TCP socket, binds it to the specified IP address and port,
-    and listens for incoming connections. It accepts a single connection at a time
-    and receives data packets containing files. The received files are written to
-    the 'output' directory. The function handles commands and data packets
-    according to the opening of the packet message.
-    The function is used to receive blendshapes files from an IPhone running
-    Live Link Face.
+    The socket data is received directly into the pages of the target file, so
+    it is never copied through an intermediate buffer.
 
     Returns:
-    None
+    The offset up to which the file has been filled, which is less than the
+    size of the map if the peer closed the connection early.
     """
-    # Create a queue for file writing tasks
-    write_queue = queue.Queue()
+    loop = asyncio.get_running_loop()
+    view = memoryview(mm)
+    try:
+        while offset < len(mm):
+            n = await loop.sock_recv_into(client_socket, view[offset:offset + MMAP_RECV_SIZE])
+            if not n:
+                break
+            if hasher is not None:
+                hasher.update(view[offset:offset + n])
+            offset += n
+    finally:
+        view.release()
+    return offset
+
+class FileReceiver:
+    """
+    Class FileReceiver receives files over TCP/IP on a given IP and port.
+
+    Description:
+    The receiver is built on asyncio and serves many connections at once, so a
+    COMMAND message is handled immediately even while a large file is still
+    being streamed in on another connection. Every message on a connection is
+    an int32 with the size of the message, followed by either a
+    "COMMAND:<cmd>!<msg>" string or the file data itself. A connection that
+    starts with tp.CHUNKED_MAGIC instead carries a resumable chunked upload,
+    see transferProtocol.py.
+
+    A receiver either serves a single mode on its own port, or multiplexes the
+    CSV and MOV streams on one port when mode is None. A multiplexing receiver
+    tells the files apart by their content, see sniff_mode, and shares one
+    writer thread and one command state between both streams.
+
+    Attributes:
+    - server_ip: The IP address to bind the server socket to.
+    - server_port: The port number to bind the server socket to.
+    - write_paths: The directory the dated subdirectories are created in, by mode.
+    - mode: The file extension of the received files, "csv" or "mov", or None
+      to receive both on this port.
+    - file_name: The name the next received file is saved under.
+    - takes: The number of files received per (file name, mode) since the
+      last FILE command, used to name re-recorded takes.
+    - spill_path: Optional directory the partial files are written to, for
+      example on a fast local disk, before they are moved into the write paths.
+    - pipeline: The WritePipeline that performs all writes within a memory budget.
+    - stores: The TakeStore of each save directory, or None when duplicate
+      payloads are not detected.
+    - uploads: File names of the unfinished chunked uploads, by upload id.
+    - telemetry: The TransferTelemetry every transfer is recorded in.
+    - sidecar: The dtype of the binary sidecar written for every CSV, "float32"
+      or "uint16", or None to write none, see blendshapeBinary.py.
+    - catalog: The TakeCatalog every received file is added to, or None.
+    """
+    def __init__(self, server_ip, server_port, write_path, mode="csv", memory_budget=DEFAULT_MEMORY_BUDGET, spill_path=None, deduplicate=True, telemetry=None, sidecar=None, catalog=None, name=None, device=None):
+        """
+        Initialize the FileReceiver.
+
+        Args:
+        - write_path: The save directory, or a {"csv": path, "mov": path} dict
+          when mode is None.
+        - deduplicate: Store identical payloads once, see takeStore.py.
+        - telemetry: Optional TransferTelemetry shared with other receivers.
+        - sidecar: Optional dtype of the binary sidecars of the CSV files.
+        - catalog: Optional TakeCatalog shared with other receivers.
+        - name: The name in the log and the metrics, by default the mode.
+        - device: The iPhone sending to this receiver, stored with its files in the catalog, None if unknown.
+        """
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.write_paths = write_path if isinstance(write_path, dict) else {mode: write_path}
+        self.mode = mode
+        self.name = name or mode or "mux"
+        self.spill_path = spill_path
+        self.file_name = "NoFileNameGiven"
+        self.takes = {}
+        self.pipeline = WritePipeline(memory_budget, name=self.name)
+        self.stores = {m: TakeStore(path) for m, path in self.write_paths.items()} if deduplicate else None
+        self.uploads = {}
+        self.telemetry = telemetry or TransferTelemetry()
+        self.telemetry.add_source(f"{self.name}_write_queue", self.pipeline.stats)
+        self.sidecar = sidecar
+        self.catalog = catalog
+        self.device = device
+        # Received CSVs are indexed and converted on their own thread, so they never hold up the writer
+        self.post_processing = ThreadPoolExecutor(max_workers=1) if mode != "mov" else None
+        self.connections = set()
+        self.idle = set()
+        self.closing = None
+
+    async def serve(self):
+        """
+        Serve connections until a CLOSE command is received.
 
-    # Start the worker thread for writing files
-    worker_thread = threading.Thread(target=handle_queue, args=(write_queue, write_path, mode), daemon=True)
-    worker_thread.start()
+        Description:
+        This method starts the writer thread, listens on the configured address
+        and handles every accepted connection in its own task. When a CLOSE
+        command arrives it stops accepting, lets the running transfers finish
+        and stops the writer thread.
+        """
+        loop = asyncio.get_running_loop()
+        self.closing = asyncio.Event()
 
-    # Create a TCP socket, and accept only 1 connection at a time
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((server_ip, server_port))
-    server_socket.listen(1)
+        # Start the worker thread for writing files
+        self.pipeline.start()
 
-    print(f"[{mode}] Server listening on {server_ip}:{server_port}")
-    print(f"[{mode}] Writing files to: {write_path}")
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if os.name != "nt":
+            # Allow a restart while connections of the previous run are in TIME_WAIT
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((self.server_ip, self.server_port))
+        server_socket.listen()
+        server_socket.setblocking(False)
 
-    file_name = "NoFileNameGiven"
+        print(f"[{self.name}] Server listening on {self.server_ip}:{self.server_port}")
+        print(f"[{self.name}] Writing files to: {', '.join(self.write_paths.values())}")
 
-    while True:
-        # Accept a connection from a client
-        client_socket, client_address = server_socket.accept()
-        print(f"[{mode}] Connection established from {client_address}")
+        accept_task = asyncio.create_task(self.accept_connections(server_socket))
+        await self.closing.wait()
+        accept_task.cancel()
+        server_socket.close()
 
+        # Drop the connections that wait for a next message, let transfers finish
+        for task in self.idle:
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(self.connections)
+
+        # Let the worker thread finish the queued writes and stop
+        await loop.run_in_executor(None, self.pipeline.stop)
+        if self.post_processing is not None:
+            await loop.run_in_executor(None, self.post_processing.shutdown)
+
+    async def accept_connections(self, server_socket):
+        """
+        Accept connections and handle each of them in a separate task.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            client_socket, client_address = await loop.sock_accept(server_socket)
+            client_socket.setblocking(False)
+            task = asyncio.create_task(self.handle_connection(client_socket, client_address))
+            self.connections.add(task)
+            task.add_done_callback(self.connections.discard)
+
+    async def handle_connection(self, client_socket, client_address):
+        """
+        Handle a connection carrying commands and files.
+
+        Args:
+        - client_socket: The accepted, non-blocking client socket.
+        - client_address: The address of the client.
+
+        Description:
+        Messages are handled one after the other until the client closes the
+        connection, so a long-lived command channel can send (and pipeline)
+        many commands over a single connection.
+        """
+        print(f"[{self.name}] Connection established from {client_address}")
+        task = asyncio.current_task()
+        # The time to first byte of the first message counts from the accept
+        started = time.perf_counter()
         try:
-            # Receive the int32 representing the total size of the file
-            size_data = client_socket.recv(4)
-            total_size = struct.unpack('>I', size_data)[0]
-            print(f"[{mode}] Size of msg:", total_size)
-
-            # Receive the full data
-            data = b""
-            while len(data) < total_size:
-                packet = client_socket.recv(total_size - len(data))
-                if not packet:
+            while not self.closing.is_set():
+                # Receive the int32 representing the total size of the file
+                self.idle.add(task)
+                size_data = await recv_exactly(client_socket, 4)
+                self.idle.discard(task)
+                if len(size_data) < 4:
                     break
-                data += packet
-
-            if data.startswith(b"COMMAND:"):
-                # Handle command messages
-                data = data.decode("utf-8").lstrip("COMMAND:")
-                cmd, msg = data.split('!', 1)
-                if cmd == 'CLOSE':
+                started = started or time.perf_counter()
+                total_size = struct.unpack('>I', size_data)[0]
+                if total_size == tp.CHUNKED_MAGIC:
+                    await self.receive_chunked(client_socket, self.telemetry.start_transfer(self.name, client_address, started))
                     break
-                elif cmd == 'ALIVE':
-                    print(f"[{mode}] We are alive")
-                elif cmd == 'FILE':
-                    file_name = msg
-                elif cmd == 'RECORD':
-                    print(f"[{mode}] We are recording")
-                else:
-                    print(f"[{mode}] Unknown command: {cmd}")
-            else:
-                # Enqueue the file data for writing
-                print(f"[{mode}] Enqueuing file {file_name}.{mode}")
-                write_queue.put((file_name, data))
-                file_name += "_rerecorded"
+                print(f"[{self.name}] Size of msg:", total_size)
+
+                # Peek at the start of the message to tell commands from file data
+                head = await recv_exactly(client_socket, min(len(COMMAND_PREFIX), total_size))
 
+                if head == COMMAND_PREFIX and total_size <= MAX_COMMAND_SIZE:
+                    data = head + await recv_exactly(client_socket, total_size - len(head))
+                    self.handle_command(data)
+                else:
+                    await self.receive_payload(client_socket, head, total_size, self.telemetry.start_transfer(self.name, client_address, started))
+                started = None
         except Exception as e:
-            print(f"[{mode}] Error:", e)
+            print(f"[{self.name}] Error:", e)
         finally:
+            self.idle.discard(task)
             client_socket.close()
 
-    # Signal the worker thread to stop and close the queue
-    write_queue.put((None, None))
-    worker_thread.join()
-    server_socket.close()
+    def handle_command(self, data):
+        """
+        Handle a "COMMAND:<cmd>!<msg>" message.
+
+        Args:
+        - data (bytes): The full command message, including the prefix.
+        """
+        cmd, msg = data[len(COMMAND_PREFIX):].decode("utf-8").split('!', 1)
+        if cmd == 'CLOSE':
+            self.closing.set()
+        elif cmd == 'ALIVE':
+            print(f"[{self.name}] We are alive, write queue: {self.pipeline.stats()}")
+        elif cmd == 'FILE':
+            self.file_name = msg
+            self.takes = {}
+        elif cmd == 'RECORD':
+            print(f"[{self.name}] We are recording")
+        else:
+            print(f"[{self.name}] Unknown command: {cmd}")
+
+    async def receive_payload(self, client_socket, head, total_size, record):
+        """
+        Stream a file into a partial file and enqueue it once complete.
+
+        Args:
+        - client_socket: The client socket the rest of the file is read from.
+        - head (bytes): The first bytes of the file, already read from the socket.
+        - total_size (int): The announced size of the file.
+        - record (TransferRecord): The telemetry record of this transfer.
+        """
+        record.first_byte = time.perf_counter()
+        # Claim the file name now, so a concurrent transfer gets the next name
+        mode = self.mode or sniff_mode(head)
+        base_name = self.file_name
+        file_name = self.claim_file_name(mode, base_name)
+        record.mode, record.file_name, record.size = mode, file_name, total_size
+
+        # Stream the file data into a partial file
+        fd, temp_path = tempfile.mkstemp(prefix=f".{file_name}.", suffix=f".{mode}.part", dir=self.partial_dir(mode))
+        f = TimedFile(os.fdopen(fd, 'r+b'), record)
+        # Hash the data while it arrives, to recognise a take that was sent before
+        hasher = None
+        parser = None
+        try:
+            if mode == "mov" and total_size > 0:
+                # Preallocate the file and receive the video straight into it
+                f.f.truncate(total_size)
+                hasher = new_hash() if self.stores else None
+                with mmap.mmap(f.f.fileno(), total_size) as mm:
+                    mm[:len(head)] = head
+                    if hasher is not None:
+                        hasher.update(head)
+                    received = await stream_to_mmap(client_socket, mm, len(head), hasher)
+                if received < total_size:
+                    f.f.truncate(received)
+            else:
+                # Parse the blendshapes on the writer thread while they arrive
+                parser = StreamParser() if mode == "csv" else None
+                writer = ParsingFile(f, parser) if parser is not None else f
+                writer = HashingFile(writer) if self.stores else writer
+                hasher = writer if self.stores else None
+                self.pipeline.call(writer.write, head)
+                received = len(head) + await self.stream_to_pipeline(client_socket, writer, total_size - len(head))
+        except Exception as e:
+            # Nothing of a broken transfer is kept, and its name is free for the next one
+            record.last_byte = time.perf_counter()
+            record.error = f"{type(e).__name__}: {e}"
+            self.release_file_name(mode, base_name, file_name)
+            self.pipeline.call(f.close)
+            self.pipeline.call(self.discard_partial, temp_path, record)
+            raise
+        self.pipeline.call(f.close)
+        record.last_byte = time.perf_counter()
+        record.received = received
+        duration = record.last_byte - record.first_byte
+
+        if received < total_size:
+            # A truncated take is kept as the partial file, but never stored, cataloged or checked as a take
+            print(f"[{self.name}] Warning: connection closed after {received} of {total_size} bytes, "
+                  f"keeping the partial file {temp_path}")
+            record.error = "incomplete"
+            self.release_file_name(mode, base_name, file_name)
+            self.pipeline.call(self.finish_record, record)
+            return
+        print(f"[{self.name}] Received {received} bytes in {duration:.2f}s ({received / max(duration, 1e-9) / 1e6:.1f} MB/s)")
+
+        # Enqueue the completed file for moving into place
+        print(f"[{self.name}] Enqueuing file {file_name}.{mode}")
+        self.pipeline.call(self.finish_file, file_name, temp_path, mode, hasher, record, parser)
+
+    async def receive_chunked(self, client_socket, record):
+        """
+        Receive (part of) a resumable chunked upload.
+
+        Args:
+        - client_socket: The client socket, positioned right after the magic value.
+        - record (TransferRecord): The telemetry record of this connection.
+
+        Description:
+        Verified chunks are appended to a partial file named after the upload id,
+        so the size of that file is the offset to resume from. When the
+        connection drops the partial file is kept, and a new connection with the
+        same upload id continues where the previous one stopped. A chunk with a
+        bad CRC or an unexpected offset is rejected with the last good offset.
+        """
+        loop = asyncio.get_running_loop()
+        header = await recv_exactly(client_socket, tp.UPLOAD_HEADER.size)
+        total_size, chunk_size, id_length = tp.UPLOAD_HEADER.unpack(header)
+        upload_id = (await recv_exactly(client_socket, id_length)).decode("utf-8")
+        if not tp.valid_upload_id(upload_id) or chunk_size > tp.MAX_CHUNK_SIZE:
+            print(f"[{self.name}] Refusing chunked upload '{upload_id}' with chunk size {chunk_size}")
+            return
+
+        # Remember the file name for a new upload, a resumed upload keeps its name
+        base_name = self.uploads.setdefault(upload_id, self.file_name)
+
+        # Let the writes of an earlier attempt at this upload land first
+        await self.pipeline.drain()
+        temp_path = os.path.join(self.partial_dir(self.mode), f".{upload_id}.{self.name}.part")
+        f = TimedFile(open(temp_path, 'ab'), record)
+        record.mode, record.file_name, record.size = self.mode or self.name, base_name, total_size
+        try:
+            offset = f.f.tell()
+            if offset > total_size:
+                f.f.truncate(0)
+                offset = 0
+            record.resumed_at = offset
+            record.received = offset
+            print(f"[{self.name}] Chunked upload '{upload_id}' of {total_size} bytes, resuming at {offset}")
+            await loop.sock_sendall(client_socket, tp.STATUS.pack(tp.STATUS_RESUME, offset))
+
+            while offset < total_size:
+                header = await recv_exactly(client_socket, tp.CHUNK_HEADER.size)
+                record.first_byte = record.first_byte or time.perf_counter()
+                if len(header) < tp.CHUNK_HEADER.size:
+                    print(f"[{self.name}] Chunked upload '{upload_id}' interrupted at {offset} of {total_size} bytes")
+                    return
+                chunk_offset, length, crc = tp.CHUNK_HEADER.unpack(header)
+                if chunk_offset != offset or length > chunk_size or offset + length > total_size:
+                    print(f"[{self.name}] Unexpected chunk at {chunk_offset} of {length} bytes, expected offset {offset}")
+                    await loop.sock_sendall(client_socket, tp.STATUS.pack(tp.STATUS_BAD_CHUNK, offset))
+                    return
+
+                # Wait for room in the memory budget before reading the chunk
+                buffer = await self.pipeline.acquire(chunk_size)
+                chunk = memoryview(buffer)[:length]
+                if await recv_exactly_into(client_socket, chunk) < length:
+                    self.pipeline.release(buffer)
+                    print(f"[{self.name}] Chunked upload '{upload_id}' interrupted at {offset} of {total_size} bytes")
+                    return
+                if zlib.crc32(chunk) != crc:
+                    self.pipeline.release(buffer)
+                    print(f"[{self.name}] CRC mismatch in chunk at {offset}, asking to resend")
+                    await loop.sock_sendall(client_socket, tp.STATUS.pack(tp.STATUS_BAD_CHUNK, offset))
+                    return
+
+                # Only verified chunks reach the file, so its size is the resume offset
+                self.pipeline.write(f, buffer, length)
+                self.pipeline.call(f.flush)
+                offset += length
+                record.received = offset
+        finally:
+            self.pipeline.call(f.close)
+            record.last_byte = time.perf_counter()
+            record.first_byte = record.first_byte or record.last_byte
+            if record.received < total_size:
+                # Record the interrupted attempt once its writes have landed
+                record.error = "interrupted"
+                self.pipeline.call(self.finish_record, record)
+
+        await loop.sock_sendall(client_socket, tp.STATUS.pack(tp.STATUS_DONE, offset))
+        del self.uploads[upload_id]
+
+        mode = self.mode
+        if mode is None:
+            await self.pipeline.drain()
+            with open(temp_path, 'rb') as f:
+                mode = sniff_mode(f.read(8))
+        file_name = self.claim_file_name(mode, base_name)
+        record.mode, record.file_name = mode, file_name
+
+        # Enqueue the completed file for moving into place
+        print(f"[{self.name}] Enqueuing file {file_name}.{mode}")
+        self.pipeline.call(self.finish_file, file_name, temp_path, mode, None, record)
+
+    async def stream_to_pipeline(self, client_socket, f, remaining):
+        """
+        Copy remaining bytes from the socket to an open file, one chunk at a time.
+
+        Description:
+        Every chunk is received into a buffer of the write pipeline and written
+        by its writer thread, so a slow disk does not stall the event loop. When
+        the memory budget is used up, the socket is not read until the writer
+        has caught up, which applies backpressure to the sender.
+
+        Returns:
+        The number of bytes received, which is less than remaining if the peer
+        closed the connection early.
+        """
+        received = 0
+        while received < remaining:
+            buffer = await self.pipeline.acquire(CHUNK_SIZE)
+            n = await recv_exactly_into(client_socket, memoryview(buffer)[:min(CHUNK_SIZE, remaining - received)])
+            if not n:
+                self.pipeline.release(buffer)
+                break
+            self.pipeline.write(f, buffer, n)
+            received += n
+        return received
+
+    def claim_file_name(self, mode, base_name=None):
+        """
+        Claim the name of a received file.
+
+        Description:
+        The first file of each mode after a FILE command gets the given name,
+        later ones (re-recorded takes) get "_rerecorded" appended.
+        """
+        if base_name is None:
+            base_name = self.file_name
+        count = self.takes.get((base_name, mode), 0)
+        self.takes[(base_name, mode)] = count + 1
+        return base_name + "_rerecorded" * count
+
+    def release_file_name(self, mode, base_name, file_name):
+        """
+        Give back the name claimed by a transfer that did not produce a file.
+
+        Description:
+        The name is only given back when no later transfer claimed a name after it.
+        """
+        count = (len(file_name) - len(base_name)) // len("_rerecorded")
+        if self.takes.get((base_name, mode)) == count + 1:
+            self.takes[(base_name, mode)] = count
+
+    def discard_partial(self, temp_path, record):
+        """
+        Remove the partial file of a broken transfer and record the transfer, on the writer thread.
+        """
+        try:
+            os.remove(temp_path)
+        except OSError as e:
+            print(f"[{self.name}] Could not remove {temp_path}: {e}")
+        self.finish_record(record)
+
+    def partial_dir(self, mode=None):
+        """
+        Return the directory partial files are written to, creating it if needed.
+        """
+        write_path = self.write_paths.get(mode) or next(iter(self.write_paths.values()))
+        partial_dir = self.spill_path or os.path.join(write_path, time.strftime("%d-%m-%Y"))
+        os.makedirs(partial_dir, exist_ok=True)
+        return partial_dir
+
+    def finish_record(self, record):
+        """
+        Store the telemetry record of a transfer, on the writer thread.
+        """
+        record.finish_started = record.finish_started or time.perf_counter()
+        self.telemetry.finish(record)
+
+    def finish_file(self, file_name, temp_path, mode, hasher=None, record=None, parser=None):
+        """
+        Move a completed partial file into the dated subdirectory.
+
+        Args:
+        - hasher: The hash object that saw all data of the file, if any. A
+          resumed chunked upload was received over several connections and is
+          hashed here instead.
+        - record: The telemetry record of the transfer, completed here.
+        - parser: The StreamParser that saw all data of a CSV, if any. Its
+          summary of the take is ready here without reading the file again.
+
+        Description:
+        This runs on the writer thread, after all writes to the file are done.
+        When the same content was stored before, the file becomes a link to it.
+        """
+        start = time.perf_counter()
+        date_subdir = os.path.join(self.write_paths[mode], time.strftime("%d-%m-%Y"))
+        os.makedirs(date_subdir, exist_ok=True)
+        file_path = os.path.join(date_subdir, f"{file_name}.{mode}")
+        if self.stores is None:
+            print(f"[{self.name}] Writing to file: {file_path}")
+            move_file(temp_path, file_path)
+            duplicate_of = None
+        else:
+            digest = hasher.hexdigest() if hasher is not None else hash_file(temp_path)
+            duplicate_of = self.stores[mode].store(temp_path, file_path, digest)
+            if duplicate_of is None:
+                print(f"[{self.name}] Writing to file: {file_path}")
+            else:
+                print(f"[{self.name}] Linking {file_path} to identical file {duplicate_of}")
+
+        if self.catalog is not None:
+            self.catalog.add(file_path, MODALITIES[mode], "livelinkface", gloss=file_name.replace("_rerecorded", ""),
+                             take=file_name.count("_rerecorded"), device=self.device)
+
+        take = None
+        spans = None
+        if parser is not None:
+            parser.close()
+            if parser.error is None:
+                take = parser.take()
+                spans = parser.spans()
+                summary = parser.summary()
+                print(f"[{self.name}] {file_name}.{mode}: {summary['frames']} frames, "
+                      f"{summary['duration']:.2f}s, {summary['dropped_frames']} dropped frames")
+                if record is not None:
+                    record.qc = summary
+            else:
+                print(f"[{self.name}] Could not parse {file_path}: {parser.error}")
+
+        if mode == "csv":
+            self.post_processing.submit(self.post_process, file_path, take, spans)
+
+        if record is not None:
+            record.finish_started = start
+            record.duplicate = duplicate_of is not None
+            record.add_write_time(time.perf_counter() - start)
+            self.finish_record(record)
+
+    def post_process(self, file_path, take=None, spans=None):
+        """
+        Write the timecode index, the binary sidecar and the quality report of
+        a received CSV, on the post processing thread.
+
+        Args:
+        - take: The take parsed while it was received, or None to read the CSV.
+        - spans: The byte ranges of the frame lines found while parsing, so the index needs no read of the CSV.
+        """
+        try:
+            take = take if take is not None else load_take(file_path)
+            build_index(file_path, take.timecodes, take.fps, spans, take.names)
+            if self.sidecar:
+                path = sidecar_path(file_path)
+                write_binary(path, take, self.sidecar)
+                print(f"[{self.name}] Writing sidecar: {path}")
+
+            report = check_take(take)
+            report["take"] = file_path
+            write_report(file_path, report)
+            if not report["ok"]:
+                print(f"[{self.name}] QC {file_path}: {report['dropped_frames']} dropped, "
+                      f"{len(report['timecode_jumps'])} timecode jumps, {len(report['duplicated_frames'])} duplicated, "
+                      f"{report['frozen_frames']} frozen frames")
+        except Exception as e:
+            print(f"[{self.name}] Error post processing {file_path}: {e}")
+
+def receive_file(server_ip, server_port, write_path, mode="csv", memory_budget=DEFAULT_MEMORY_BUDGET, spill_path=None, deduplicate=True):
+    """
+    Receive file on a given IP and port.
+
+    Args:
+    - server_ip (str): The IP address to bind the server socket to.
+    - server_port (int): The port number to bind the server socket to.
+    - write_path (str): The directory the received files are written to.
+    - mode (str): The file extension of the received files, "csv" or "mov",
+      or None to receive both (write_path is then a dict by mode).
+    - memory_budget (int): The maximum number of bytes waiting to be written.
+    - spill_path (str): Optional directory for the partial files.
+    - deduplicate (bool): Store identical payloads once.
+
+    Description:
+    This function runs a FileReceiver on its own event loop until a CLOSE
+    command is received. The received files are streamed chunk by chunk into a
+    partial file in the dated output directory, which is renamed once the full
+    payload has arrived, so memory use stays constant regardless of the file
+    size. The function is used to receive blendshapes files from an IPhone
+    running Live Link Face.
+
+    Returns:
+    None
+    """
+    asyncio.run(FileReceiver(server_ip, server_port, write_path, mode, memory_budget, spill_path, deduplicate).serve())
+
+async def main(args):
+    """
+    Serve the CSV and MOV receivers concurrently on one event loop.
+
+    Description:
+    When receive_port is configured, a single receiver multiplexes both streams
+    on that port instead. iPhones with a receive_port of their own (llf_devices)
+    each get a multiplexing receiver as well. All receivers record their transfers in one
+    TransferTelemetry, served on localhost when receiver_metrics_port is set.
+    """
+    telemetry = TransferTelemetry(log_path=args.receiver_transfer_log)
+    catalog = TakeCatalog(args.catalog_db_path) if args.catalog_db_path else None
+    if args.receiver_metrics_port:
+        telemetry.serve_metrics("127.0.0.1", args.receiver_metrics_port)
+
+    # The iPhone on the shared receivers, if only one iPhone sends to them
+    shared = [device["name"] for device in args.llf_devices
+              if not device["receive_port"] or device["receive_port"] == args.receive_port]
+    shared_device = shared[0] if len(shared) == 1 else None
+
+    # Every iPhone with a receive_port of its own gets a multiplexing receiver saving under its name
+    receivers = []
+    for device in args.llf_devices:
+        if device["receive_port"] and device["receive_port"] != args.receive_port:
+            write_paths = {"csv": os.path.join(args.llf_csv_save_path, device["name"]),
+                           "mov": os.path.join(args.llf_video_save_path, device["name"])}
+            receivers.append(FileReceiver(args.target_ip, device["receive_port"], write_paths, None,
+                                          memory_budget=args.receiver_memory_budget, spill_path=args.receiver_spill_path,
+                                          deduplicate=args.receiver_deduplicate, telemetry=telemetry,
+                                          sidecar=args.receiver_binary_sidecar, catalog=catalog,
+                                          name=device["name"], device=device["name"]))
+
+    if args.receive_port:
+        write_paths = {"csv": args.llf_csv_save_path, "mov": args.llf_video_save_path}
+        receivers.append(FileReceiver(args.target_ip, args.receive_port, write_paths, None,
+                                      memory_budget=args.receiver_memory_budget, spill_path=args.receiver_spill_path,
+                                      deduplicate=args.receiver_deduplicate, telemetry=telemetry,
+                                      sidecar=args.receiver_binary_sidecar, catalog=catalog, device=shared_device))
+    else:
+        receivers += [
+            FileReceiver(args.target_ip, args.receive_csv_port, args.llf_csv_save_path,
+                         memory_budget=args.receiver_memory_budget, spill_path=args.receiver_spill_path,
+                         deduplicate=args.receiver_deduplicate, telemetry=telemetry,
+                         sidecar=args.receiver_binary_sidecar, catalog=catalog, device=shared_device),
+            FileReceiver(args.target_ip, args.receive_video_port, args.llf_video_save_path, "mov",
+                         memory_budget=args.receiver_memory_budget, spill_path=args.receiver_spill_path,
+                         deduplicate=args.receiver_deduplicate, telemetry=telemetry, catalog=catalog,
+                         device=shared_device)
+        ]
+    await asyncio.gather(*(receiver.serve() for receiver in receivers))
 
 
 if __name__ == "__main__":
     args = SetUp("config.yaml")
 
-    csv_path = args.llf_csv_save_path
-    video_path = args.llf_video_save_path
     print("Starting file receiver...")
-    loop = asyncio.get_event_loop()
-    tasks = [
-        loop.run_in_executor(None, receive_file, args.target_ip, args.receive_csv_port, csv_path),
-        loop.run_in_executor(None, receive_file, args.target_ip, args.receive_video_port, video_path, "mov")
-    ]
-    loop.run_until_complete(asyncio.wait(tasks))
+    asyncio.run(main(args))
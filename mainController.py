@@ -11,6 +11,7 @@ Functions:
 - handle_start(websocket, control, message): Handle the "recordStart" command.
 - handle_stop(websocket, control, message): Handle the "recordStop" command.
 - handle_ping(websocket, control, message): Handle the "ping" command.
+- handle_latency(websocket, control, message): Handle the "latency" command.
 - handle_filename(websocket, control, message): Handle the "fileName" command.
 - handle_greet(message): Handle the "greet" command.
 - handle_default(message): Handle default messages.
@@ -34,6 +35,7 @@ from src.utils.opticalCamera import FFmpegRecorder
 import src.utils.OBSRecorder.src.obsRecording as obsRecording
 from src.utils.popUp import PopUp
 import functools
+import json
 import os
 import ssl
 
@@ -118,6 +120,11 @@ async def handle_stop(websocket, control, optical_cameras, obs, message):
     except Exception as e:
         print(f"[main ERROR] stopping recordings: {e}")
 
+    try:
+        await asyncio.to_thread(control.catalog_obs_recordings)
+    except Exception as e:
+        print(f"[main ERROR] cataloging OBS recordings: {e}")
+
     # Send the "stopping" message to the client after all tasks are done
     try:
         await websocket.send("stopping")
@@ -144,6 +151,24 @@ async def handle_ping(websocket, control, message):
     await websocket.send("pong")
 
 
+async def handle_latency(websocket, control, message):
+    """
+    Handle the "latency" command.
+
+    Description:
+    This function handles the "latency" command received from the client.
+    It collects the round trip times of the OSC commands, from here to the
+    OSC server and from the OSC server to the iPhones, and sends the
+    p50/p95/p99 per device back as "latency:<json>".
+
+    Returns:
+    None
+    """
+    print("[main] Collecting the OSC latency...")
+    report = await asyncio.to_thread(control.latency_report)
+    await websocket.send("latency:" + json.dumps(report))
+
+
 async def handle_filename(websocket, control, optical_cameras, obs, message):
     """
     Handle the "fileName" command.
@@ -163,7 +188,7 @@ async def handle_filename(websocket, control, optical_cameras, obs, message):
     print("[main] Asking optical camera to set the file name...")
     try:
         for optical_camera in optical_cameras:
-            optical_camera.set_recording_name(file_name + "_" + optical_camera.video_device)
+            optical_camera.set_recording_name(file_name + "_" + optical_camera.video_device, gloss=file_name)
     except Exception as e:
         print(f"[main] Error setting optical camera file name: {e}")
 
@@ -205,6 +230,7 @@ async def message_handler(control, optical_cameras, obs, websocket, path):
         "recordStart": functools.partial(handle_start, websocket, control, optical_cameras, obs),
         "recordStop": functools.partial(handle_stop, websocket, control, optical_cameras, obs),
         "ping": functools.partial(handle_ping, websocket, control),
+        "latency": functools.partial(handle_latency, websocket, control),
         "fileName": functools.partial(handle_filename, websocket, control, optical_cameras, obs),
         "greet": handle_greet,
     }
@@ -276,7 +302,7 @@ if __name__ == "__main__":
     for i in range(len(args.camera_names)):
         print(f"Camera {i + 1}: {args.camera_names[i]}, {args.camera_mic_names[i]}, {args.camera_save_paths[i]}")
         # Start the optical camera
-        optical_camera = FFmpegRecorder(video_device=args.camera_names[i], audio_device=args.camera_mic_names[i], save_path=args.camera_save_paths[i], popUp=popUp)
+        optical_camera = FFmpegRecorder(video_device=args.camera_names[i], audio_device=args.camera_mic_names[i], save_path=args.camera_save_paths[i], popUp=popUp, catalog=control.catalog)
         optical_camera.set_save_location(args.camera_save_paths[i])
         # optical_camera.set_save_location('D:\\VideoCapture')  # Set your desired save location
         if optical_camera.validate_devices() == (True, True) or optical_camera.validate_devices() == (True, False):
@@ -5,6 +5,7 @@ This script imports necessary modules to set up and launch a LiveLinkFaceServer
 It fetches configuration settings from a YAML file using the SetUp class from src.config.setup module.
 Then, it initializes a LiveLinkFaceServer instance with a specified model name and the fetched arguments.
 Finally, it launches the server using the init_server() method.
+The server runs blocking or on an asyncio event loop, depending on osc_server_mode in the config.
 
 Usage:
     python main.py
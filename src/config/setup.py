@@ -12,6 +12,7 @@ class SetUp:
         self.__load_paths()
         self.__load_optical_camera_configs()
         self.__load_obs_config()
+        self.__load_receiver_config()
 
     def __load_vicon(self):
         self.vicon_sdk_path = self.args['vicon_sdk_path']
@@ -34,14 +35,27 @@ class SetUp:
         self.leffe_con = self.args['leffe_con']
 
         # Live Link Face
-        self.llf_udp_ip = self.args['llf_udp_ip']
         self.llf_udp_port = self.args['llf_udp_port']
+        # iPhones recorded at once, by default only llf_udp_ip
+        devices = self.args.get('llf_devices') or [{'name': 'iphone', 'ip': self.args['llf_udp_ip']}]
+        self.llf_devices = [self.__load_llf_device(i, device) for i, device in enumerate(devices)]
+        self.llf_udp_ip = self.llf_devices[0]['ip']
+        # Optional port the iPhone streams the blendshapes to while recording
+        self.llf_stream_port = self.args.get('llf_stream_port', None)
+        self.llf_stream_buffer_frames = self.args.get('llf_stream_buffer_frames', 6000)
 
         # Local computer 
         self.target_ip = self.args['target_ip']
         self.target_port = self.args['target_port']
+        # "blocking" handles the OSC messages one by one, "asyncio" runs the TCP work of the handlers in the background
+        self.osc_server_mode = self.args.get('osc_server_mode', 'blocking')
+        # Record commands are resent until confirmed: seconds to the first resend (doubled after each) and number of resends
+        self.osc_confirm_timeout = self.args.get('osc_confirm_timeout', 0.25)
+        self.osc_retries = self.args.get('osc_retries', 3)
         self.receive_csv_port = self.args['receive_csv_port']
         self.receive_video_port = self.args['receive_video_port']
+        # Optional single port on which one receiver takes both the CSV and MOV files
+        self.receive_port = self.args.get('receive_port', None)
 
         self.tcp_iphone_port = self.args['tcp_iphone_port']
         self.controller_port = self.args['controller_port']
@@ -51,6 +65,14 @@ class SetUp:
         self.websock_ip = self.args['websock_ip']
         self.websock_port = self.args['websock_port']
 
+    def __load_llf_device(self, index, device):
+        # Without its own receive_port a device sends its files to the shared receivers
+        return {
+            'name': device.get('name', f"iphone{index}"),
+            'ip': device['ip'],
+            'receive_port': device.get('receive_port', None),
+        }
+
     def __load_paths(self):
         self.output_dir = self.args['output_dir']
         self.llf_csv_save_path = self.args['llf_save_path_csv']
@@ -76,6 +98,16 @@ class SetUp:
         self.obs_buffer_folder = self.args['obs_buffer_folder']
         self.obs_save_folder = self.args['obs_save_folder']
 
+    def __load_receiver_config(self):
+        self.receiver_memory_budget = self.args.get('receiver_memory_budget', 64 * 1024 * 1024)
+        self.receiver_spill_path = self.args.get('receiver_spill_path', None)
+        self.receiver_deduplicate = self.args.get('receiver_deduplicate', True)
+        self.receiver_metrics_port = self.args.get('receiver_metrics_port', None)
+        self.receiver_transfer_log = self.args.get('receiver_transfer_log', None)
+        self.receiver_binary_sidecar = self.args.get('receiver_binary_sidecar', None)
+        # SQLite catalog of all captured files, shared by the receiver and the controller
+        self.catalog_db_path = self.args.get('catalog_db_path', None)
+
 if __name__ == "__main__":
     reader = SetUp("config.yaml")
     
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+File: benchmarkLoader.py
+
+Description:
+Benchmark for the blendshape CSV loader (src/utils/blendshapeLoader.py). A
+corpus of synthetic takes is written to a temporary directory, each made of
+the frames of a real Live Link Face CSV repeated up to the requested length,
+and loaded once with the vectorized loader and once with the csv module, row
+by row, as a baseline. The number of takes loaded per minute is reported for
+both.
+
+Usage:
+    python -m src.liveLinkTest.benchmarkLoader --takes 1000 --seconds 10
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.utils.blendshapeLoader import DEFAULT_FPS, BlendshapeTake, load_take
+
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "..", "output_file.txt")
+
+
+def make_corpus(directory, source, takes, frames):
+    """
+    Write takes synthetic CSV files of the given number of frames.
+    """
+    with open(source, 'rb') as f:
+        header, _, body = f.read().partition(b"\n")
+    lines = body.strip().split(b"\n")
+    take = header + b"\n" + b"\n".join(lines[i % len(lines)] for i in range(frames)) + b"\n"
+    paths = []
+    for i in range(takes):
+        path = os.path.join(directory, f"take_{i}.csv")
+        with open(path, 'wb') as f:
+            f.write(take)
+        paths.append(path)
+    return paths
+
+
+def load_rows(path):
+    """
+    Baseline loader parsing the CSV row by row with the csv module.
+    """
+    timecodes, values = [], []
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader)[2:]
+        for row in reader:
+            h, m, s, frame = row[0].split(":")
+            timecodes.append(int(h) * 3600 + int(m) * 60 + int(s) + float(frame) / DEFAULT_FPS)
+            values.append([float(v) for v in row[2:]])
+    return BlendshapeTake(names, np.array(timecodes), np.array(values, dtype=np.float32))
+
+
+def run(loader, paths):
+    start = time.perf_counter()
+    frames = 0
+    for path in paths:
+        frames += len(loader(path))
+    return time.perf_counter() - start, frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the blendshape CSV loader.")
+    parser.add_argument('--takes', type=int, default=1000, help="Number of takes in the corpus")
+    parser.add_argument('--seconds', type=float, default=10, help="Length of every take in seconds")
+    parser.add_argument('--csv', default=DEFAULT_CSV, help="CSV file the takes are made from")
+    parser.add_argument('--skip-baseline', action='store_true', help="Only run the vectorized loader")
+    args = parser.parse_args()
+
+    frames = int(args.seconds * DEFAULT_FPS)
+    with tempfile.TemporaryDirectory(prefix="loader_bench_") as directory:
+        paths = make_corpus(directory, args.csv, args.takes, frames)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"Corpus of {args.takes} takes of {frames} frames, {size / 1e6:.1f} MB")
+
+        loaders = [("vectorized", load_take)] + ([] if args.skip_baseline else [("csv module", load_rows)])
+        for name, loader in loaders:
+            seconds, loaded = run(loader, paths)
+            print(f"{name:>10}: {seconds:.2f}s, {60 * len(paths) / seconds:.0f} takes/min, "
+                  f"{size / seconds / 1e6:.1f} MB/s, {loaded} frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+File: benchmarkReceiver.py
+
+Description:
+Throughput benchmark for the file receiver (fileReceiver.py). The receiver is
+started on localhost in a separate process and driven by a number of simulated
+Live Link Face senders (see filesSender.py), each sending takes of one CSV and
+one MOV, the way the iPhone does after /Transport. The benchmark is repeated
+for every concurrency level, with a fresh receiver each time.
+
+For every level it reports the throughput in MB/s, the p50/p99 time-to-disk
+(from the start of a send until the file appears under its final name) per
+file type, and the peak RSS of the receiver process. The results are written
+to a JSON file, and a previous results file can be given to compare against.
+
+Usage:
+    python -m src.liveLinkTest.benchmarkReceiver --concurrency 1 4 16 --takes 32 --mov-mb 50
+    python -m src.liveLinkTest.benchmarkReceiver --compare output/benchmarks/receiver_<previous>.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.liveLinkTest.filesSender import send_bytes
+
+TOKEN_SIZE = 32
+DEFAULT_CSV = os.path.join(os.path.dirname(__file__), "..", "..", "output_file.txt")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_receivers(csv_port, mov_port, csv_path, mov_path, memory_budget):
+    """
+    Process target running the CSV and MOV receivers, with their output silenced.
+    """
+    import fileReceiver
+
+    sys.stdout = open(os.devnull, 'w')
+    asyncio.run(serve_receivers(fileReceiver, csv_port, mov_port, csv_path, mov_path, memory_budget))
+
+
+async def serve_receivers(fileReceiver, csv_port, mov_port, csv_path, mov_path, memory_budget):
+    receivers = [
+        fileReceiver.FileReceiver("127.0.0.1", csv_port, csv_path, "csv", memory_budget),
+        fileReceiver.FileReceiver("127.0.0.1", mov_port, mov_path, "mov", memory_budget),
+    ]
+    await asyncio.gather(*(receiver.serve() for receiver in receivers))
+
+
+def peak_rss_mb(pid):
+    """
+    Return the peak resident set size of a process in MB, or None if unknown.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class DiskWatcher:
+    """
+    Class DiskWatcher records when each benchmark file appears under its final name.
+
+    Description:
+    Every payload ends with a unique token, so the watcher can tell which send a
+    file belongs to without depending on the names the receiver chooses.
+    """
+    def __init__(self, directories, interval=0.002):
+        self.directories = directories
+        self.interval = interval
+        self.seen = set()
+        self.arrivals = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.scan()
+            time.sleep(self.interval)
+        self.scan()
+
+    def scan(self):
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.startswith(".") or not name.endswith((".csv", ".mov")) or path in self.seen:
+                        continue
+                    arrived = time.perf_counter()
+                    try:
+                        with open(path, 'rb') as f:
+                            f.seek(-TOKEN_SIZE, os.SEEK_END)
+                            token = f.read(TOKEN_SIZE)
+                    except OSError:
+                        continue
+                    self.seen.add(path)
+                    self.arrivals[token] = arrived
+
+    def wait_for(self, count, timeout):
+        deadline = time.perf_counter() + timeout
+        while len(self.arrivals) < count and time.perf_counter() < deadline:
+            time.sleep(self.interval)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_level(concurrency, takes, csv_data, mov_size, memory_budget, timeout):
+    """
+    Benchmark a fresh receiver with the given number of concurrent senders.
+    """
+    with tempfile.TemporaryDirectory(prefix="receiver_bench_") as work_dir:
+        csv_path = os.path.join(work_dir, "csv")
+        mov_path = os.path.join(work_dir, "mov")
+        csv_port, mov_port = free_port(), free_port()
+        process = multiprocessing.Process(target=run_receivers, args=(csv_port, mov_port, csv_path, mov_path, memory_budget), daemon=True)
+        process.start()
+        for port in (csv_port, mov_port):
+            deadline = time.perf_counter() + 10
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.perf_counter() > deadline:
+                        raise RuntimeError("The receiver did not start")
+                    time.sleep(0.05)
+
+        mov_base = os.urandom(mov_size)
+        watcher = DiskWatcher([csv_path, mov_path])
+        watcher.thread.start()
+        sends = {}
+
+        def send_take(_):
+            for kind, port, base in (("csv", csv_port, csv_data), ("mov", mov_port, mov_base)):
+                token = uuid.uuid4().hex.encode("ascii")
+                payload = base + token
+                start = time.perf_counter()
+                # A fresh name per take keeps the "_rerecorded" suffixes from piling up
+                send_bytes("127.0.0.1", port, b"COMMAND:FILE!bench_" + token)
+                send_bytes("127.0.0.1", port, payload)
+                sends[token] = (kind, start, len(payload))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send_take, range(takes)))
+        watcher.wait_for(len(sends), timeout)
+        watcher.stopped.set()
+        watcher.thread.join()
+
+        peak_rss = peak_rss_mb(process.pid)
+        for port in (csv_port, mov_port):
+            send_bytes("127.0.0.1", port, b"COMMAND:CLOSE!")
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
+
+    latencies = {"csv": [], "mov": []}
+    total_bytes = 0
+    last_arrival = start
+    for token, (kind, sent, size) in sends.items():
+        if token in watcher.arrivals:
+            latencies[kind].append(1000 * (watcher.arrivals[token] - sent))
+            total_bytes += size
+            last_arrival = max(last_arrival, watcher.arrivals[token])
+    seconds = last_arrival - start
+
+    return {
+        "concurrency": concurrency,
+        "transfers": len(sends),
+        "completed": sum(len(v) for v in latencies.values()),
+        "bytes": total_bytes,
+        "seconds": seconds,
+        "mb_per_s": total_bytes / max(seconds, 1e-9) / 1e6,
+        "time_to_disk_ms": {
+            kind: {"p50": percentile(values, 50), "p99": percentile(values, 99)}
+            for kind, values in latencies.items()
+        },
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def compare(results, previous):
+    """
+    Print the change in throughput and p99 time-to-disk against a previous run.
+    """
+    old_levels = {level["concurrency"]: level for level in previous["levels"]}
+    for level in results["levels"]:
+        old = old_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        print(f"concurrency {level['concurrency']}: {old['mb_per_s']:.1f} -> {level['mb_per_s']:.1f} MB/s "
+              f"({100 * (level['mb_per_s'] / max(old['mb_per_s'], 1e-9) - 1):+.1f}%)")
+        for kind, stats in level["time_to_disk_ms"].items():
+            old_p99 = old["time_to_disk_ms"].get(kind, {}).get("p99")
+            if stats["p99"] is not None and old_p99 is not None:
+                print(f"    {kind} p99 time-to-disk: {old_p99:.1f} -> {stats['p99']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Live Link Face file receiver on localhost.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="Numbers of concurrent senders")
+    parser.add_argument('--takes', type=int, default=32, help="Takes (one CSV and one MOV) per concurrency level")
+    parser.add_argument('--csv', default=DEFAULT_CSV, help="CSV file used as the blendshape payload")
+    parser.add_argument('--mov-mb', type=float, default=50, help="Size of the synthetic MOV payload in MB")
+    parser.add_argument('--memory-budget', type=int, default=64 * 1024 * 1024, help="Memory budget of the receivers in bytes")
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds to wait for the files to reach the disk")
+    parser.add_argument('--output', default=None, help="Results file, by default output/benchmarks/receiver_<time>.json")
+    parser.add_argument('--compare', default=None, help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    with open(args.csv, 'rb') as f:
+        csv_data = f.read()
+    mov_size = int(args.mov_mb * 1e6)
+
+    results = {
+        "benchmark": "receiver",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "settings": {"takes": args.takes, "csv_bytes": len(csv_data), "mov_bytes": mov_size, "memory_budget": args.memory_budget},
+        "levels": [],
+    }
+    for concurrency in args.concurrency:
+        level = run_level(concurrency, args.takes, csv_data, mov_size, args.memory_budget, args.timeout)
+        results["levels"].append(level)
+        ttd = level["time_to_disk_ms"]
+        print(f"concurrency {concurrency:3d}: {level['mb_per_s']:8.1f} MB/s, "
+              f"csv p50/p99 {ttd['csv']['p50'] or 0:.1f}/{ttd['csv']['p99'] or 0:.1f} ms, "
+              f"mov p50/p99 {ttd['mov']['p50'] or 0:.1f}/{ttd['mov']['p99'] or 0:.1f} ms, "
+              f"peak RSS {level['peak_rss_mb'] or 0:.1f} MB, {level['completed']}/{level['transfers']} files")
+
+    output = args.output or os.path.join("output", "benchmarks", f"receiver_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
 import socket
 import struct
+import os
+import time
+import hashlib
+import src.utils.transferProtocol as tp
 
 def send_file(server_ip, server_port, file_path):
     # Read the contents of the file
     with open(file_path, 'rb') as file:
         file_content = file.read()
 
+    send_bytes(server_ip, server_port, file_content)
+    print("File sent successfully.")
+
+def send_bytes(server_ip, server_port, file_content):
+    """
+    Send a file that is already in memory, the way the Live Link Face app does.
+    """
     # Get the total size of the file
     total_size = len(file_content)
 
@@ -22,13 +33,81 @@ def send_file(server_ip, server_port, file_path):
         # Send the contents of the file
         client_socket.sendall(file_content)
 
-        print("File sent successfully.")
-
     finally:
         # Close the socket
         client_socket.close()
 
+def recv_status(client_socket):
+    """
+    Receive a status frame from the receiver, or None if the connection closed.
+    """
+    data = b""
+    while len(data) < tp.STATUS.size:
+        packet = client_socket.recv(tp.STATUS.size - len(data))
+        if not packet:
+            return None
+        data += packet
+    return tp.STATUS.unpack(data)
+
+def send_file_chunked(server_ip, server_port, file_path, chunk_size=tp.DEFAULT_CHUNK_SIZE, upload_id=None, max_retries=5, retry_delay=1.0):
+    """
+    Send a file with the resumable chunked protocol of the file receiver.
+
+    Args:
+    - file_path: The file to send.
+    - chunk_size: The number of bytes covered by each CRC.
+    - upload_id: Identifies the upload when resuming, by default derived from the file.
+    - max_retries: The number of times to reconnect after a failed attempt.
+    - retry_delay: The number of seconds to wait before reconnecting.
+
+    Description:
+    When the connection drops or a chunk is rejected, the sender reconnects and
+    the receiver tells it the offset to continue from, so only the missing part
+    of the file is sent again.
+
+    Returns:
+    True if the receiver confirmed the complete file, False otherwise.
+    """
+    total_size = os.path.getsize(file_path)
+    if upload_id is None:
+        stat = os.stat(file_path)
+        key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        upload_id = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            print(f"Retrying upload '{upload_id}' ({attempt}/{max_retries})...")
+            time.sleep(retry_delay)
+        try:
+            with socket.create_connection((server_ip, server_port)) as client_socket, open(file_path, 'rb') as file:
+                client_socket.sendall(tp.pack_upload_header(total_size, chunk_size, upload_id))
+                status = recv_status(client_socket)
+                if status is None or status[0] != tp.STATUS_RESUME:
+                    continue
+
+                offset = status[1]
+                if offset:
+                    print(f"Resuming upload '{upload_id}' at {offset} of {total_size} bytes")
+                file.seek(offset)
+                while offset < total_size:
+                    chunk = file.read(chunk_size)
+                    client_socket.sendall(tp.pack_chunk_header(offset, chunk))
+                    client_socket.sendall(chunk)
+                    offset += len(chunk)
+
+                status = recv_status(client_socket)
+                if status is not None and status[0] == tp.STATUS_DONE:
+                    print("File sent successfully.")
+                    return True
+                print(f"Upload '{upload_id}' was not confirmed: {status}")
+        except OSError as e:
+            print(f"Upload '{upload_id}' interrupted: {e}")
+
+    return False
+
 if __name__ == "__main__":
+    # Run from the repository root with: python -m src.liveLinkTest.filesSender
     # Replace '127.0.0.1' and 9000 with the IP address and port where your server is running
     # Replace 'path/to/your/file' with the actual path to the file you want to send
     send_file("192.168.0.180", 8007, r"C:\Users\VICON\Desktop\Code\Glex\GLEX_Controller\src\liveLinkTest\blabla.txt")
+    # send_file_chunked("192.168.0.180", 8010, r"C:\Users\VICON\Desktop\Code\Glex\GLEX_Controller\src\liveLinkTest\blabla.txt")
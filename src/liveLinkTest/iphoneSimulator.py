@@ -0,0 +1,343 @@
+"""
+File: iphoneSimulator.py
+
+Description:
+Simulates one or more iPhones running Live Link Face, so the OSC server
+(LiveLinkFaceServer) and the file receivers (fileReceiver.py) can be tested and
+load tested without a phone on the studio network. Every simulated phone
+listens for OSC on its own address and implements the part of the Live Link
+Face OSC protocol the project uses:
+
+- /OSCSetSendTarget <ip> <port>: answers /OSCSetSendTargetConfirm, and sends all
+  replies to that address. Like the app, a phone answers nothing before it has
+  a send target.
+- /Slate <name>, /RecordStart <slate> <take>: answers /RecordStartConfirm <timecode>.
+- /RecordStop: answers /RecordStopConfirm <timecode> <csv path> <mov path>.
+- /BatteryQuery: answers /Battery <level>.
+- /Transport <ip:port> <path>: pushes the file over TCP the way the app does
+  (an int32 size followed by the file, see filesSender.send_bytes).
+- /VideoDisplayOn, /AddLiveLinkAddress, /LiveLinkStreamStart: accepted and ignored.
+
+The files of a take are generated when they are transported: a CSV with 61
+smoothly moving channels at 60 fps over the recorded duration (or a fixed
+length), and a MOV of a fixed size that starts with a QuickTime "ftyp" atom.
+Every take has unique content, so the deduplication of the receiver does not
+skew a load test. Every phone can delay messages (one way latency with
+jitter) and drop datagrams in both directions.
+
+All phones run on one asyncio event loop. On Linux every address in
+127.0.0.0/8 is local, so phones get their own IP (127.0.0.10, 127.0.0.11, ...)
+and can all use the Live Link Face port, as on the studio network.
+
+With --drive, the simulator also plays the controller: it sends the record
+commands of a number of takes to the OSC server, and reports how many takes
+the phones recorded and transported.
+
+Usage:
+    python -m src.liveLinkTest.iphoneSimulator --phones 1 --ip 127.0.0.10 --port 8006
+    python -m src.liveLinkTest.iphoneSimulator --phones 4 --latency 20 --jitter 5 --loss 0.02 --mov-mb 20 --drive 50 --server 127.0.0.1:8005
+
+Classes:
+- PhoneOptions: Latency, loss and file sizes of a simulated phone.
+- SimulatedPhone: One simulated iPhone.
+"""
+import argparse
+import asyncio
+import ipaddress
+import os
+import random
+import time
+from collections import Counter
+
+import numpy as np
+from pythonosc.osc_message import OscMessage, ParseError
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from src.liveLinkTest.filesSender import send_bytes
+from src.utils.blendshapeLoader import BlendshapeTake, DEFAULT_FPS, format_take
+from src.utils.liveLinkStream import CHANNEL_NAMES
+from src.utils.reliableOSC import ReliableOSCClient
+
+DEFAULT_PORT = 8006
+STORAGE = "/var/mobile/Containers/Data/Application/LiveLinkFace/Documents/"
+MOV_HEADER = b"\x00\x00\x00\x14ftypqt  \x00\x00\x00\x00qt  "
+MOV_BLOCK = 1 << 20
+
+
+class PhoneOptions:
+    """
+    Class PhoneOptions holds the behaviour of a simulated phone.
+
+    Attributes:
+    - latency, jitter: One way delay of every message in seconds, and its random spread.
+    - loss: Probability that a datagram is dropped, in either direction.
+    - csv_seconds: Length of the CSV of every take, None for the recorded duration.
+    - mov_bytes: Size of the MOV of every take.
+    - battery: The battery level reported.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, csv_seconds=None, mov_bytes=5 * MOV_BLOCK, battery=0.8):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.csv_seconds = csv_seconds
+        self.mov_bytes = mov_bytes
+        self.battery = battery
+
+
+class SimulatedPhone(asyncio.DatagramProtocol):
+    """
+    Class SimulatedPhone answers the OSC messages of the OSC server like Live Link Face.
+
+    Description:
+    Every received datagram is handled after the simulated latency, and every
+    reply is sent after it as well. Takes are remembered by the paths reported
+    in /RecordStopConfirm, and generated when /Transport asks for them.
+
+    Attributes:
+    - name: The name of the phone in the output.
+    - address: The (ip, port) the phone listens on.
+    - options: The PhoneOptions.
+    - target: Where the replies go, set by /OSCSetSendTarget.
+    - stats: Counter of received, dropped and sent messages, takes and transports.
+    """
+    def __init__(self, name, address, options, seed=None):
+        self.name = name
+        self.address = address
+        self.options = options
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.transport = None
+        self.target = None
+        self.slate = "NoSlate"
+        self.take = 0
+        self.record_start = None
+        self.takes = {}
+        self.transports = asyncio.Lock()
+        self.stats = Counter()
+        self.handlers = {
+            "/OSCSetSendTarget": self.set_send_target,
+            "/Slate": self.set_slate,
+            "/RecordStart": self.record_start_command,
+            "/RecordStop": self.record_stop_command,
+            "/BatteryQuery": self.battery_query,
+            "/Transport": self.transport_command,
+        }
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def delay(self):
+        return max(0.0, self.options.latency + self.random.uniform(-self.options.jitter, self.options.jitter))
+
+    def dropped(self):
+        return self.random.random() < self.options.loss
+
+    def datagram_received(self, data, addr):
+        if self.dropped():
+            self.stats["dropped_in"] += 1
+            return
+        try:
+            message = OscMessage(data)
+        except ParseError:
+            self.stats["bad_messages"] += 1
+            return
+        self.stats["received"] += 1
+        handler = self.handlers.get(message.address)
+        if handler is not None:
+            asyncio.get_running_loop().call_later(self.delay(), handler, addr, *message.params)
+
+    def reply(self, addr, address, *args):
+        """
+        Send a message to the send target after the latency.
+        """
+        if self.target is None:
+            self.stats["unanswered"] += 1
+            return
+        if self.dropped():
+            self.stats["dropped_out"] += 1
+            return
+        builder = OscMessageBuilder(address=address)
+        for arg in args:
+            builder.add_arg(arg)
+        data = builder.build().dgram
+
+        def send():
+            self.transport.sendto(data, self.target)
+            self.stats["sent"] += 1
+        asyncio.get_running_loop().call_later(self.delay(), send)
+
+    def timecode(self):
+        seconds = time.time() % 86400
+        return f"{int(seconds // 3600):02d}:{int(seconds // 60 % 60):02d}:{int(seconds % 60):02d}:" \
+               f"{int(seconds % 1 * DEFAULT_FPS):02d}.000"
+
+    def set_send_target(self, addr, ip, port, *args):
+        self.target = (ip, int(port))
+        self.reply(addr, "/OSCSetSendTargetConfirm")
+
+    def set_slate(self, addr, slate, *args):
+        self.slate = str(slate)
+
+    def record_start_command(self, addr, slate=None, take=None, *args):
+        if slate is not None:
+            self.slate = str(slate)
+        if take is not None:
+            self.take = int(take)
+        self.record_start = time.time()
+        self.reply(addr, "/RecordStartConfirm", self.timecode())
+
+    def record_stop_command(self, addr, *args):
+        if self.record_start is None:
+            # A resent stop for a take that already stopped
+            return
+        duration = time.time() - self.record_start
+        name = f"{self.slate}_{self.take}_{self.name}"
+        csv_path, mov_path = STORAGE + name + ".csv", STORAGE + name + ".mov"
+        take = (self.record_start % 86400, duration, self.rng.integers(1 << 62))
+        self.takes[csv_path] = ("csv",) + take
+        self.takes[mov_path] = ("mov",) + take
+        self.record_start = None
+        self.stats["takes"] += 1
+        self.reply(addr, "/RecordStopConfirm", self.timecode(), csv_path, mov_path)
+
+    def battery_query(self, addr, *args):
+        self.reply(addr, "/Battery", float(self.options.battery))
+
+    def transport_command(self, addr, destination, path, *args):
+        asyncio.get_running_loop().create_task(self.push_file(destination, path))
+
+    def make_csv(self, start, duration, seed):
+        frames = max(1, int(round((self.options.csv_seconds or duration) * DEFAULT_FPS)))
+        rng = np.random.default_rng(seed)
+        steps = rng.normal(0.0, 0.01, (frames, len(CHANNEL_NAMES)))
+        values = np.clip(rng.random(len(CHANNEL_NAMES)) + np.cumsum(steps, axis=0), 0.0, 1.0).astype(np.float32)
+        timecodes = start + np.arange(frames) / DEFAULT_FPS
+        return format_take(BlendshapeTake(CHANNEL_NAMES, timecodes, values)).encode("utf-8")
+
+    def make_mov(self, seed):
+        block = np.random.default_rng(seed).bytes(MOV_BLOCK)
+        data = bytearray(MOV_HEADER)
+        while len(data) < self.options.mov_bytes:
+            data += block
+        return bytes(data[:max(self.options.mov_bytes, len(MOV_HEADER))])
+
+    async def push_file(self, destination, path):
+        """
+        Generate a file of a take and send it to "ip:port" over TCP, one transport at a time.
+        """
+        take = self.takes.get(path)
+        if take is None:
+            print(f"[{self.name}] Unknown file to transport: {path}")
+            self.stats["transport_errors"] += 1
+            return
+        kind, start, duration, seed = take
+        ip, port = destination.rsplit(":", 1)
+        async with self.transports:
+            data = await asyncio.to_thread(self.make_csv, start, duration, seed) if kind == "csv" else \
+                await asyncio.to_thread(self.make_mov, seed)
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(send_bytes, ip, int(port), data)
+            except OSError as e:
+                print(f"[{self.name}] Transport of {os.path.basename(path)} to {destination} failed: {e}")
+                self.stats["transport_errors"] += 1
+                return
+            self.stats["transports"] += 1
+            self.stats["bytes_sent"] += len(data)
+            self.stats["transport_ms"] += int(1000 * (time.perf_counter() - started))
+
+
+async def start_phones(count, first_ip, port, options, seed=None):
+    """
+    Start count phones on consecutive IP addresses.
+
+    Returns:
+    The SimulatedPhones.
+    """
+    loop = asyncio.get_running_loop()
+    phones = []
+    for i in range(count):
+        ip = str(ipaddress.ip_address(first_ip) + i)
+        phone = SimulatedPhone(f"phone{i}", (ip, port), options, None if seed is None else seed + i)
+        await loop.create_datagram_endpoint(lambda phone=phone: phone, local_addr=(ip, port))
+        phones.append(phone)
+        print(f"[{phone.name}] Listening on {ip}:{port}")
+    return phones
+
+
+async def drive(server, takes, take_seconds, pause, timeout=0.25, retries=3):
+    """
+    Send the record commands of a number of takes to the OSC server, like the controller.
+
+    Returns:
+    The ReliableOSCClient with the delivery metrics.
+    """
+    client = ReliableOSCClient(server[0], server[1], timeout, retries, listen=True)
+    for take in range(takes):
+        gloss = f"SIM{take:05d}"
+        client.send_message("/SendFileNameToTCP", [gloss])
+        client.send_message("/SetFileName", [gloss])
+        await asyncio.sleep(pause)
+        start = client.send_reliable("/RecordStart")
+        await asyncio.sleep(take_seconds)
+        stop = client.send_reliable("/RecordStop")
+        await asyncio.to_thread(start.wait, 5)
+        await asyncio.to_thread(stop.wait, 5)
+        await asyncio.sleep(pause)
+    return client
+
+
+def print_stats(phones):
+    for phone in phones:
+        stats = phone.stats
+        mb = stats["bytes_sent"] / 1e6
+        seconds = stats["transport_ms"] / 1000
+        print(f"[{phone.name}] {stats['received']} received, {stats['dropped_in']}/{stats['dropped_out']} dropped in/out, "
+              f"{stats['takes']} takes, {stats['transports']} transports ({mb:.1f} MB, "
+              f"{mb / seconds if seconds else 0:.1f} MB/s), {stats['transport_errors']} transport errors")
+
+
+async def run(args):
+    options = PhoneOptions(args.latency / 1000, args.jitter / 1000, args.loss, args.csv_seconds,
+                           int(args.mov_mb * 1e6), args.battery)
+    phones = await start_phones(args.phones, args.ip, args.port, options, args.seed)
+    try:
+        if args.drive:
+            ip, port = args.server.rsplit(":", 1)
+            client = await drive((ip, int(port)), args.drive, args.take_seconds, args.pause)
+            # Let the last transports finish
+            await asyncio.sleep(args.settle)
+            client.print_stats()
+        else:
+            await asyncio.Event().wait()
+    finally:
+        print_stats(phones)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate iPhones running Live Link Face.")
+    parser.add_argument('--phones', type=int, default=1, help="Number of simulated phones")
+    parser.add_argument('--ip', default="127.0.0.10", help="IP of the first phone, the others get the following IPs")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="OSC port of the phones (llf_udp_port)")
+    parser.add_argument('--latency', type=float, default=0.0, help="One way latency in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random spread of the latency in ms")
+    parser.add_argument('--loss', type=float, default=0.0, help="Probability that a datagram is dropped")
+    parser.add_argument('--csv-seconds', type=float, default=None, help="Length of every CSV, by default the recorded duration")
+    parser.add_argument('--mov-mb', type=float, default=5.0, help="Size of every MOV in MB")
+    parser.add_argument('--battery', type=float, default=0.8, help="Battery level reported")
+    parser.add_argument('--seed', type=int, default=None, help="Seed of the latency, loss and file content")
+    parser.add_argument('--drive', type=int, default=0, help="Record this many takes through the OSC server")
+    parser.add_argument('--server', default="127.0.0.1:8005", help="OSC server to drive (target_ip:target_port)")
+    parser.add_argument('--take-seconds', type=float, default=2.0, help="Duration of every driven take")
+    parser.add_argument('--pause', type=float, default=0.5, help="Seconds between the commands of driven takes")
+    parser.add_argument('--settle', type=float, default=5.0, help="Seconds to wait for the transports after driving")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+File: blendshapeBinary.py
+
+Description:
+This file defines a compact binary form of a blendshape take, written next to
+the CSV as a sidecar (<name>.bshp). The CSV stores every value as text with 10
+decimals; the binary form stores them as float32, or quantized to uint16 per
+channel, and can be memory mapped, so any frame is read without parsing the
+rest of the take.
+
+Layout (little endian, all sections aligned to 64 bytes):
+- Header (HEADER): magic, version, dtype, frame count, channel count, fps and
+  the offsets of the sections below.
+- Channel names: utf-8, separated by newlines.
+- Timecodes: float64 per frame, the timecode in seconds (see blendshapeLoader.py).
+- Quantization: float32 offset and scale per channel, only for uint16 data.
+- Values: frames x channels, float32 or uint16 in row major order.
+
+Classes:
+- BinaryTake: A memory mapped binary take.
+
+Functions:
+- write_binary(path, take, dtype): Write a BlendshapeTake in the binary form.
+- open_binary(path): Memory map a binary take.
+- sidecar_path(csv_path): The path of the sidecar of a CSV file.
+- write_sidecar(csv_path, dtype): Convert a received CSV into its sidecar.
+"""
+import os
+import struct
+
+import numpy as np
+
+from src.utils.blendshapeLoader import BlendshapeTake, load_take
+
+MAGIC = b"BSHP"
+VERSION = 1
+SUFFIX = ".bshp"
+ALIGNMENT = 64
+# magic, version, dtype, frames, channels, fps, names, timecodes, quantization and values offsets
+HEADER = struct.Struct("<4sHHIIdQQQQ")
+DTYPES = {"float32": (0, np.float32), "uint16": (1, np.uint16)}
+DTYPE_CODES = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+# Largest quantized value, the quantization error is at most half a step
+QUANTIZATION_LEVELS = 65535
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def sidecar_path(csv_path):
+    return os.path.splitext(csv_path)[0] + SUFFIX
+
+
+def quantize(values):
+    """
+    Quantize each channel to uint16 over its own range.
+
+    Returns:
+    The uint16 values, and the float32 offset and scale per channel.
+    """
+    low = values.min(axis=0) if len(values) else np.zeros(values.shape[1], np.float32)
+    high = values.max(axis=0) if len(values) else low
+    scale = ((high - low) / QUANTIZATION_LEVELS).astype(np.float32)
+    scale[scale == 0] = 1.0
+    q = np.rint((values - low) / scale)
+    return np.clip(q, 0, QUANTIZATION_LEVELS).astype(np.uint16), low.astype(np.float32), scale
+
+
+def write_binary(path, take, dtype="float32"):
+    """
+    Write a take in the binary form.
+
+    Args:
+    - path (str): The file to write, replaced atomically.
+    - take (BlendshapeTake): The take to write.
+    - dtype (str): "float32", or "uint16" to quantize the channels.
+    """
+    code, _ = DTYPES[dtype]
+    values = np.ascontiguousarray(take.values, dtype=np.float32)
+    frames, channels = values.shape
+    names = "\n".join(take.names).encode("utf-8")
+
+    names_offset = aligned(HEADER.size)
+    timecodes_offset = aligned(names_offset + len(names))
+    quantization_offset = aligned(timecodes_offset + 8 * frames)
+    if dtype == "uint16":
+        data, low, scale = quantize(values)
+        values_offset = aligned(quantization_offset + 8 * channels)
+    else:
+        data = values
+        values_offset = quantization_offset
+
+    header = HEADER.pack(MAGIC, VERSION, code, frames, channels, float(take.fps),
+                         names_offset, timecodes_offset, quantization_offset, values_offset)
+    temp_path = path + ".part"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.seek(names_offset)
+        f.write(names)
+        f.seek(timecodes_offset)
+        f.write(np.ascontiguousarray(take.timecodes, dtype="<f8").tobytes())
+        if dtype == "uint16":
+            f.seek(quantization_offset)
+            f.write(low.astype("<f4").tobytes())
+            f.write(scale.astype("<f4").tobytes())
+        f.seek(values_offset)
+        f.write(data.astype(data.dtype.newbyteorder("<")).tobytes())
+    os.replace(temp_path, path)
+
+
+class BinaryTake:
+    """
+    Class BinaryTake gives random access to a binary take through memory maps.
+
+    Attributes:
+    - names: The names of the channels.
+    - fps: The frame rate of the take.
+    - timecodes: Memory mapped float64 timecodes in seconds.
+    - data: Memory mapped stored values, float32 or uint16.
+    - low, scale: The quantization of each channel, None for float32 data.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            (magic, version, code, frames, channels, fps,
+             names_offset, timecodes_offset, quantization_offset, values_offset) = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} blendshape binary")
+            f.seek(names_offset)
+            names = f.read(timecodes_offset - names_offset).rstrip(b"\0")
+            self.names = names.decode("utf-8").split("\n") if names else []
+            self.low = self.scale = None
+            if DTYPE_CODES[code][0] == "uint16":
+                f.seek(quantization_offset)
+                self.low = np.frombuffer(f.read(4 * channels), dtype="<f4")
+                self.scale = np.frombuffer(f.read(4 * channels), dtype="<f4")
+
+        self.path = path
+        self.fps = fps
+        dtype = np.dtype(DTYPE_CODES[code][1]).newbyteorder("<")
+        if frames:
+            self.timecodes = np.memmap(path, dtype="<f8", mode='r', offset=timecodes_offset, shape=(frames,))
+            self.data = np.memmap(path, dtype=dtype, mode='r', offset=values_offset, shape=(frames, channels))
+        else:
+            self.timecodes = np.zeros(0, dtype=np.float64)
+            self.data = np.zeros((0, channels), dtype=dtype)
+
+    def __len__(self):
+        return len(self.data)
+
+    def values(self, start=0, stop=None):
+        """
+        Return the float32 values of frames start to stop.
+        """
+        data = self.data[start:stop]
+        if self.scale is None:
+            return np.asarray(data, dtype=np.float32)
+        return (data * self.scale + self.low).astype(np.float32)
+
+    def frame(self, index):
+        return self.values(index, index + 1 if index != -1 else None)[0]
+
+    def to_take(self):
+        return BlendshapeTake(self.names, np.array(self.timecodes), self.values(), self.fps)
+
+
+def open_binary(path):
+    return BinaryTake(path)
+
+
+def write_sidecar(csv_path, dtype="float32"):
+    """
+    Convert a received CSV file into its binary sidecar.
+
+    Returns:
+    The path of the sidecar.
+    """
+    path = sidecar_path(csv_path)
+    write_binary(path, load_take(csv_path), dtype)
+    return path
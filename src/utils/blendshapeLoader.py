@@ -0,0 +1,373 @@
+"""
+File: blendshapeLoader.py
+
+Description:
+This file loads the blendshape CSV files recorded by Live Link Face into NumPy
+arrays. A take starts with a header line, followed by one line per frame:
+
+    Timecode,BlendshapeCount,EyeBlinkLeft,...,RightEyeRoll
+    21:22:27:33.353,61,0.081086,...
+
+The timecode is hours:minutes:seconds:frame, where the frame has a fractional
+subframe. The whole body of the file is parsed in a single vectorized pass:
+the ':' and newline separators are turned into commas, so the file becomes one
+flat list of numbers of 4 + 1 + 61 values per frame, which NumPy parses in C
+and reshapes into a (frames, 66) array.
+
+A take that is still arriving can be parsed block by block with StreamParser,
+so its frames and quality summary are ready as soon as the last byte is in.
+
+Classes:
+- BlendshapeTake: The channel names, timecodes and values of a take.
+- StreamParser: Incremental parser fed with the chunks of a CSV.
+- ParsingFile: File wrapper that feeds everything written through it to a StreamParser.
+
+Functions:
+- load_take(path, fps): Load a take from a CSV file.
+- parse_take(data, fps): Parse the bytes of a CSV file.
+- parse_rows(body, channels): Parse the frame lines of a CSV file.
+- timecode_seconds(fields, fps): Convert timecode fields to seconds.
+- count_dropped(timecodes, fps, previous): Count the frames missing between timecodes.
+- format_timecodes(timecodes, fps): Convert seconds to "HH:MM:SS:FF.mmm" timecodes.
+- format_take(take): The text of a BlendshapeTake as a Live Link Face CSV.
+- save_take(path, take): Write a BlendshapeTake as a Live Link Face CSV.
+- find_takes(directories): The paths of the CSV takes below directories.
+- line_spans(data, start): The byte ranges of the non-empty lines of a CSV.
+"""
+import os
+import warnings
+
+import numpy as np
+
+CHANNEL_COUNT = 61
+DEFAULT_FPS = 60
+# hours, minutes, seconds and frame of the timecode, then BlendshapeCount
+TIMECODE_FIELDS = 4
+LEADING_FIELDS = TIMECODE_FIELDS + 1
+# A directory with this file holds takes derived from others, such as resampled copies
+DERIVED_MARKER = ".derived"
+
+
+class BlendshapeTake:
+    """
+    Class BlendshapeTake holds the parsed content of a blendshape CSV.
+
+    Attributes:
+    - names: The names of the channels, in the order of the columns.
+    - timecodes: float64 array of shape (frames,), the timecode of each frame in seconds.
+    - values: float32 array of shape (frames, channels) with the channel values.
+    - fps: The frame rate used to convert the frame part of the timecodes.
+    """
+    def __init__(self, names, timecodes, values, fps=DEFAULT_FPS):
+        self.names = names
+        self.timecodes = timecodes
+        self.values = values
+        self.fps = fps
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def duration(self):
+        return float(self.timecodes[-1] - self.timecodes[0]) if len(self.timecodes) else 0.0
+
+
+def timecode_seconds(fields, fps=DEFAULT_FPS):
+    """
+    Convert (frames, 4) hours, minutes, seconds and frame fields to seconds.
+    """
+    fields = np.asarray(fields, dtype=np.float64)
+    return fields[:, 0] * 3600 + fields[:, 1] * 60 + fields[:, 2] + fields[:, 3] / fps
+
+
+def parse_rows(body, channels=CHANNEL_COUNT):
+    """
+    Parse the frame lines of a blendshape CSV.
+
+    Args:
+    - body (bytes): Complete frame lines, without the header.
+    - channels (int): The number of channels per frame.
+
+    Description:
+    All separators are turned into commas and the result is parsed as one flat
+    array. If the number of values does not add up, for example because of a
+    truncated last line, the lines are parsed one by one and the malformed
+    lines are skipped.
+
+    Returns:
+    float64 array of shape (frames, 5 + channels): the timecode fields, the
+    blendshape count and the channel values.
+    """
+    width = LEADING_FIELDS + channels
+    body = body.strip()
+    flat = body.replace(b"\r", b"").replace(b":", b",").replace(b"\n", b",")
+    try:
+        with warnings.catch_warnings():
+            # NumPy only warns when it stops at data it cannot parse
+            warnings.simplefilter("error")
+            values = np.fromstring(flat, dtype=np.float64, sep=",")
+        if values.size % width == 0 and values.size // width == body.count(b"\n") + 1:
+            return values.reshape(-1, width)
+    except (ValueError, DeprecationWarning):
+        pass
+
+    rows = []
+    for line in body.splitlines():
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                row = np.fromstring(line.replace(b":", b","), dtype=np.float64, sep=",")
+        except (ValueError, DeprecationWarning):
+            continue
+        if row.size == width:
+            rows.append(row)
+    return np.array(rows, dtype=np.float64).reshape(-1, width)
+
+
+def line_spans(data, start):
+    """
+    Return the start and end offsets of the non-empty lines of data after start.
+    """
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    newlines = newlines[newlines >= start]
+    starts = np.concatenate(([start], newlines + 1))
+    ends = np.concatenate((newlines + 1, [len(data)]))
+    keep = (ends - starts) > 2
+    return starts[keep], ends[keep]
+
+
+def format_timecodes(timecodes, fps=DEFAULT_FPS):
+    """
+    Convert timecodes in seconds to "HH:MM:SS:FF.mmm" strings, the inverse of timecode_seconds.
+    """
+    millis = np.rint(np.asarray(timecodes, dtype=np.float64) * fps * 1000).astype(np.int64)
+    frames, millis = np.divmod(millis, 1000)
+    seconds, frames = np.divmod(frames, int(round(fps)))
+    minutes, seconds = np.divmod(seconds, 60)
+    hours, minutes = np.divmod(minutes, 60)
+    return [f"{h:02d}:{m:02d}:{s:02d}:{f:02d}.{ms:03d}" for h, m, s, f, ms in
+            zip(hours.tolist(), minutes.tolist(), seconds.tolist(), frames.tolist(), millis.tolist())]
+
+
+def format_take(take):
+    """
+    Return a take as the text of a CSV in the Live Link Face format.
+    """
+    count = str(len(take.names))
+    lines = [",".join(["Timecode", "BlendshapeCount"] + list(take.names))]
+    for timecode, row in zip(format_timecodes(take.timecodes, take.fps), take.values.tolist()):
+        lines.append(timecode + "," + count + "," + ",".join(map(repr, row)))
+    return "\n".join(lines) + "\n"
+
+
+def save_take(path, take):
+    """
+    Write a take as a CSV in the Live Link Face format.
+    """
+    with open(path, 'w', encoding="utf-8", newline="\n") as f:
+        f.write(format_take(take))
+
+
+def find_takes(directories):
+    """
+    Return the paths of the CSV takes below one or more directories, searched recursively.
+
+    Description:
+    Hidden files, partial transfers (".part") and directories with derived takes
+    (marked with DERIVED_MARKER, and everything below them) are skipped, so the
+    same recording is never checked, archived or indexed twice.
+    """
+    if isinstance(directories, str):
+        directories = [directories]
+    paths = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            if DERIVED_MARKER in files:
+                dirs[:] = []
+                continue
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files)
+                         if name.endswith(".csv") and not name.startswith("."))
+    return paths
+
+
+def count_dropped(timecodes, fps=DEFAULT_FPS, previous=None):
+    """
+    Count the frames missing from a run of timecodes.
+
+    Args:
+    - timecodes: The timecodes in seconds.
+    - fps (int): The frame rate the take was recorded at.
+    - previous (float): The timecode of the frame before the run, if any.
+
+    Returns:
+    The number of frame intervals skipped between consecutive timecodes.
+    """
+    if previous is not None:
+        timecodes = np.concatenate(([previous], timecodes))
+    steps = np.rint(np.diff(timecodes) * fps)
+    return int(np.maximum(steps - 1, 0).sum())
+
+
+def parse_take(data, fps=DEFAULT_FPS):
+    """
+    Parse the bytes of a blendshape CSV into a BlendshapeTake.
+    """
+    header, _, body = data.partition(b"\n")
+    names = header.decode("utf-8").strip().split(",")[2:]
+    rows = parse_rows(body, len(names))
+    return BlendshapeTake(names, timecode_seconds(rows[:, :TIMECODE_FIELDS], fps),
+                          rows[:, LEADING_FIELDS:].astype(np.float32), fps)
+
+
+def load_take(path, fps=DEFAULT_FPS):
+    """
+    Load a blendshape CSV file.
+
+    Args:
+    - path (str): The CSV file written by the file receiver.
+    - fps (int): The frame rate the take was recorded at.
+
+    Returns:
+    A BlendshapeTake with a (frames, 61) float32 array of values.
+    """
+    with open(path, 'rb') as f:
+        return parse_take(f.read(), fps)
+
+
+class StreamParser:
+    """
+    Class StreamParser parses a blendshape CSV from the chunks it arrives in.
+
+    Description:
+    Every chunk is appended to the incomplete last line of the previous one,
+    and all complete lines are parsed at once with parse_rows. The frame
+    count, the duration and the dropped frames are updated with every block.
+    The byte range of every frame line is kept as well, so the timecode index
+    of the take can be written without reading the file again.
+
+    Attributes:
+    - names: The channel names, None until the header line is complete.
+    - frames: The number of frames parsed so far.
+    - dropped: The number of frames missing between the parsed timecodes.
+    - error: The error that stopped the parsing, if any.
+    """
+    def __init__(self, fps=DEFAULT_FPS):
+        self.fps = fps
+        self.error = None
+        self.names = None
+        self.remainder = b""
+        self.timecodes = []
+        self.values = []
+        self.frames = 0
+        self.dropped = 0
+        self.first = None
+        self.last = None
+        # Bytes before the remainder, and the byte ranges of the parsed lines
+        self.consumed = 0
+        self.starts = []
+        self.ends = []
+        self.spans_valid = True
+
+    def feed(self, data):
+        """
+        Parse the complete lines of a chunk.
+
+        Returns:
+        The number of frames parsed from this chunk.
+        """
+        data = self.remainder + bytes(data)
+        offset = self.consumed
+        if self.names is None:
+            header, newline, rest = data.partition(b"\n")
+            if not newline:
+                self.remainder = data
+                return 0
+            self.names = header.decode("utf-8").strip().split(",")[2:]
+            data = rest
+            offset += len(header) + 1
+        cut = data.rfind(b"\n") + 1
+        self.remainder = data[cut:]
+        self.consumed = offset + cut
+        return self.add_rows(data[:cut], offset)
+
+    def close(self):
+        """
+        Parse what is left after the last chunk, a last line without newline.
+        """
+        rest, self.remainder = self.remainder, b""
+        if self.names is None:
+            self.names = rest.decode("utf-8").strip().split(",")[2:]
+            return 0
+        return self.add_rows(rest, self.consumed)
+
+    def add_rows(self, lines, offset=0):
+        if not lines.strip():
+            return 0
+        rows = parse_rows(lines, len(self.names))
+        starts, ends = line_spans(lines, 0)
+        if len(starts) == len(rows):
+            self.starts.append(starts + offset)
+            self.ends.append(ends + offset)
+        else:
+            # Malformed lines were skipped, the lines no longer match the frames
+            self.spans_valid = False
+        if not len(rows):
+            return 0
+        timecodes = timecode_seconds(rows[:, :TIMECODE_FIELDS], self.fps)
+        self.dropped += count_dropped(timecodes, self.fps, self.last)
+        self.first = timecodes[0] if self.first is None else self.first
+        self.last = timecodes[-1]
+        self.timecodes.append(timecodes)
+        self.values.append(rows[:, LEADING_FIELDS:].astype(np.float32))
+        self.frames += len(rows)
+        return len(rows)
+
+    def take(self):
+        """
+        Return the parsed frames as a BlendshapeTake.
+        """
+        names = self.names or []
+        if not self.values:
+            return BlendshapeTake(names, np.zeros(0), np.zeros((0, len(names)), dtype=np.float32), self.fps)
+        return BlendshapeTake(names, np.concatenate(self.timecodes), np.concatenate(self.values), self.fps)
+
+    def spans(self):
+        """
+        Return the start and end byte offsets of the line of every frame, or None if some lines were malformed.
+        """
+        if not self.spans_valid:
+            return None
+        if not self.starts:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return np.concatenate(self.starts).astype(np.int64), np.concatenate(self.ends).astype(np.int64)
+
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "duration": float(self.last - self.first) if self.frames else 0.0,
+            "dropped_frames": self.dropped,
+            "fps": self.fps,
+        }
+
+
+class ParsingFile:
+    """
+    Class ParsingFile wraps a file and parses all data written through it.
+
+    Description:
+    The data is written first, so a take that cannot be parsed is still
+    written completely. The parser then stops and keeps the error.
+    """
+    def __init__(self, f, parser):
+        self.f = f
+        self.parser = parser
+
+    def write(self, data):
+        n = self.f.write(data)
+        if self.parser.error is None:
+            try:
+                self.parser.feed(data)
+            except Exception as e:
+                self.parser.error = e
+        return n
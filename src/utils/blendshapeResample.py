@@ -0,0 +1,130 @@
+"""
+File: blendshapeResample.py
+
+Description:
+Resamples blendshape takes onto the frame clock of the motion capture, so the
+facial and body data line up frame by frame. Shogun records at PAL 100 fps
+(see ViconShogunPost.setPAL100), while Live Link Face records at 60 fps with
+jittery timecodes.
+
+The output frames lie on the target clock: every timecode is a whole multiple
+of 1 / target_fps, within the time range of the take. All channels are
+linearly interpolated at once: a binary search finds the two source frames
+around every output frame, and the values are blended with one weight per
+output frame. Duplicated timecodes and timecodes that go backwards are
+dropped first.
+
+The timecodes of the output keep the frame unit of the recording (60 fps),
+with the fractional subframe holding the position on the target clock, so
+the resampled CSVs read back with load_take and check cleanly with takeQC.
+The output directory is marked as derived (DERIVED_MARKER), so the take
+scanners (takeQC, takeArchive, takeSimilarity) do not pick the copies up.
+
+A whole session is resampled in batch, in a process pool:
+
+    python -m src.utils.blendshapeResample D:\\LiveLinkFace\\LiveLinkFaceCSV\\17-10-2026 --fps 100
+
+Functions:
+- resample(take, target_fps): Resample a BlendshapeTake to a target frame rate.
+- resample_file(csv_path, output_dir, target_fps): Resample a CSV into a new CSV.
+- resample_session(directory, output_dir, target_fps, workers): Resample all CSVs of a session.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.utils.blendshapeLoader import DERIVED_MARKER, BlendshapeTake, load_take, save_take
+
+DEFAULT_TARGET_FPS = 100
+
+
+def monotonic(timecodes):
+    """
+    Return the indices of the frames whose timecode is later than all before it.
+    """
+    return np.flatnonzero(timecodes > np.maximum.accumulate(np.concatenate(([-np.inf], timecodes[:-1]))))
+
+
+def resample(take, target_fps=DEFAULT_TARGET_FPS):
+    """
+    Resample a take to a target frame rate by linear interpolation.
+
+    Args:
+    - take (BlendshapeTake): The take to resample.
+    - target_fps (float): The frame rate of the output, for example 100 for Shogun.
+
+    Returns:
+    A BlendshapeTake with frames on the target clock. Its fps stays that of the
+    input, the unit of the frame part of the timecodes when it is saved.
+    """
+    keep = monotonic(take.timecodes)
+    timecodes, values = take.timecodes[keep], take.values[keep]
+    if len(timecodes) < 2:
+        return BlendshapeTake(take.names, timecodes.copy(), values.copy(), take.fps)
+
+    first = int(np.ceil(timecodes[0] * target_fps - 1e-6))
+    last = int(np.floor(timecodes[-1] * target_fps + 1e-6))
+    target = np.arange(first, last + 1) / target_fps
+
+    # Source frames before and after every output frame, and the weight of the latter
+    after = np.clip(np.searchsorted(timecodes, target, 'right'), 1, len(timecodes) - 1)
+    before = after - 1
+    weight = ((target - timecodes[before]) / (timecodes[after] - timecodes[before])).astype(np.float32)
+    weight = np.clip(weight, 0.0, 1.0)[:, None]
+    resampled = values[before] * (1 - weight) + values[after] * weight
+    return BlendshapeTake(take.names, target, resampled.astype(np.float32), take.fps)
+
+
+def resample_file(csv_path, output_dir, target_fps=DEFAULT_TARGET_FPS):
+    """
+    Resample a CSV and write the result as a CSV with the same name in output_dir.
+
+    Returns:
+    The path of the resampled CSV.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    marker = os.path.join(output_dir, DERIVED_MARKER)
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+    path = os.path.join(output_dir, os.path.basename(csv_path))
+    save_take(path, resample(load_take(csv_path), target_fps))
+    return path
+
+
+def resample_session(directory, output_dir=None, target_fps=DEFAULT_TARGET_FPS, workers=None):
+    """
+    Resample all CSVs in a session directory, in a process pool.
+
+    Args:
+    - directory (str): The session directory, for example a dated LiveLinkFaceCSV folder.
+    - output_dir (str): Where to write the resampled CSVs, by default a
+      "<fps>fps" subdirectory of the session directory, marked as derived.
+
+    Returns:
+    The paths of the resampled CSVs.
+    """
+    output_dir = output_dir or os.path.join(directory, f"{target_fps:g}fps")
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+             if name.endswith(".csv") and not name.startswith(".")]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(resample_file, paths, [output_dir] * len(paths), [target_fps] * len(paths), chunksize=8))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resample Live Link Face takes onto the motion capture frame clock.")
+    parser.add_argument('directory', help="Session directory with the CSV takes")
+    parser.add_argument('--fps', type=float, default=DEFAULT_TARGET_FPS, help="Target frame rate")
+    parser.add_argument('--output', default=None, help="Output directory, by default <directory>/<fps>fps")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes, by default one per core")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = resample_session(args.directory, args.output, args.fps, args.workers)
+    print(f"Resampled {len(paths)} takes to {args.fps:g} fps in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
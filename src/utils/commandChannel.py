@@ -0,0 +1,103 @@
+"""
+File: commandChannel.py
+
+Description:
+This file defines the CommandChannel class, a long-lived TCP connection to one
+of the file receivers that carries "COMMAND:<cmd>!<msg>" messages. Keeping the
+connection open saves a connect and teardown round trip for every command, and
+several commands can be pipelined in a single send.
+
+Classes:
+- CommandChannel: Auto-reconnecting command connection to a single receiver port.
+"""
+import select
+import socket
+import struct
+import threading
+
+
+def frame_command(cmd, extra=""):
+    """
+    Frame a command the way the file receiver expects it.
+
+    Returns:
+    The int32 size of the message followed by the message itself.
+    """
+    message = ("COMMAND:" + cmd + "!" + extra).encode("utf-8")
+    return struct.pack('>I', len(message)) + message
+
+
+class CommandChannel:
+    """
+    Class CommandChannel keeps a command connection to a file receiver open.
+
+    Description:
+    The connection is opened on the first send and reused afterwards. Before
+    every send the channel checks whether the receiver closed the connection
+    (for example because it was restarted), and reconnects if so. A send that
+    fails on a dead connection is retried once on a fresh connection.
+
+    Attributes:
+    - ip: The IP address of the receiver.
+    - port: The port of the receiver.
+    - timeout: The timeout in seconds for connecting and sending.
+    """
+    def __init__(self, ip, port, timeout=2.0):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def send(self, *commands):
+        """
+        Send one or more (cmd, extra) commands in a single write.
+
+        Raises:
+        OSError if the receiver cannot be reached.
+        """
+        data = b"".join(frame_command(*command) for command in commands)
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None or self.is_closed_by_peer():
+                        self.reconnect()
+                    self.sock.sendall(data)
+                    return
+                except OSError:
+                    self.disconnect()
+                    if attempt:
+                        raise
+
+    def reconnect(self):
+        self.disconnect()
+        self.sock = socket.create_connection((self.ip, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def is_closed_by_peer(self):
+        """
+        Check without blocking whether the receiver closed the connection.
+
+        Description:
+        The receiver never writes on a command connection, so a readable socket
+        means it was closed or reset.
+        """
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        """
+        Close the connection, a later send opens a new one.
+        """
+        with self.lock:
+            self.disconnect()
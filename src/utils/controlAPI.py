@@ -13,6 +13,7 @@ stop_record_osc_shogun(): Stops the recording process using OSC and Shogun.
 set_file_name_osc_shogun(file_name): Sets the file name for recording using OSC and Shogun.
 close_osc_iphone(): Closes connections and servers related to OSC and iPhone.
 servers_alive(): Checks if all servers are still operational and responsive.
+latency_report(): Collects the round trip times to the OSC server and the iPhones.
 
 Usage:
 Instantiate the Control class with appropriate arguments, then utilize its methods to manage
@@ -22,12 +23,15 @@ Note:
 Ensure correct configuration of IP addresses, ports, and other settings in the arguments
 provided to the Control class during instantiation.
 '''
-from pythonosc.udp_client import SimpleUDPClient
+from src.utils.latencyProbe import LatencyProbe
+from src.utils.reliableOSC import ReliableOSCClient
 # from vicon_core_api import *
 # from shogun_live_api import *
 import src.utils.utils as utils
+from src.utils.takeCatalog import TakeCatalog
 import sys
 import os
+import json
 import time
 # get the path to the Shogun SDK
 # sys.path.append(r"C:\Program Files\Vicon\ShogunLive1.14\SDK\Python\shogun_live_api")
@@ -61,10 +65,12 @@ class Control:
         - PC_IP (str): Target IP address for the PC.
         - PORT_TCP_IPHONE (int): TCP port for iPhone communication.
         - SHOGUN_IP (str): Hostname/IP of the Shogun server.
-        - OSC_client (SimpleUDPClient): UDP client for OSC communication.
+        - OSC_client (ReliableOSCClient): UDP client for OSC communication, resends the record commands until acknowledged.
         - PORT (int): Controller port.
         - vicon_client (Client): Vicon Core API client.
         - vicon_capture_services (CaptureServices): Shogun Live API services for Vicon capture.
+        - catalog (TakeCatalog): Catalog the Shogun captures and OBS recordings are added to, or None.
+        - probe (LatencyProbe): Round trip times of the commands to the OSC server.
 
         Methods:
         - start_record_osc_shogun: Start recording via OSC and Shogun.
@@ -72,6 +78,7 @@ class Control:
         - set_file_name_osc_shogun: Set file name for recording via OSC and Shogun.
         - close_osc_iphone: Close connections and servers for OSC and iPhone.
         - servers_alive: Check if all servers are still alive.
+        - latency_report: Round trip times to the OSC server and the iPhones.
         """
         # Initialize Vicon SDK and Shogun Live API
         sys.path.append(args.vicon_sdk_path)
@@ -92,8 +99,12 @@ class Control:
         self.PC_IP = args.target_ip
         self.PORT_TCP_IPHONE = args.tcp_iphone_port
         self.SHOGUN_IP = args.shogun_hostname
-        self.OSC_client = SimpleUDPClient(self.PC_IP, args.target_port) 
+        self.probe = LatencyProbe()
+        self.OSC_client = ReliableOSCClient(self.PC_IP, args.target_port, args.osc_confirm_timeout, args.osc_retries,
+                                            listen=True, probe=self.probe, device="osc_server")
         self.PORT = args.controller_port
+        self.catalog = TakeCatalog(args.catalog_db_path) if args.catalog_db_path else None
+        self.obs_save_folder = args.obs_save_folder
 
         # Connect Vicon Core API client to the application.
         self.vicon_client = Client(self.SHOGUN_IP, args.shogun_port)
@@ -110,7 +121,7 @@ class Control:
         """
         Start recording via OSC and Shogun.
         """
-        self.OSC_client.send_message("/RecordStart", [])
+        self.OSC_client.send_reliable("/RecordStart")
         self.vicon_capture_services.start_capture()
 
     def stop_record_osc_shogun(self):
@@ -134,10 +145,16 @@ class Control:
                 old_path = folder + "\\" + name + f"_old_{i}.mcp"
             print(f"Renaming to: {old_path}")
             os.rename(self.last_path, old_path)
+            if self.catalog is not None:
+                # The renamed capture keeps its row, the new capture gets its own below
+                self.catalog.move(self.last_path, old_path)
 
-        self.OSC_client.send_message("/RecordStop", [])
+        self.OSC_client.send_reliable("/RecordStop")
         result = self.vicon_capture_services.stop_capture(0)
         print(f"Recording stopped. Result: {result}")
+        if self.catalog is not None:
+            take = len(self.catalog.find(gloss=name, modality="mocap"))
+            self.catalog.add(self.last_path, "mocap", "shogun", gloss=name, take=take)
         # self.open_last_file_shogun()
 
     def open_last_file_shogun(self):
@@ -164,6 +181,15 @@ class Control:
             time.sleep(1)
             result = self.SHOGUN_POST.OpenFile(self.last_path)
 
+    def catalog_obs_recordings(self):
+        """
+        Add the OBS recordings written since the previous call to the catalog.
+        """
+        if self.catalog is None:
+            return
+        count = self.catalog.scan_directory(self.obs_save_folder, "video", "obs")
+        print(f"[catalog] Added {count} OBS recordings")
+
     def set_file_name_osc_shogun(self, file_name):
         """
         Set file name for recording via OSC and Shogun.
@@ -197,5 +223,20 @@ class Control:
         """
         Check if all servers are still alive.
         """
-        self.OSC_client.send_message("/Alive", [])
+        # Not resent, only acknowledged to time the round trip
+        self.OSC_client.send_reliable("/Alive", retries=0)
+        self.OSC_client.print_stats()
         utils.check_connected(self.vicon_client, vicon_core_api)
+
+    def latency_report(self, timeout=2.0):
+        """
+        Collect the round trip times of the OSC commands.
+
+        Returns:
+        A dict with the p50/p95/p99 per device: "controller" with the round trips from here
+        to the OSC server, "osc_server" with those from the OSC server to the iPhones (None
+        if the OSC server did not answer).
+        """
+        delivery = self.OSC_client.send_reliable("/LatencyQuery", confirm_address="/LatencyReport", retries=1)
+        osc_server = json.loads(delivery.response[0]) if delivery.wait(timeout) else None
+        return {"controller": self.probe.report(), "osc_server": osc_server}
@@ -0,0 +1,204 @@
+"""
+File: latencyProbe.py
+
+Description:
+Measures how long OSC commands take to be answered, per device: from the
+controller to the OSC server (the acknowledgements of reliableOSC.py), and from
+the OSC server to the iPhones and back ("/RecordStartConfirm",
+"/OSCSetSendTargetConfirm", the "/Battery" reply to "/BatteryQuery").
+
+Outgoing requests are timestamped with sent and matched with their response
+in received, the oldest unanswered request first. The commands that are
+resent until confirmed (the record commands and "/OSCSetSendTarget") are timed
+by ReliableOSCClient from the first send to the confirm, and added with record.
+When several iPhones record at once, LiveLinkFaceClient also records the skew
+between them under the device "skew".
+
+Every device keeps an HDR-style histogram: buckets are exact below 128
+microseconds and above that grow with the value, so every bucket is at most
+1/64 (1.6%) wide relative to its value, from microseconds up to a day, in a
+fixed array of counters. Percentiles are read from the histogram, so recording
+costs the same however many round trips were measured.
+
+Classes:
+- LatencyHistogram: HDR-style histogram of durations.
+- LatencyProbe: Matches requests with responses and keeps a histogram per device and command.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# 2^7 exact buckets, then 64 buckets per power of two
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+# Up to 2^37 microseconds, more than a day
+MAX_SHIFT = 31
+BUCKET_COUNT = (MAX_SHIFT + 2) * SUB_BUCKET_HALF
+# A request without a response after this many seconds is counted as lost
+RESPONSE_TIMEOUT = 10.0
+# The responses of the requests the probe matches itself
+RESPONSES = {
+    "/BatteryQuery": "/Battery",
+}
+
+
+def bucket_index(microseconds):
+    """
+    Return the histogram bucket of a duration in whole microseconds.
+    """
+    shift = max(0, microseconds.bit_length() - SUB_BUCKET_BITS)
+    return min(shift * SUB_BUCKET_HALF + (microseconds >> shift), BUCKET_COUNT - 1)
+
+
+def bucket_bounds(index):
+    """
+    Return the lowest and the highest duration in microseconds of a bucket.
+    """
+    shift = max(0, index // SUB_BUCKET_HALF - 1)
+    low = (index - shift * SUB_BUCKET_HALF) << shift
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Class LatencyHistogram counts durations in logarithmic buckets of bounded relative width.
+
+    Attributes:
+    - counts: int64 array with the count of every bucket.
+    - count: The number of recorded durations.
+    - total: The sum of the recorded durations in seconds.
+    - min, max: The shortest and the longest recorded duration in seconds.
+    """
+    def __init__(self):
+        self.counts = np.zeros(BUCKET_COUNT, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        microseconds = max(0, int(seconds * 1e6))
+        self.counts[bucket_index(microseconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Return the q-th percentile in seconds, the middle of its bucket, or None if empty.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(np.ceil(q / 100 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        low, high = bucket_bounds(index)
+        return min(max((low + high) / 2e6, self.min), self.max)
+
+    def to_dict(self):
+        def ms(seconds):
+            return None if seconds is None else round(1000 * seconds, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count if self.count else None),
+            "min_ms": ms(self.min),
+            **{f"p{q}_ms": ms(self.percentile(q)) for q in (50, 95, 99)},
+            "max_ms": ms(self.max),
+        }
+
+
+class LatencyProbe:
+    """
+    Class LatencyProbe times OSC requests per device.
+
+    Description:
+    A device is any name for the other end, such as the IP of an iPhone or
+    "osc_server". Every device has a histogram of all its round trips and one
+    per command, and counts the requests that were never answered.
+
+    Attributes:
+    - responses: The response address of every timed request address.
+    - timeout: Seconds after which an unanswered request is counted as lost.
+    """
+    def __init__(self, responses=None, timeout=RESPONSE_TIMEOUT):
+        self.responses = dict(RESPONSES if responses is None else responses)
+        self.requests = {response: request for request, response in self.responses.items()}
+        self.timeout = timeout
+        self.pending = defaultdict(deque)
+        self.histograms = defaultdict(LatencyHistogram)
+        self.lost = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def sent(self, device, address):
+        """
+        Timestamp a request to a device, if it is one the probe times.
+        """
+        if address in self.responses:
+            with self.lock:
+                self.pending[(device, address)].append(time.perf_counter())
+
+    def received(self, device, address):
+        """
+        Match a response from a device with the oldest unanswered request.
+
+        Returns:
+        The round trip time in seconds, or None if no request was waiting for it.
+        """
+        request = self.requests.get(address)
+        if request is None:
+            return None
+        now = time.perf_counter()
+        with self.lock:
+            self.expire(now)
+            pending = self.pending[(device, request)]
+            if not pending:
+                return None
+            rtt = now - pending.popleft()
+        self.record(device, request, rtt)
+        return rtt
+
+    def expire(self, now):
+        """
+        Count the requests unanswered for longer than the timeout as lost; called with the lock held.
+        """
+        for (device, _), pending in self.pending.items():
+            while pending and now - pending[0] > self.timeout:
+                pending.popleft()
+                self.lost[device] += 1
+
+    def record_lost(self, device):
+        with self.lock:
+            self.lost[device] += 1
+
+    def record(self, device, command, seconds):
+        """
+        Add a round trip time measured elsewhere.
+        """
+        with self.lock:
+            self.histograms[(device, None)].record(seconds)
+            self.histograms[(device, command)].record(seconds)
+
+    def report(self):
+        """
+        Return the latency of every device, overall and per command, in milliseconds.
+        """
+        with self.lock:
+            self.expire(time.perf_counter())
+            devices = {}
+            for (device, command), histogram in sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+                entry = devices.setdefault(device, {"lost": self.lost[device], "commands": {}})
+                if command is None:
+                    entry.update(histogram.to_dict())
+                else:
+                    entry["commands"][command] = histogram.to_dict()
+            for device, lost in self.lost.items():
+                devices.setdefault(device, {"lost": lost, "commands": {}, **LatencyHistogram().to_dict()})
+            return devices
+
+    def print_report(self):
+        for device, entry in self.report().items():
+            print(f"[latency] {device}: {entry['count']} round trips, p50 {entry['p50_ms']} ms, "
+                  f"p95 {entry['p95_ms']} ms, p99 {entry['p99_ms']} ms, max {entry['max_ms']} ms, {entry['lost']} lost")
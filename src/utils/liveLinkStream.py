@@ -0,0 +1,171 @@
+"""
+File: liveLinkStream.py
+
+Description:
+This file defines the LiveLinkStream class, which receives the realtime Live
+Link UDP stream of the iPhone while a take is being recorded, next to the OSC
+control of LiveLinkFaceServer. Every packet holds one frame:
+
+- Packet version (uint32, little endian) and device id (37 bytes).
+- Subject name: length (int32, big endian) and utf-8 name.
+- Frame time: frame number (int32), subframe (float32), fps and denominator
+  (int32 each) and the number of blendshapes (uint8), all big endian.
+- The blendshape values: 61 big endian float32.
+
+Packets are received into one preallocated buffer and copied into a fixed size
+NumPy ring buffer, so no arrays are allocated per frame. Consumers in the same
+process read the latest frames with latest(n), or the frames of a take with
+frames_since(count), for example to run the take quality checks (takeQC.py)
+while the take is still being recorded.
+
+Classes:
+- LiveLinkStream: Receives the Live Link stream into a ring buffer.
+"""
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from src.utils.blendshapeLoader import BlendshapeTake, CHANNEL_COUNT
+
+DEFAULT_STREAM_PORT = 11111
+DEFAULT_CAPACITY = 6000
+NAME_OFFSET = 41
+NAME_LENGTH = struct.Struct("!i")
+FRAME_TIME = struct.Struct("!if2iB")
+MAX_PACKET_SIZE = 2048
+# The channel names in the order of the stream, the same as the CSV columns
+CHANNEL_NAMES = [
+    "EyeBlinkLeft", "EyeLookDownLeft", "EyeLookInLeft", "EyeLookOutLeft", "EyeLookUpLeft", "EyeSquintLeft", "EyeWideLeft",
+    "EyeBlinkRight", "EyeLookDownRight", "EyeLookInRight", "EyeLookOutRight", "EyeLookUpRight", "EyeSquintRight", "EyeWideRight",
+    "JawForward", "JawRight", "JawLeft", "JawOpen", "MouthClose", "MouthFunnel", "MouthPucker", "MouthRight", "MouthLeft",
+    "MouthSmileLeft", "MouthSmileRight", "MouthFrownLeft", "MouthFrownRight", "MouthDimpleLeft", "MouthDimpleRight",
+    "MouthStretchLeft", "MouthStretchRight", "MouthRollLower", "MouthRollUpper", "MouthShrugLower", "MouthShrugUpper",
+    "MouthPressLeft", "MouthPressRight", "MouthLowerDownLeft", "MouthLowerDownRight", "MouthUpperUpLeft", "MouthUpperUpRight",
+    "BrowDownLeft", "BrowDownRight", "BrowInnerUp", "BrowOuterUpLeft", "BrowOuterUpRight", "CheekPuff", "CheekSquintLeft",
+    "CheekSquintRight", "NoseSneerLeft", "NoseSneerRight", "TongueOut", "HeadYaw", "HeadPitch", "HeadRoll",
+    "LeftEyeYaw", "LeftEyePitch", "LeftEyeRoll", "RightEyeYaw", "RightEyePitch", "RightEyeRoll",
+]
+
+
+class LiveLinkStream:
+    """
+    Class LiveLinkStream receives the Live Link UDP stream into a ring buffer.
+
+    Description:
+    A background thread receives the packets and writes frame count modulo
+    capacity. The frame count only grows, so a consumer can remember it and
+    later ask for all frames received since, as long as fewer than capacity
+    frames were received in between.
+
+    Attributes:
+    - values: float32 ring buffer of shape (capacity, 61).
+    - timecodes: float64 ring buffer with the timecode of every frame in seconds.
+    - count: The number of frames received since the start.
+    - fps: The frame rate of the last frame.
+    - subject: The subject name of the last frame.
+    - dropped: The number of frames missing between consecutive frame numbers.
+    - bad_packets: The number of packets that could not be decoded.
+    """
+    def __init__(self, ip, port=DEFAULT_STREAM_PORT, capacity=DEFAULT_CAPACITY):
+        self.ip = ip
+        self.port = port
+        self.capacity = capacity
+        self.values = np.zeros((capacity, CHANNEL_COUNT), dtype=np.float32)
+        self.timecodes = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.fps = 60
+        self.subject = None
+        self.dropped = 0
+        self.bad_packets = 0
+        self.last_frame = None
+        self.lock = threading.Lock()
+        self.buffer = bytearray(MAX_PACKET_SIZE)
+        self.view = memoryview(self.buffer)
+        # Big endian float views on the receive buffer, by offset of the values
+        self.value_views = {}
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """
+        Bind the socket and start receiving on a background thread.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.ip, self.port))
+        self.sock.settimeout(0.5)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"[stream] Receiving the Live Link stream on {self.ip}:{self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.sock is not None:
+            self.sock.close()
+
+    def run(self):
+        """
+        Worker function of the receive thread.
+        """
+        while self.running:
+            try:
+                size = self.sock.recv_into(self.buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                self.decode(size)
+            except (struct.error, ValueError, UnicodeDecodeError):
+                self.bad_packets += 1
+
+    def decode(self, size):
+        """
+        Decode the packet in the receive buffer into the next ring buffer slot.
+        """
+        name_length = NAME_LENGTH.unpack_from(self.buffer, NAME_OFFSET)[0]
+        time_offset = NAME_OFFSET + NAME_LENGTH.size + name_length
+        frame, subframe, fps, denominator, channels = FRAME_TIME.unpack_from(self.buffer, time_offset)
+        values_offset = time_offset + FRAME_TIME.size
+        if channels != CHANNEL_COUNT or size < values_offset + 4 * CHANNEL_COUNT or fps <= 0:
+            raise ValueError("Unexpected Live Link packet")
+
+        values = self.value_views.get(values_offset)
+        if values is None:
+            values = np.frombuffer(self.buffer, dtype=">f4", count=CHANNEL_COUNT, offset=values_offset)
+            self.value_views[values_offset] = values
+            self.subject = bytes(self.view[time_offset - name_length:time_offset]).decode("utf-8")
+
+        with self.lock:
+            slot = self.count % self.capacity
+            self.values[slot] = values
+            self.timecodes[slot] = (frame + subframe) * max(denominator, 1) / fps
+            self.count += 1
+        if self.last_frame is not None and frame > self.last_frame + 1:
+            self.dropped += frame - self.last_frame - 1
+        self.last_frame = frame
+        self.fps = fps / max(denominator, 1)
+
+    def frames_since(self, count):
+        """
+        Return the frames received after the frame count was count.
+
+        Returns:
+        A BlendshapeTake with a copy of the frames, only the latest capacity
+        frames if more were received.
+        """
+        with self.lock:
+            start = max(count, self.count - self.capacity)
+            slots = np.arange(start, self.count) % self.capacity
+            return BlendshapeTake(CHANNEL_NAMES, self.timecodes[slots], self.values[slots], self.fps)
+
+    def latest(self, n):
+        """
+        Return the latest n frames, oldest first.
+        """
+        return self.frames_since(self.count - n)
@@ -3,153 +3,333 @@ File: LiveLinkFace.py
 
 Description:
 This file defines the LiveLinkFaceClient and LiveLinkFaceServer classes for
-communicating with an iPhone server via OSC (Open Sound Control) protocol.
+communicating with one or more iPhone servers via OSC (Open Sound Control) protocol.
 
 Classes:
-- LiveLinkFaceClient: Sends messages to the iPhone Live Link server.
-- LiveLinkFaceServer: Launches the Live Link server and communicates with the iPhone.
+- IphoneDevice: The connection, take number and receiver ports of one iPhone.
+- LiveLinkFaceClient: Sends messages to the iPhone Live Link servers.
+- LiveLinkFaceServer: Launches the Live Link server and communicates with the iPhones.
 
 LiveLinkFaceClient:
-- The __init__ method initializes the client and sets the Python server address on the iPhone.
-- The start_capture method instructs the iPhone to start capturing.
-- The stop_capture method instructs the iPhone to stop capturing.
+- The __init__ method initializes the client and sets the Python server address on the iPhones.
+- The send_all method sends a message to every iPhone.
+- The send_reliable_all method sends a command to every iPhone, resent until each confirms it.
+- The start_capture method instructs the iPhones to start capturing.
+- The stop_capture method instructs the iPhones to stop capturing.
 - The set_filename method sets the file name for capturing.
-- The request_battery method requests the battery status from the iPhone.
-- The save_file method sends a transport message to the iPhone to save a file.
+- The set_send_target method tells the iPhones where to send their messages, resent until confirmed.
+- The request_battery method requests the battery status from the iPhones.
+- The device_for method finds the iPhone a message came from.
+- The confirm method passes a confirm to the iPhone it came from and measures the skew between the iPhones.
+- The save_file method sends a transport message to an iPhone to save a file.
 
 LiveLinkFaceServer:
 - The __init__ method initializes the server and client objects for communication with the iPhone.
 - The init_server method starts the server to receive messages from the iPhone.
+- The serve_async method runs the server on an asyncio event loop.
+- The run_io method runs the TCP work of a handler, in the background in asyncio mode.
 - The quit_server method exits the server and client.
 - The start_recording method starts recording with the iPhone and TCP socket.
+- The send_basic_cmd_tcp method sends a command over the long-lived command connection of a port.
+- The send_cmd_all_tcp method sends a command to every file receiver.
 - The send_close_tcp method sends a close command to the TCP socket.
 - The send_file_name_tcp method sends a file name to the TCP socket.
 - The send_are_you_okay_tcp method checks if the TCP socket is okay.
 - The send_signal_recording_tcp method sets the TCP socket to file receiving mode.
 - The ping_back method responds to requests, indicating that the OSC server is alive.
+- The probe_response method matches replies of the iPhone with the requests timed by the latency probe.
+- The report_latency method sends the latency of the iPhones back to the controller.
+- The confirm_iphone method passes the confirms of the iPhones to the client.
+- The check_stream method runs the quality checks on the frames streamed during the take.
 - The default method prints all received messages by default.
 """
-from pythonosc.udp_client import SimpleUDPClient
 from pythonosc.dispatcher import Dispatcher
-from pythonosc.osc_server import BlockingOSCUDPServer
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_server import AsyncIOOSCUDPServer, BlockingOSCUDPServer
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.commandChannel import CommandChannel
+from src.utils.latencyProbe import LatencyProbe
+from src.utils.reliableOSC import ReliableOSCClient, ReliableReceiver
+from src.utils.liveLinkStream import LiveLinkStream
+from src.utils.takeQC import check_take
+import asyncio
+import json
 import sys
-import socket
-import struct
+import threading
+import time
+
+# The IPhone confirms "/RecordStop" only once the take is written, which takes longer than a start
+STOP_CONFIRM_TIMEOUT = 2.0
+
+class IphoneDevice:
+    """
+    Class IphoneDevice holds the connection and the take state of one iPhone.
+
+    Attributes:
+    - name: The name of the iPhone in the config.
+    - ip: The IP address of the iPhone, also its name in the latency probe.
+    - toIphone: ReliableOSCClient instance for communication with the iPhone server; the record
+      commands are resent until the iPhone confirms them.
+    - takenumber: The take number of the next recording on this iPhone.
+    - csv_port, video_port: The receiver ports the iPhone sends its files to.
+    - last_start: The Delivery of the last "/RecordStart", to tell if the iPhone recorded the take.
+    - last_transport: The CSV of the last transported take.
+    """
+    def __init__(self, device, args, probe):
+        self.name = device['name']
+        self.ip = device['ip']
+        self.toIphone = ReliableOSCClient(self.ip, args.llf_udp_port, args.osc_confirm_timeout, args.osc_retries,
+                                          probe=probe, device=self.ip)
+        self.takenumber = 0
+        # A device with its own receive_port has a multiplexing receiver of its own
+        self.csv_port = device['receive_port'] or args.receive_port or args.receive_csv_port
+        self.video_port = device['receive_port'] or args.receive_port or args.receive_video_port
+        self.last_start = None
+        self.last_transport = None
 
 class LiveLinkFaceClient:
     """
-    Class LiveLinkFaceClient sends messages to the live link server on the iPhone.
+    Class LiveLinkFaceClient sends messages to the live link server on one or more iPhones.
+
+    Description:
+    Every command is sent to all iPhones (see llf_devices in the config). The UDP messages are built once and
+    sent one after the other without waiting for the confirms, so the iPhones get a command within
+    microseconds of each other. The skew between the iPhones is measured twice and added to the latency probe
+    under the device "skew": the spread of the send times ("<command> send") and the spread of the arrival
+    times of the confirms ("<command> confirm"), which includes the network and the iPhones themselves.
 
     Methods:
-    - __init__: Initializes the client and sets the Python server address on the iPhone.
-    - start_capture: Sends a message to start capturing to the iPhone server.
-    - stop_capture: Sends a message to stop capturing to the iPhone server.
-    - set_filename: Sets the file name for capturing on the iPhone server.
-    - request_battery: Requests battery information from the iPhone server.
-    - save_file: Sends a transport message to the iPhone for saving a file.
+    - __init__: Initializes the client and sets the Python server address on the iPhones.
+    - send_all: Sends a message to every iPhone.
+    - send_reliable_all: Sends a command to every iPhone, resent until each confirms it.
+    - start_capture: Sends a message to start capturing to the iPhone servers.
+    - stop_capture: Sends a message to stop capturing to the iPhone servers.
+    - set_filename: Sets the file name for capturing on the iPhone servers.
+    - request_battery: Requests battery information from the iPhone servers.
+    - device_for: Finds the iPhone a message came from.
+    - confirm: Passes a confirm of an iPhone to its reliable client and measures the skew.
+    - save_file: Sends a transport message to an iPhone for saving a file.
 
     Attributes:
-    - toIphone: SimpleUDPClient instance for communication with the iPhone server.
+    - devices: IphoneDevice per IP address, in the order of the config.
     - gloss: Current gloss set for capturing.
     - args: Arguments for configuring the client.
+    - probe: LatencyProbe timing the replies of the iPhones and the skew between them.
+    - fanouts: The deliveries of the last command sent to all iPhones, per confirm address.
     """
 
-    def __init__(self, args, gloss):
+    def __init__(self, args, gloss, probe=None):
         """
         Initialize the LiveLinkFaceClient.
 
         Args:
         - args: The arguments containing necessary configurations.
         - gloss: The initial gloss for capturing.
+        - probe: The LatencyProbe of the server, a new one by default.
 
         Description:
-        This method initializes the LiveLinkFaceClient instance. It sets up the UDP client
-        for communication with the iPhone server, sets the Python server address on the iPhone,
+        This method initializes the LiveLinkFaceClient instance. It sets up a UDP client
+        for communication with every iPhone server, sets the Python server address on the iPhones,
         and initializes other necessary attributes.
         """
-        print("Sending to: ", args.llf_udp_ip, args.llf_udp_port)
-        self.toIphone = SimpleUDPClient(args.llf_udp_ip, args.llf_udp_port)
-        self.toIphone.send_message("/OSCSetSendTarget", [args.target_ip, args.target_port])
-        self.toIphone.send_message("/VideoDisplayOn", [])
+        self.probe = probe or LatencyProbe()
+        self.devices = {}
+        for device in args.llf_devices:
+            print("Sending to: ", device['name'], device['ip'], args.llf_udp_port)
+            self.devices[device['ip']] = IphoneDevice(device, args, self.probe)
+        self.fanouts = {}
+        self.fanout_lock = threading.Lock()
+        self.send_all("/OSCSetSendTarget", [args.target_ip, args.target_port])
+        self.send_all("/VideoDisplayOn", [])
+        if args.llf_stream_port:
+            # Stream the blendshapes of the first iPhone to this computer while recording
+            first = next(iter(self.devices.values()))
+            first.toIphone.send_message("/AddLiveLinkAddress", [args.target_ip, args.llf_stream_port])
+            first.toIphone.send_message("/LiveLinkStreamStart", [])
         self.gloss = gloss
         self.args = args
 
         # Set gloss of first sign
         self.set_filename(self.gloss)
-        self.takenumber = 0
+
+    def send_all(self, address, args):
+        """
+        Send a message to every iPhone without waiting for a confirm.
+        """
+        builder = OscMessageBuilder(address=address)
+        for arg in args:
+            builder.add_arg(arg)
+        # Built once, so the iPhones get the message right after each other
+        message = builder.build()
+        for device in self.devices.values():
+            device.toIphone.send(message)
+
+    def send_reliable_all(self, address, args, confirm_address, timeout=None):
+        """
+        Send a command to every iPhone, each resent until that iPhone confirms it.
+
+        Args:
+        - address: The OSC address of the command.
+        - args: The arguments of the command, the same for every iPhone, or a function of the IphoneDevice.
+        - confirm_address: The address of the confirm, such as "/RecordStartConfirm".
+        - timeout: Seconds to wait for the first confirm, by default that of the clients.
+
+        Returns:
+        The Delivery per IP address.
+        """
+        deliveries = {}
+        for ip, device in self.devices.items():
+            device_args = args(device) if callable(args) else args
+            deliveries[ip] = device.toIphone.send_reliable(address, device_args, confirm_address, timeout=timeout)
+        if len(deliveries) > 1:
+            sent = [delivery.first_sent for delivery in deliveries.values()]
+            self.probe.record("skew", f"{address} send", max(sent) - min(sent))
+            with self.fanout_lock:
+                self.fanouts[confirm_address] = deliveries
+        return deliveries
 
     def start_capture(self, *args):
         """
-        Start capturing on the iPhone server.
+        Start capturing on the iPhone servers.
 
         Returns:
-        The current capture number.
+        The current capture number per iPhone name.
 
         Description:
-        This method sends a message to the iPhone server to start capturing.
-        It increments the capture number and returns it.
+        This method sends a message to the iPhone servers to start capturing, each with its own take number.
+        The message is resent until every iPhone answers with "/RecordStartConfirm".
         """
-        self.toIphone.send_message("/RecordStart", [self.gloss, self.takenumber])
-        return self.takenumber
+        deliveries = self.send_reliable_all("/RecordStart", lambda device: [self.gloss, device.takenumber],
+                                            "/RecordStartConfirm")
+        for ip, delivery in deliveries.items():
+            self.devices[ip].last_start = delivery
+        return {device.name: device.takenumber for device in self.devices.values()}
 
     def stop_capture(self, *args):
         """
-        Stop capturing on the iPhone server.
+        Stop capturing on the iPhone servers.
 
         Description:
-        This method sends a message to the iPhone server to stop capturing.
-        It also increments the capture number.
+        This method sends a message to the iPhone servers to stop capturing,
+        resent until every iPhone answers with "/RecordStopConfirm".
+        It also increments the capture number of the iPhones that recorded the take.
         """
-        self.toIphone.send_message("/RecordStop", [])
-        self.takenumber += 1
+        self.send_reliable_all("/RecordStop", [], "/RecordStopConfirm", timeout=STOP_CONFIRM_TIMEOUT)
+        for device in self.devices.values():
+            start = device.last_start
+            # An iPhone that never confirmed the start recorded nothing, so it keeps its take number
+            if start is None or start.confirmed or not start.done.is_set():
+                device.takenumber += 1
 
     def set_filename(self, gloss, *args):
         """
-        Set the file name for capturing on the iPhone server.
+        Set the file name for capturing on the iPhone servers.
 
         Args:
         - gloss: The gloss to be set as the file name.
 
         Description:
-        This method sets the file name for capturing on the iPhone server.
-        It also resets the capture number.
+        This method sets the file name for capturing on the iPhone servers.
+        It also resets the capture numbers.
         """
         gloss = ''.join(e for e in gloss if e.isalnum())
         print("Setting filename to: ", gloss)
         print("ARGS: ", args)
-        self.toIphone.send_message("/Slate", [self.gloss])
+        self.send_all("/Slate", [self.gloss])
 
         # Don't reset the take number if the gloss is the same
         if self.gloss == gloss:
             return
 
         self.gloss = gloss
-        self.takenumber = 0
+        for device in self.devices.values():
+            device.takenumber = 0
     
     def request_battery(self, *args):
         """
-        Request battery information from the iPhone server.
+        Request battery information from the iPhone servers.
+
+        Description:
+        This method sends a message to the iPhone servers to request battery information.
+        The replies ("/Battery") are timed by the latency probe.
+        """
+        for device in self.devices.values():
+            self.probe.sent(device.ip, "/BatteryQuery")
+        self.send_all("/BatteryQuery", [])
+
+    def set_send_target(self):
+        """
+        Tell the iPhones where to send their messages, resent until they confirm.
+
+        Description:
+        The iPhones are told once when the client starts, before the server listens, and once
+        more by the server when it listens, so the confirms arrive. Without it an iPhone
+        confirms nothing, so it is resent like the record commands.
+        """
+        self.send_reliable_all("/OSCSetSendTarget", [self.args.target_ip, self.args.target_port],
+                               "/OSCSetSendTargetConfirm")
+
+    def device_for(self, client_address):
+        """
+        Return the IphoneDevice a message came from, or None if it is not a known iPhone.
 
         Description:
-        This method sends a message to the iPhone server to request battery information.
+        With a single iPhone its messages are accepted from any address, as before.
         """
-        self.toIphone.send_message("/BatteryQuery", [])
+        device = self.devices.get(client_address[0])
+        if device is None and len(self.devices) == 1:
+            device = next(iter(self.devices.values()))
+        return device
 
-    def save_file(self, command, timecode, blendshapeCSV, referenceMOV, *args):
+    def confirm(self, client_address, address, *args):
+        """
+        Pass a confirm to the reliable client of the iPhone it came from.
+
+        Returns:
+        Whether a pending command of that iPhone was confirmed.
+
+        Description:
+        Once every iPhone confirmed a command sent to all of them, the spread of the arrival
+        times of the confirms is added to the latency probe.
+        """
+        device = self.device_for(client_address)
+        if device is None or not device.toIphone.confirm(address, *args):
+            return False
+        with self.fanout_lock:
+            deliveries = self.fanouts.get(address)
+            if deliveries is None or not all(delivery.confirmed for delivery in deliveries.values()):
+                return True
+            del self.fanouts[address]
+        arrived = [delivery.first_sent + delivery.rtt for delivery in deliveries.values()]
+        self.probe.record("skew", f"{deliveries[device.ip].address} confirm", max(arrived) - min(arrived))
+        return True
+
+    def save_file(self, client_address, command, timecode, blendshapeCSV, referenceMOV, *args):
         """
         Save a file on the iPhone server.
 
         Args:
+        - client_address: The address of the iPhone the confirm came from.
         - timecode: Timecode information.
         - blendshapeCSV: Blendshape CSV data.
         - referenceMOV: Reference MOV file.
 
         Description:
-        This method sends a transport message to the iPhone server to save a file.
+        This method sends a transport message to the iPhone server to save a file, to the receiver
+        of that iPhone. A take confirmed twice (because "/RecordStop" was resent) is transported once.
         """
-        print(f"send the transport towards:\tCSV{self.args.target_ip}:{str(self.args.receive_csv_port)}\tMOV{self.args.target_ip}:{str(self.args.receive_video_port)}")
-        self.toIphone.send_message("/Transport", [self.args.target_ip + ':' + str(self.args.receive_csv_port), blendshapeCSV])
-        self.toIphone.send_message("/Transport", [self.args.target_ip + ':' + str(self.args.receive_video_port), referenceMOV])
+        device = self.device_for(client_address)
+        if device is None:
+            print(f"[osc] {blendshapeCSV} is from an unknown iPhone {client_address[0]}, not transported")
+            return
+        if blendshapeCSV == device.last_transport:
+            print(f"[osc] {blendshapeCSV} was already transported")
+            return
+        device.last_transport = blendshapeCSV
+        print(f"send the transport of {device.name} towards:\tCSV{self.args.target_ip}:{str(device.csv_port)}"
+              f"\tMOV{self.args.target_ip}:{str(device.video_port)}")
+        device.toIphone.send_message("/Transport", [self.args.target_ip + ':' + str(device.csv_port), blendshapeCSV])
+        device.toIphone.send_message("/Transport", [self.args.target_ip + ':' + str(device.video_port), referenceMOV])
 
 class LiveLinkFaceServer: 
     """
@@ -157,8 +337,11 @@ class LiveLinkFaceServer:
 
     Description:
     The IP used in this server should be the same as the listener in the iPhone.
-    The server is NOT launched asynchronously, but it contains the client object to do any communication
-    to the iPhone where necessary.
+    By default the server handles the messages one by one on a single thread. With osc_server_mode set to
+    "asyncio" it runs on an event loop instead: the UDP messages to the iPhone are still sent inline, but the
+    TCP commands to the file receivers run on a background thread, so a slow or restarting receiver never
+    delays the next OSC message (for example a "/RecordStop" right after a "/RecordStart").
+    The server contains the client object to do any communication to the iPhone where necessary.
     The server is a man in the middle for all the communication with the iPhone, including setting up the
     TCP connection for the file transfer.
     """
@@ -176,25 +359,55 @@ class LiveLinkFaceServer:
         """
         self.gloss = gloss
         self.args = args
-        self.client = LiveLinkFaceClient(args, gloss)
+        # Round trip times of the iPhones, reported to the controller on "/LatencyQuery"
+        self.probe = LatencyProbe()
+        self.client = LiveLinkFaceClient(args, gloss, self.probe)
+
+        # Set by serve_async; in blocking mode the TCP work runs inline
+        self.loop = None
+        self.quit_event = None
+        self.io_tasks = set()
+        # One thread, so the receivers get the commands in the order of the OSC messages
+        self.io_executor = None
+
+        # Long-lived command connections to the file receivers, one per port, including those of the iPhones
+        # with a receiver of their own
+        receiver_ports = [args.receive_port] if args.receive_port else [args.receive_csv_port, args.receive_video_port]
+        for device in args.llf_devices:
+            if device['receive_port'] and device['receive_port'] not in receiver_ports:
+                receiver_ports.append(device['receive_port'])
+        self.command_channels = {port: CommandChannel(args.target_ip, port) for port in receiver_ports}
+
+        # Optional realtime blendshape stream, checked at the end of every take
+        self.stream = None
+        self.take_start = 0
+        if args.llf_stream_port:
+            self.stream = LiveLinkStream(args.target_ip, args.llf_stream_port, args.llf_stream_buffer_frames)
 
         # Start server rules here, add a default rule for all other incoming messages
         self.dispatcher = Dispatcher()
-        self.dispatcher.map("/OSCSetSendTargetConfirm", print)
+        self.dispatcher.map("/OSCSetSendTargetConfirm", self.confirm_iphone, needs_reply_address=True)
+        self.dispatcher.map("/Battery", self.probe_response, needs_reply_address=True)
         self.dispatcher.map("/QuitServer", self.quit_server)
 
         # Start client requests here
         self.dispatcher.map("/BatteryQuery", self.client.request_battery)
         self.dispatcher.map("/SetFileName", lambda address, *args: self.client.set_filename(*args))
-        self.dispatcher.map("/RecordStart", self.start_recording)
-        self.dispatcher.map("/RecordStop", self.client.stop_capture)
+        # The controller sends the record commands with a sequence number and waits for the acknowledgement
+        self.reliable = ReliableReceiver()
+        self.dispatcher.map("/RecordStart", self.reliable.wrap(self.start_recording), needs_reply_address=True)
+        self.dispatcher.map("/RecordStop", self.reliable.wrap(self.stop_recording), needs_reply_address=True)
+        # The confirms of the iPhones stop the resending of the record commands, matched by the address of the iPhone
+        self.dispatcher.map("/RecordStartConfirm", self.confirm_iphone, needs_reply_address=True)
+        self.dispatcher.map("/RecordStopConfirm", self.confirm_iphone, needs_reply_address=True)
         # When the recording is fully finished, instruct the client to save the file locally
-        self.dispatcher.map("/RecordStopConfirm", self.client.save_file)
+        self.dispatcher.map("/RecordStopConfirm", self.client.save_file, needs_reply_address=True)
 
         # Start TCP requests here
-        self.dispatcher.map("/CloseTCPListener", self.send_close_tcp)
-        self.dispatcher.map("/SendFileNameToTCP", self.send_file_name_tcp)
-        self.dispatcher.map("/Alive", self.ping_back)
+        self.dispatcher.map("/CloseTCPListener", lambda *args: self.run_io(self.send_close_tcp, *args))
+        self.dispatcher.map("/SendFileNameToTCP", lambda *args: self.run_io(self.send_file_name_tcp, *args))
+        self.dispatcher.map("/Alive", self.reliable.wrap(self.ping_back), needs_reply_address=True)
+        self.dispatcher.map("/LatencyQuery", self.report_latency, needs_reply_address=True)
 
         # What to do with unknown messages
         self.dispatcher.set_default_handler(self.default)
@@ -207,9 +420,76 @@ class LiveLinkFaceServer:
         This method starts the server to receive messages from the iPhone.
         """
         print("Receiving On: ", self.args.target_ip, self.args.target_port)
+        if self.stream is not None:
+            self.stream.start()
+        if getattr(self.args, "osc_server_mode", "blocking") == "asyncio":
+            asyncio.run(self.serve_async())
+            return
         self.server = BlockingOSCUDPServer((self.args.target_ip, self.args.target_port), self.dispatcher)
+        self.client.set_send_target()
         self.server.serve_forever()
 
+    async def serve_async(self):
+        """
+        Run the server on an asyncio event loop until "/QuitServer".
+
+        Description:
+        The handlers are called on the event loop as the datagrams arrive. Their TCP work is
+        handed to run_io, which runs it as a task on the background thread.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.quit_event = asyncio.Event()
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="osc-io")
+        self.server = AsyncIOOSCUDPServer((self.args.target_ip, self.args.target_port), self.dispatcher, self.loop)
+        transport, _ = await self.server.create_serve_endpoint()
+        self.client.set_send_target()
+        print("[osc] Serving on the asyncio event loop")
+        try:
+            await self.quit_event.wait()
+        finally:
+            transport.close()
+            if self.io_tasks:
+                await asyncio.wait(self.io_tasks, timeout=5)
+            self.io_executor.shutdown(wait=False)
+            if self.stream is not None:
+                self.stream.stop()
+
+    def run_io(self, func, *args):
+        """
+        Run blocking work of a handler, such as a TCP command to the file receivers.
+
+        Args:
+        - func: The function to run.
+        - args: The arguments of the function.
+
+        Description:
+        In blocking mode the function is called right away. In asyncio mode it runs as a task on the
+        background thread and the handler returns immediately; the tasks run one after the other in
+        the order they were started.
+        """
+        if self.loop is None:
+            func(*args)
+            return
+        # Nothing is returned, the OSC server would send a return value back as a reply
+        task = self.loop.create_task(self.run_in_background(func, *args))
+        self.io_tasks.add(task)
+        task.add_done_callback(self.io_tasks.discard)
+
+    async def run_in_background(self, func, *args):
+        def timed():
+            started = time.perf_counter()
+            func(*args)
+            return time.perf_counter() - started
+
+        name = getattr(func, '__name__', func)
+        try:
+            elapsed = await self.loop.run_in_executor(self.io_executor, timed)
+        except Exception as e:
+            print(f"[osc] {name} failed: {e}")
+            return
+        if elapsed > 0.5:
+            print(f"[osc] {name} took {elapsed:.2f}s, the OSC messages were handled meanwhile")
+
     def quit_server(self, *args):
         """
         Exit the server.
@@ -217,6 +497,9 @@ class LiveLinkFaceServer:
         Description:
         This method exits the server and client through the /QuitServer handle.
         """
+        if self.quit_event is not None:
+            self.quit_event.set()
+            return
         sys.exit()
 
     def start_recording(self, *args):
@@ -227,7 +510,57 @@ class LiveLinkFaceServer:
         This method starts recording with the iPhone and starts accepting a file with the TCP socket.
         """
         self.client.start_capture()
-        self.send_signal_recording_tcp()
+        if self.stream is not None:
+            self.take_start = self.stream.count
+        self.run_io(self.send_signal_recording_tcp)
+
+    def stop_recording(self, *args):
+        """
+        Stop recording with the iPhone.
+
+        Description:
+        This method stops recording with the iPhone and checks the frames
+        streamed during the take, before the files are transported.
+        """
+        self.client.stop_capture()
+        self.run_io(self.check_stream, self.take_start)
+
+    def probe_response(self, client_address, address, *args):
+        """
+        Time a reply of an iPhone to a request of the latency probe, and print it.
+        """
+        rtt = self.probe.received(client_address[0], address)
+        print(f"{address}: {args}" + (f" ({1000 * rtt:.1f} ms)" if rtt is not None else ""))
+
+    def report_latency(self, client_address, address, *args):
+        """
+        Send the latency report of the iPhones back to the sender, as JSON in "/LatencyReport".
+        """
+        self.reliable.reply(client_address, "/LatencyReport", json.dumps(self.probe.report()))
+
+    def confirm_iphone(self, client_address, address, *args):
+        """
+        Pass a confirm of an iPhone to the client, so it stops resending the command to that iPhone.
+        """
+        if not self.client.confirm(client_address, address, *args):
+            print(f"{address} from {client_address[0]}: {args} (not awaited)")
+
+    def check_stream(self, take_start=None):
+        """
+        Run the quality checks on the frames streamed since the take started.
+
+        Args:
+        - take_start: The frame count of the stream at the start of the take, by default that of the last take.
+
+        Returns:
+        The QC report, or None when there is no stream.
+        """
+        if self.stream is None:
+            return None
+        report = check_take(self.stream.frames_since(self.take_start if take_start is None else take_start))
+        print(f"[stream] Take {self.client.gloss}: {report['frames']} frames, {report['dropped_frames']} dropped, "
+              f"{report['frozen_frames']} frozen, {len(report['duplicated_frames'])} duplicated")
+        return report
 
     def send_basic_cmd_tcp(self, cmd, extra="", port=None, *args):
         """
@@ -238,18 +571,20 @@ class LiveLinkFaceServer:
         - extra: Additional information to be sent.
 
         Description:
-        This method sends a basic message containing a command to the TCP socket.
+        This method sends a basic message containing a command to the TCP socket,
+        over the long-lived command connection of the given port.
         """
         if port is None:
-            port = self.args.receive_csv_port
+            port = next(iter(self.command_channels))
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect((self.args.target_ip, port))
+        self.command_channels[port].send((cmd, extra))
 
-            # Send the recording message
-            close_message = "COMMAND:" + cmd + "!" + extra
-            client_socket.sendall(struct.pack('>I', len(close_message)))
-            client_socket.sendall(close_message.encode())
+    def send_cmd_all_tcp(self, cmd, extra=""):
+        """
+        Send a basic command to every file receiver.
+        """
+        for port in self.command_channels:
+            self.send_basic_cmd_tcp(cmd, extra, port)
 
     def send_close_tcp(self, *args):
         """
@@ -258,8 +593,9 @@ class LiveLinkFaceServer:
         Description:
         This method asks the TCP socket to close itself.
         """
-        self.send_basic_cmd_tcp('CLOSE', port=self.args.receive_csv_port)
-        self.send_basic_cmd_tcp('CLOSE', port=self.args.receive_video_port)
+        self.send_cmd_all_tcp('CLOSE')
+        for channel in self.command_channels.values():
+            channel.close()
 
     def send_file_name_tcp(self, addr, file_name, *args):
         """
@@ -272,8 +608,7 @@ class LiveLinkFaceServer:
         Description:
         This method sends the TCP socket a file name.
         """
-        self.send_basic_cmd_tcp('FILE', file_name)
-        self.send_basic_cmd_tcp('FILE', file_name, port=self.args.receive_video_port)
+        self.send_cmd_all_tcp('FILE', file_name)
 
     def send_are_you_okay_tcp(self, *args):
         """
@@ -282,8 +617,7 @@ class LiveLinkFaceServer:
         Description:
         This method asks the TCP socket if it is okay.
         """
-        self.send_basic_cmd_tcp('ALIVE')
-        self.send_basic_cmd_tcp('ALIVE', port=self.args.receive_video_port)
+        self.send_cmd_all_tcp('ALIVE')
 
     def send_signal_recording_tcp(self, *args):
         """
@@ -292,8 +626,7 @@ class LiveLinkFaceServer:
         Description:
         This method sets the TCP socket to the "file receiving" mode.
         """
-        self.send_basic_cmd_tcp('RECORD')
-        self.send_basic_cmd_tcp('RECORD', port=self.args.receive_video_port)
+        self.send_cmd_all_tcp('RECORD')
 
     def ping_back(self, *args):
         """
@@ -301,9 +634,18 @@ class LiveLinkFaceServer:
 
         Description:
         This method responds to requests, indicating that the OSC server is alive.
+        It also queries the battery of the iPhone, which times a round trip to it.
         """
         print("OSC SERVER ALIVE")
-        self.send_are_you_okay_tcp()
+        if self.stream is not None:
+            print(f"[stream] {self.stream.count} frames from {self.stream.subject}, {self.stream.dropped} dropped, "
+                  f"{self.stream.bad_packets} bad packets")
+        for device in self.client.devices.values():
+            print(f"[osc] {device.name} ({device.ip}), take {device.takenumber}:")
+            device.toIphone.print_stats()
+        self.probe.print_report()
+        self.client.request_battery()
+        self.run_io(self.send_are_you_okay_tcp)
 
     def default(self, address, *args):
         """
@@ -8,15 +8,17 @@ import asyncio
 from threading import Thread
 
 class FFmpegRecorder:
-    def __init__(self, save_path="./", file_name="recording", video_device="video=UT-VID 00K0626579", audio_device="audio=Digital Audio Interface (UT-AUD 00K0626579)", popUp=None):
+    def __init__(self, save_path="./", file_name="recording", video_device="video=UT-VID 00K0626579", audio_device="audio=Digital Audio Interface (UT-AUD 00K0626579)", popUp=None, catalog=None):
         self.save_path = save_path
         self.file_name = file_name
+        self.gloss = file_name
         self.video_device = video_device
         self.audio_device = audio_device
         self.recording = False
         self.ffmpeg_process = None  # This will store the subprocess handle
         self.current_output_file = None
         self.popup = popUp
+        self.catalog = catalog  # Optional TakeCatalog the recordings are added to
 
     def set_save_location(self, path, date_folder=True):
         """Sets the location to save the recorded files."""
@@ -83,10 +85,11 @@ class FFmpegRecorder:
         
         return f"{base_name}_{counter}{file_extension}"
 
-    def set_recording_name(self, name):
-        """Sets the name of the recording file."""
+    def set_recording_name(self, name, gloss=None):
+        """Sets the name of the recording file, and the gloss it is cataloged under."""
         print(f"[ffmpeg] Recording name set to: {name}")
         self.file_name = name
+        self.gloss = gloss or name
 
     def list_devices(self):
         """List available audio and video devices using FFmpeg."""
@@ -212,13 +215,13 @@ class FFmpegRecorder:
         # await asyncio.sleep(0.5) # Wait for half a second before stopping the recording, making sure we have the last frames
 
         # Start stopping FFmpeg in a separate thread
-        thread = Thread(target=self.stop_ffmpeg, args=(self.ffmpeg_process,))
+        thread = Thread(target=self.stop_ffmpeg, args=(self.ffmpeg_process, self.current_output_file, self.gloss))
         thread.start()
 
         self.ffmpeg_process = None
         return True
 
-    def stop_ffmpeg(self, ffmpeg_process):
+    def stop_ffmpeg(self, ffmpeg_process, output_file=None, gloss=None):
         """This function will run in a separate thread to stop FFmpeg."""
         try:
             # Perform the blocking FFmpeg operations
@@ -232,6 +235,12 @@ class FFmpegRecorder:
             # self.check_last_file()
             # After stopping FFmpeg, do the final cleanup
             print("[ffmpeg] Recording and processing stopped.")
+            if self.catalog is not None and output_file is not None:
+                try:
+                    take = len(self.catalog.find(gloss=gloss, modality="video", source=f"ffmpeg:{self.video_device}"))
+                    self.catalog.add(output_file, "video", f"ffmpeg:{self.video_device}", gloss=gloss, take=take)
+                except Exception as e:
+                    print(f"[ffmpeg] Error adding '{output_file}' to the catalog: {e}")
             self.recording = False
             self.current_output_file = None
 
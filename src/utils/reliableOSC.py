@@ -0,0 +1,350 @@
+"""
+File: reliableOSC.py
+
+Description:
+A reliability layer for the OSC record commands, which are sent over plain UDP.
+A lost "/RecordStart" otherwise means a missing facial take that is only noticed
+afterwards. Every reliable command is resent until it is confirmed, with a
+timeout that doubles after every attempt, and reported when it stays
+unconfirmed after the last retry.
+
+A command is confirmed in one of two ways:
+- Sequenced: a sequence number is appended to the arguments, and the receiver
+  answers "<address>Ack" with that number (see ReliableReceiver). This is used
+  between the controller and the OSC server. A resent command that was already
+  handled is acknowledged again, but not handled twice.
+- By confirm address: for peers that cannot echo a sequence number, such as the
+  Live Link Face app, which answers "/RecordStart" with "/RecordStartConfirm".
+  A confirm resolves the oldest unconfirmed command waiting for it.
+
+The round trip time, the retries and the failures are counted per command,
+and the round trip times are also added to a LatencyProbe when one is given.
+
+Classes:
+- Delivery: A reliable command waiting for its confirm.
+- CommandMetrics: Round trip times and retries of one command address.
+- ReliableOSCClient: SimpleUDPClient that resends commands until they are confirmed.
+- ReliableReceiver: Acknowledges and deduplicates sequenced commands in a Dispatcher.
+"""
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from pythonosc.osc_message import OscMessage, ParseError
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.udp_client import SimpleUDPClient
+
+from src.utils.transferTelemetry import percentile
+
+ACK_SUFFIX = "Ack"
+DEFAULT_TIMEOUT = 0.25
+DEFAULT_RETRIES = 3
+# Longest wait of the worker, so new commands and received confirms are picked up quickly
+POLL_INTERVAL = 0.05
+RTT_SAMPLES = 1000
+
+
+class Delivery:
+    """
+    Class Delivery is a reliable command waiting for its confirm.
+
+    Attributes:
+    - address, args: The OSC message, including the sequence number if any.
+    - confirm_address: The address of the confirm.
+    - seq: The sequence number, None if the confirm is matched by address only.
+    - attempts: The number of times the command was sent.
+    - rtt: Seconds from the first send to the confirm.
+    - confirmed: Whether the command was confirmed.
+    - response: The arguments of the confirm.
+    """
+    def __init__(self, address, args, confirm_address, seq, timeout, retries):
+        self.address = address
+        self.args = args
+        self.confirm_address = confirm_address
+        self.seq = seq
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.first_sent = None
+        self.deadline = None
+        self.rtt = None
+        self.confirmed = False
+        self.response = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the command is confirmed or given up on.
+
+        Returns:
+        Whether the command was confirmed.
+        """
+        self.done.wait(timeout)
+        return self.confirmed
+
+
+class CommandMetrics:
+    """
+    Class CommandMetrics counts the deliveries of one command address.
+    """
+    def __init__(self):
+        self.sent = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rtts = deque(maxlen=RTT_SAMPLES)
+
+    def to_dict(self):
+        rtts = [1000 * rtt for rtt in self.rtts]
+        return {
+            "sent": self.sent,
+            "confirmed": self.confirmed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rtt_ms": {**{f"p{q}": percentile(rtts, q) for q in (50, 95, 99)}, "max": max(rtts, default=None)},
+        }
+
+
+class ReliableOSCClient(SimpleUDPClient):
+    """
+    Class ReliableOSCClient sends OSC commands and resends them until they are confirmed.
+
+    Description:
+    The client is a SimpleUDPClient, so send_message keeps working for the
+    messages that need no confirm. send_reliable returns right away; a worker
+    thread resends the commands whose timeout passed. Confirms either arrive on
+    the socket of the client (listen=True, for the acknowledgements of a
+    ReliableReceiver) or are passed in with confirm, for example by a
+    Dispatcher handler of the OSC server the peer answers to.
+
+    Attributes:
+    - timeout: Seconds to wait for the first confirm, doubled after every attempt.
+    - retries: The number of times a command is resent before it is given up on.
+    - metrics: CommandMetrics per command address.
+    - probe: LatencyProbe the round trip times are added to, or None.
+    - device: The name of the peer in the probe, by default its address and port.
+    """
+    def __init__(self, address, port, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, listen=False,
+                 probe=None, device=None):
+        super().__init__(address, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.listen = listen
+        self.probe = probe
+        self.device = device or f"{address}:{port}"
+        self.pending = []
+        self.next_seq = 1
+        self.metrics = defaultdict(CommandMetrics)
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send_reliable(self, address, args=None, confirm_address=None, timeout=None, retries=None):
+        """
+        Send a command and resend it until it is confirmed.
+
+        Args:
+        - address: The OSC address of the command.
+        - args: The arguments of the command.
+        - confirm_address: The address of the confirm of a peer that cannot echo sequence numbers, such
+          as "/RecordStartConfirm". By default a sequence number is appended and "<address>Ack" awaited.
+        - timeout: Seconds to wait for the first confirm, by default the timeout of the client.
+        - retries: The number of resends, by default the retries of the client.
+
+        Returns:
+        The Delivery, to wait for the confirm if needed.
+        """
+        args = list(args or [])
+        with self.condition:
+            seq = None
+            if confirm_address is None:
+                seq = self.next_seq
+                self.next_seq += 1
+                args.append(seq)
+                confirm_address = address + ACK_SUFFIX
+            delivery = Delivery(address, args, confirm_address, seq, self.timeout if timeout is None else timeout,
+                                self.retries if retries is None else retries)
+            self.pending.append(delivery)
+            self.transmit(delivery)
+            self.condition.notify()
+        return delivery
+
+    def transmit(self, delivery):
+        """
+        Send a delivery and set the deadline of its next attempt; called with the condition held.
+        """
+        now = time.perf_counter()
+        if delivery.attempts:
+            self.metrics[delivery.address].retries += 1
+        else:
+            delivery.first_sent = now
+            self.metrics[delivery.address].sent += 1
+        delivery.deadline = now + delivery.timeout * 2 ** delivery.attempts
+        delivery.attempts += 1
+        try:
+            self.send_message(delivery.address, delivery.args)
+        except OSError as e:
+            print(f"[osc] Sending {delivery.address} failed: {e}")
+
+    def confirm(self, address, *args):
+        """
+        Confirm the oldest pending command waiting for this confirm.
+
+        Args:
+        - address: The address of the confirm, such as "/RecordStartConfirm".
+        - args: The arguments of the confirm, ending with the sequence number for acknowledgements.
+
+        Returns:
+        Whether a pending command was confirmed.
+        """
+        seq = args[-1] if args and isinstance(args[-1], int) else None
+        with self.condition:
+            for delivery in self.pending:
+                if delivery.confirm_address == address and (delivery.seq is None or delivery.seq == seq):
+                    break
+            else:
+                return False
+            self.pending.remove(delivery)
+            delivery.rtt = time.perf_counter() - delivery.first_sent
+            delivery.confirmed = True
+            delivery.response = args
+            metrics = self.metrics[delivery.address]
+            metrics.confirmed += 1
+            metrics.rtts.append(delivery.rtt)
+        if self.probe is not None:
+            self.probe.record(self.device, delivery.address, delivery.rtt)
+        delivery.done.set()
+        return True
+
+    def resend_due(self):
+        """
+        Resend the commands whose timeout passed and give up on those out of retries.
+
+        Returns:
+        Seconds until the next deadline.
+        """
+        failed = []
+        with self.condition:
+            now = time.perf_counter()
+            for delivery in list(self.pending):
+                if delivery.deadline > now:
+                    continue
+                if delivery.attempts > delivery.retries:
+                    self.pending.remove(delivery)
+                    self.metrics[delivery.address].failed += 1
+                    failed.append(delivery)
+                else:
+                    self.transmit(delivery)
+            wait = min((d.deadline for d in self.pending), default=now + POLL_INTERVAL) - now
+        for delivery in failed:
+            print(f"[osc] {delivery.address} to {self._address}:{self._port} was not confirmed after "
+                  f"{delivery.attempts} attempts")
+            if self.probe is not None:
+                self.probe.record_lost(self.device)
+            delivery.done.set()
+        return max(0.0, min(wait, POLL_INTERVAL))
+
+    def run(self):
+        """
+        Worker function: resend due commands and receive acknowledgements.
+        """
+        while self.running:
+            wait = self.resend_due()
+            if not self.listen:
+                with self.condition:
+                    self.condition.wait(wait)
+                continue
+            try:
+                readable, _, _ = select.select([self._sock], [], [], wait)
+                if readable:
+                    message = OscMessage(self._sock.recv(65535))
+                    self.confirm(message.address, *message.params)
+            except (OSError, ValueError, ParseError):
+                if self.running:
+                    time.sleep(wait)
+
+    def stats(self):
+        """
+        Return the metrics of every command address, and the number of pending commands.
+        """
+        with self.condition:
+            return {"pending": len(self.pending),
+                    "commands": {address: metrics.to_dict() for address, metrics in self.metrics.items()}}
+
+    def print_stats(self):
+        for address, metrics in self.stats()["commands"].items():
+            rtt = metrics["rtt_ms"]
+            p50 = f"{rtt['p50']:.1f}" if rtt["p50"] is not None else "-"
+            p95 = f"{rtt['p95']:.1f}" if rtt["p95"] is not None else "-"
+            print(f"[osc] {address}: {metrics['sent']} sent, {metrics['confirmed']} confirmed, "
+                  f"{metrics['failed']} failed, {metrics['retries']} retries, rtt p50 {p50} ms, p95 {p95} ms")
+
+    def close(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        self.thread.join()
+        self._sock.close()
+
+
+class ReliableReceiver:
+    """
+    Class ReliableReceiver acknowledges and deduplicates sequenced commands.
+
+    Description:
+    wrap turns a Dispatcher handler into one that expects a trailing sequence
+    number. Every received command is acknowledged with "<address>Ack" and the
+    sequence number, sent back to the address it came from; the handler only
+    runs the first time a sequence number arrives. Commands without a sequence
+    number are passed to the handler unchanged.
+
+    Attributes:
+    - history: The number of sequence numbers remembered per sender and address.
+    """
+    def __init__(self, history=256):
+        self.history = history
+        self.seen = defaultdict(OrderedDict)
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def reply(self, client_address, address, *args):
+        """
+        Send a message back to the sender of a command.
+        """
+        builder = OscMessageBuilder(address=address)
+        for arg in args:
+            builder.add_arg(arg)
+        try:
+            self.sock.sendto(builder.build().dgram, client_address)
+        except OSError as e:
+            print(f"[osc] Replying {address} to {client_address} failed: {e}")
+
+    def acknowledge(self, client_address, address, seq):
+        self.reply(client_address, address + ACK_SUFFIX, seq)
+
+    def is_new(self, client_address, address, seq):
+        with self.lock:
+            seen = self.seen[(client_address, address)]
+            if seq in seen:
+                return False
+            seen[seq] = True
+            if len(seen) > self.history:
+                seen.popitem(last=False)
+            return True
+
+    def wrap(self, handler):
+        """
+        Wrap a handler; map the result with needs_reply_address=True.
+        """
+        def reliable_handler(client_address, address, *args):
+            if not args or not isinstance(args[-1], int):
+                return handler(address, *args)
+            seq = args[-1]
+            self.acknowledge(client_address, address, seq)
+            if self.is_new(client_address, address, seq):
+                return handler(address, *args[:-1])
+            print(f"[osc] Ignoring resent {address} #{seq}")
+        return reliable_handler
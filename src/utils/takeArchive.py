@@ -0,0 +1,315 @@
+"""
+File: takeArchive.py
+
+Description:
+Archival codec for blendshape takes (.bsz), to keep the dated LiveLinkFaceCSV
+folders small. A take is encoded in three steps:
+- Quantization: every channel is rounded to a multiple of 2 * error_bound, so
+  no value moves by more than error_bound. In lossless mode the float32 values
+  are kept bit for bit instead.
+- Delta encoding: every frame is stored as its difference to the previous
+  frame (an XOR of the bit patterns in lossless mode). Blendshapes change
+  slowly, so the differences are small numbers with many zero bytes.
+- Compression: the differences are stored channel by channel, with the bytes
+  of each value split into planes, and compressed with lzma or zlib.
+
+The timecodes are always stored losslessly. Lossless refers to the parsed take
+(the float32 values and float64 timecodes, see blendshapeLoader.py); the text
+formatting of the CSV is not kept.
+
+Since the 10 decimal text of the CSV cannot be rebuilt from an archive, not
+even a lossless one, --remove deletes CSVs only together with --discard-text.
+A CSV whose archive was verified is then deleted together with its sidecars (the .bshp binary copy, the .tcidx.npz timecode index and the .qc.json
+report). It is forgotten by the content store of the receiver, and its row in
+the take catalog is moved to the archive.
+
+Usage:
+    python -m src.utils.takeArchive convert D:\\LiveLinkFace\\LiveLinkFaceCSV --error-bound 0.0001
+    python -m src.utils.takeArchive convert D:\\LiveLinkFace\\LiveLinkFaceCSV --lossless --remove --discard-text --catalog D:\\takes_catalog.sqlite
+    python -m src.utils.takeArchive verify D:\\LiveLinkFace\\LiveLinkFaceCSV\\17-10-2026\\hello.csv
+
+Functions:
+- encode_take(take, error_bound, compressor): Encode a take as bytes.
+- decode_take(data): Decode bytes back into a BlendshapeTake.
+- write_archive(path, take, error_bound, compressor): Write a take to a .bsz file.
+- read_archive(path): Read a .bsz file.
+- verify(csv_path, archive): Compare a CSV with its archive.
+- convert_file(csv_path, error_bound, compressor, remove): Archive and verify one CSV.
+- remove_take(csv_path, archive, catalog): Delete an archived CSV, its sidecars and its store entry.
+- convert_directories(directories, error_bound, compressor, remove, workers, catalog): Archive all CSVs in a process pool.
+"""
+import argparse
+import lzma
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.utils.blendshapeBinary import sidecar_path
+from src.utils.blendshapeLoader import BlendshapeTake, find_takes, load_take
+from src.utils.takeCatalog import TakeCatalog
+from src.utils.takeIndex import index_path
+from src.utils.takeQC import qc_path
+from src.utils.takeStore import find_store
+
+MAGIC = b"BSZ1"
+VERSION = 1
+SUFFIX = ".bsz"
+DEFAULT_ERROR_BOUND = 1e-4
+# magic, version, compressor, value dtype, frames, channels, fps, error bound, names length
+HEADER = struct.Struct("<4sHBBIIddI")
+COMPRESSORS = {
+    "zlib": (0, lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (1, lambda data: lzma.compress(data, preset=9), lzma.decompress),
+}
+COMPRESSOR_CODES = {code: (name, decompress) for name, (code, _, decompress) in COMPRESSORS.items()}
+# Stored value types; code 0 is the lossless XOR of the float32 bit patterns
+VALUE_DTYPES = {0: np.dtype("<u4"), 1: np.dtype("<i1"), 2: np.dtype("<i2"), 3: np.dtype("<i4")}
+
+
+def archive_path(csv_path):
+    return os.path.splitext(csv_path)[0] + SUFFIX
+
+
+def xor_delta(bits):
+    """
+    XOR every row of an unsigned integer array with the previous row.
+    """
+    delta = bits.copy()
+    delta[1:] ^= bits[:-1]
+    return delta
+
+
+def undo_xor_delta(delta):
+    return np.bitwise_xor.accumulate(delta, axis=0)
+
+
+def shuffle(array):
+    """
+    Lay out an array channel by channel with the bytes of each value in planes.
+    """
+    columns = np.ascontiguousarray(array.T)
+    return columns.view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+
+
+def unshuffle(data, dtype, shape):
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    columns = np.ascontiguousarray(planes.T).view(dtype).reshape(shape[::-1])
+    return np.ascontiguousarray(columns.T)
+
+
+def smallest_dtype(delta):
+    """
+    Return the code of the smallest signed integer type that holds all differences.
+    """
+    low, high = (int(delta.min()), int(delta.max())) if delta.size else (0, 0)
+    for code in (1, 2, 3):
+        info = np.iinfo(VALUE_DTYPES[code])
+        if info.min <= low and high <= info.max:
+            return code
+    raise ValueError("Quantized differences do not fit in int32, use a larger error bound")
+
+
+def encode_take(take, error_bound=DEFAULT_ERROR_BOUND, compressor="lzma"):
+    """
+    Encode a take for archiving.
+
+    Args:
+    - take (BlendshapeTake): The take to encode.
+    - error_bound (float): The largest allowed error of a value, or None for lossless.
+    - compressor (str): "lzma" (smallest) or "zlib" (fastest).
+
+    Returns:
+    The encoded take as bytes.
+    """
+    code, compress, _ = COMPRESSORS[compressor]
+    values = np.ascontiguousarray(take.values, dtype=np.float32)
+    frames, channels = values.shape
+
+    if error_bound is None:
+        value_dtype = 0
+        delta = xor_delta(values.view(np.uint32))
+    else:
+        quantized = np.rint(values.astype(np.float64) / (2 * error_bound)).astype(np.int64)
+        delta = np.diff(quantized, axis=0, prepend=np.zeros((1, channels), dtype=np.int64))
+        value_dtype = smallest_dtype(delta)
+        delta = delta.astype(VALUE_DTYPES[value_dtype])
+
+    timecodes = xor_delta(np.ascontiguousarray(take.timecodes, dtype=np.float64).view(np.uint64).reshape(-1, 1))
+    names = "\n".join(take.names).encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, code, value_dtype, frames, channels, float(take.fps),
+                         float(error_bound or 0.0), len(names))
+    return header + names + compress(shuffle(timecodes) + shuffle(delta))
+
+
+def decode_take(data):
+    """
+    Decode a take encoded with encode_take.
+    """
+    magic, version, code, value_dtype, frames, channels, fps, error_bound, names_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} blendshape archive")
+    names_end = HEADER.size + names_length
+    names = data[HEADER.size:names_end].decode("utf-8")
+    payload = COMPRESSOR_CODES[code][1](data[names_end:])
+
+    timecode_bytes = 8 * frames
+    timecodes = undo_xor_delta(unshuffle(payload[:timecode_bytes], np.dtype("<u8"), (frames, 1)))
+    delta = unshuffle(payload[timecode_bytes:], VALUE_DTYPES[value_dtype], (frames, channels))
+    if value_dtype == 0:
+        values = undo_xor_delta(delta).view(np.float32)
+    else:
+        values = (np.cumsum(delta, axis=0, dtype=np.int64) * (2 * error_bound)).astype(np.float32)
+    return BlendshapeTake(names.split("\n") if names else [], timecodes.view(np.float64).reshape(-1), values, fps)
+
+
+def write_archive(path, take, error_bound=DEFAULT_ERROR_BOUND, compressor="lzma"):
+    temp_path = path + ".part"
+    with open(temp_path, 'wb') as f:
+        f.write(encode_take(take, error_bound, compressor))
+    os.replace(temp_path, path)
+
+
+def read_archive(path):
+    with open(path, 'rb') as f:
+        return decode_take(f.read())
+
+
+def verify(csv_path, archive=None):
+    """
+    Compare a CSV with its archive.
+
+    Returns:
+    A dict with the largest value error, the error bound of the archive and
+    whether the names, the timecodes and the error are all as expected.
+    """
+    archive = archive or archive_path(csv_path)
+    original, archived = load_take(csv_path), read_archive(archive)
+    with open(archive, 'rb') as f:
+        error_bound = HEADER.unpack_from(f.read(HEADER.size))[7]
+
+    same_shape = original.values.shape == archived.values.shape
+    max_error = float(np.abs(original.values.astype(np.float64) - archived.values).max()) if same_shape and len(original) else 0.0
+    # The float32 rounding of the reconstructed values adds to the quantization error
+    tolerance = error_bound + float(np.abs(original.values).max() if len(original) else 0.0) * 2 ** -23
+    ok = (same_shape and original.names == archived.names
+          and np.array_equal(original.timecodes, archived.timecodes)
+          and (max_error == 0.0 if error_bound == 0.0 else max_error <= tolerance))
+    return {"take": csv_path, "ok": bool(ok), "max_error": max_error, "error_bound": error_bound}
+
+
+def convert_file(csv_path, error_bound=DEFAULT_ERROR_BOUND, compressor="lzma", remove=False):
+    """
+    Archive a CSV next to it and verify the archive.
+
+    Args:
+    - remove (bool): Delete the CSV once the archive has been verified.
+
+    Returns:
+    A dict with the sizes and the verification result.
+    """
+    path = archive_path(csv_path)
+    write_archive(path, load_take(csv_path), error_bound, compressor)
+    result = verify(csv_path, path)
+    result.update({"csv_bytes": os.path.getsize(csv_path), "archive_bytes": os.path.getsize(path)})
+    if remove and result["ok"]:
+        remove_take(csv_path, path)
+    return result
+
+
+def remove_take(csv_path, archive, catalog=None, store=None):
+    """
+    Delete a CSV that was archived, with everything derived from it.
+
+    Args:
+    - csv_path (str): The CSV to delete.
+    - archive (str): The verified archive of the CSV.
+    - catalog (TakeCatalog): The catalog whose row of the CSV is moved to the archive, if any.
+    - store (TakeStore): The content store the CSV is in, by default found from its path.
+
+    Description:
+    The binary sidecar, the timecode index and the QC report would otherwise
+    outlive the CSV and be read in its place by the slicer and the similarity index.
+    """
+    store = store or find_store(csv_path)
+    if store is not None:
+        store.remove(csv_path)
+    for path in (sidecar_path(csv_path), index_path(csv_path), qc_path(csv_path), csv_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    if catalog is not None:
+        catalog.move(csv_path, archive)
+
+
+def convert_directories(directories, error_bound=DEFAULT_ERROR_BOUND, compressor="lzma", remove=False, workers=None,
+                        catalog=None):
+    """
+    Archive all CSVs below the given directories, in a process pool over all cores.
+
+    Description:
+    The verified CSVs are removed afterwards in this process, one after the
+    other, so the content store and the catalog are updated by a single writer.
+    """
+    paths = find_takes(directories)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(convert_file, paths, [error_bound] * len(paths), [compressor] * len(paths),
+                                    [False] * len(paths), chunksize=8))
+    if remove:
+        stores = {}
+        for result in results:
+            if result["ok"]:
+                directory = os.path.dirname(result["take"])
+                if directory not in stores:
+                    stores[directory] = find_store(result["take"])
+                store = stores[directory]
+                remove_take(result["take"], archive_path(result["take"]), catalog, store)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive Live Link Face takes in the compressed .bsz format.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Archive all CSVs below the given directories")
+    convert.add_argument('directories', nargs='+', help="Dated LiveLinkFaceCSV directories, searched recursively")
+    convert.add_argument('--error-bound', type=float, default=DEFAULT_ERROR_BOUND, help="Largest allowed error of a value")
+    convert.add_argument('--lossless', action='store_true', help="Keep the values bit for bit with the float32 values the loader parses, not the CSV text")
+    convert.add_argument('--compressor', choices=sorted(COMPRESSORS), default="lzma", help="General purpose compressor")
+    convert.add_argument('--remove', action='store_true', help="Delete every CSV whose archive was verified")
+    convert.add_argument('--discard-text', action='store_true',
+                         help="Confirm that --remove may delete the only full precision text of the takes")
+    convert.add_argument('--catalog', default=None, help="Take catalog whose rows of the removed CSVs are moved to the archives")
+    convert.add_argument('--workers', type=int, default=None, help="Number of processes, by default one per core")
+    check = commands.add_parser("verify", help="Compare CSVs with their archives")
+    check.add_argument('paths', nargs='+', help="CSV files or directories")
+    args = parser.parse_args()
+    if args.command == "convert" and args.remove and not args.discard_text:
+        parser.error("--remove deletes the CSV text, which the archives do not keep (not even with --lossless); "
+                     "add --discard-text to remove the CSVs anyway")
+
+    start = time.perf_counter()
+    if args.command == "convert":
+        catalog = TakeCatalog(args.catalog) if args.catalog else None
+        results = convert_directories(args.directories, None if args.lossless else args.error_bound,
+                                      args.compressor, args.remove, args.workers, catalog)
+        csv_bytes = sum(r["csv_bytes"] for r in results)
+        archive_bytes = sum(r["archive_bytes"] for r in results)
+        print(f"Archived {len(results)} takes in {time.perf_counter() - start:.2f}s: {csv_bytes / 1e6:.1f} MB -> "
+              f"{archive_bytes / 1e6:.1f} MB ({csv_bytes / max(archive_bytes, 1):.1f}x)")
+    else:
+        paths = [p for p in args.paths if os.path.isfile(p)] + find_takes([p for p in args.paths if os.path.isdir(p)])
+        results = [verify(path) for path in paths if os.path.exists(archive_path(path))]
+        print(f"Verified {len(results)} takes in {time.perf_counter() - start:.2f}s")
+
+    for result in results:
+        if not result["ok"]:
+            print(f"{result['take']}: verification failed, max error {result['max_error']:.3g} "
+                  f"(bound {result['error_bound']:.3g})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+File: takeCatalog.py
+
+Description:
+This file defines the TakeCatalog class, a local SQLite database of every file
+captured by the pipeline: the blendshape CSVs and reference videos of the file
+receiver, the optical camera recordings of FFmpegRecorder, the OBS recordings
+and the Shogun captures. Each file is stored with its gloss, take number,
+modality, source, recording device and recording time, so all files of a gloss
+are found with one indexed query instead of walking the dated folders. The
+device tells apart the takes of several iPhones recording the same gloss.
+
+The components add their files when they write them, so the catalog is kept up
+to date without rescanning. Folders written by other programs, such as the OBS
+save folder, are scanned incrementally: only files changed since the previous
+scan are added. The database is in WAL mode, so the file receiver and the
+controller can write to it from their own processes while it is being read.
+
+Usage:
+    python -m src.utils.takeCatalog D:\\takes_catalog.sqlite --gloss HALLO
+    python -m src.utils.takeCatalog D:\\takes_catalog.sqlite --scan D:\\VideoCapture\\Canon1 video ffmpeg
+
+Classes:
+- TakeCatalog: The SQLite catalog of captured files.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    gloss TEXT NOT NULL,
+    take INTEGER NOT NULL,
+    modality TEXT NOT NULL,
+    source TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    size INTEGER,
+    device TEXT
+);
+CREATE INDEX IF NOT EXISTS files_gloss ON files (gloss, take);
+CREATE INDEX IF NOT EXISTS files_recorded ON files (recorded);
+CREATE INDEX IF NOT EXISTS files_modality ON files (modality, recorded);
+CREATE TABLE IF NOT EXISTS scans (
+    directory TEXT NOT NULL,
+    source TEXT NOT NULL,
+    scanned REAL NOT NULL,
+    PRIMARY KEY (directory, source)
+);
+"""
+COLUMNS = "path, gloss, take, modality, source, recorded, size, device"
+# "<gloss>_rerecorded_rerecorded" (file receiver) or "<gloss>_2" (FFmpegRecorder)
+TAKE_SUFFIX = re.compile(r"^(?P<gloss>.*?)(?P<rerecorded>(_rerecorded)*)(_(?P<counter>\d+))?$")
+
+
+def split_take(name):
+    """
+    Split a file name without extension into its gloss and take number.
+    """
+    match = TAKE_SUFFIX.match(name)
+    take = len(match.group("rerecorded")) // len("_rerecorded")
+    if match.group("counter"):
+        take += int(match.group("counter"))
+    return match.group("gloss") or name, take
+
+
+class TakeCatalog:
+    """
+    Class TakeCatalog keeps the SQLite catalog of captured files.
+
+    Attributes:
+    - db_path: The SQLite database file.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Catalogs created before the device column
+        columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(files)")]
+        if "device" not in columns:
+            self.connection.execute("ALTER TABLE files ADD COLUMN device TEXT")
+            self.connection.commit()
+        self.lock = threading.Lock()
+
+    def add(self, path, modality, source, gloss=None, take=None, recorded=None, device=None):
+        """
+        Add or update a captured file.
+
+        Args:
+        - path (str): The path of the file.
+        - modality (str): The kind of data, such as "blendshapes", "face_video", "video" or "mocap".
+        - source (str): The component that wrote the file, such as "livelinkface", "ffmpeg", "obs" or "shogun".
+        - gloss (str): The gloss of the take, by default taken from the file name.
+        - take (int): The take number, by default taken from the file name.
+        - recorded (float): The time of the recording, by default the modification time of the file.
+        - device (str): The device that recorded the file, such as the name of an iPhone, if known.
+        """
+        name_gloss, name_take = split_take(os.path.splitext(os.path.basename(path))[0])
+        try:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            # For example a Shogun capture on another machine
+            size, mtime = None, time.time()
+        row = (os.path.abspath(path) if os.path.exists(path) else path, gloss or name_gloss,
+               name_take if take is None else take, modality, source, recorded or mtime, size, device)
+        with self.lock:
+            self.connection.execute(f"INSERT OR REPLACE INTO files ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self.connection.commit()
+
+    def remove(self, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM files WHERE path IN (?, ?)", (path, os.path.abspath(path)))
+            self.connection.commit()
+
+    def move(self, old_path, new_path, modality=None):
+        """
+        Follow a file that was renamed or replaced, keeping its gloss, take and device.
+
+        Args:
+        - old_path (str): The path the file was added with.
+        - new_path (str): The new path of the file.
+        - modality (str): The new modality, for example when a CSV is replaced by its archive.
+
+        Returns:
+        Whether the file was in the catalog.
+        """
+        new = os.path.abspath(new_path) if os.path.exists(new_path) else new_path
+        try:
+            size = os.path.getsize(new_path)
+        except OSError:
+            size = None
+        with self.lock:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (new,))
+            cursor = self.connection.execute(
+                "UPDATE files SET path = ?, size = COALESCE(?, size), modality = COALESCE(?, modality) "
+                "WHERE path IN (?, ?)", (new, size, modality, old_path, os.path.abspath(old_path)))
+            self.connection.commit()
+            return cursor.rowcount > 0
+
+    def scan_directory(self, directory, modality, source, extensions=(".mp4", ".mkv", ".mov", ".csv", ".mcp")):
+        """
+        Add the files written to a directory since its previous scan.
+
+        Returns:
+        The number of files added.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT scanned FROM scans WHERE directory = ? AND source = ?",
+                                          (directory, source)).fetchone()
+        since = row["scanned"] if row else 0.0
+        scan_time = time.time()
+
+        rows = []
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.lower().endswith(extensions) or name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime < since:
+                    continue
+                gloss, take = split_take(os.path.splitext(name)[0])
+                rows.append((os.path.abspath(path), gloss, take, modality, source, stat.st_mtime, stat.st_size, None))
+
+        with self.lock:
+            self.connection.executemany(f"INSERT OR REPLACE INTO files ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO scans VALUES (?, ?, ?)", (directory, source, scan_time))
+            self.connection.commit()
+        return len(rows)
+
+    def find(self, gloss=None, modality=None, source=None, since=None, until=None, device=None):
+        """
+        Return the files matching all given criteria, oldest first, as dicts.
+        """
+        conditions, values = [], []
+        for column, operator, value in (("gloss", "=", gloss), ("modality", "=", modality), ("source", "=", source),
+                                        ("recorded", ">=", since), ("recorded", "<", until), ("device", "=", device)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                values.append(value)
+        query = "SELECT * FROM files"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(query + " ORDER BY recorded", values)]
+
+    def files_for_gloss(self, gloss):
+        return self.find(gloss=gloss)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or fill the catalog of captured takes.")
+    parser.add_argument('db_path', help="The SQLite catalog")
+    parser.add_argument('--gloss', default=None, help="List all files of a gloss")
+    parser.add_argument('--scan', nargs=3, metavar=("DIRECTORY", "MODALITY", "SOURCE"), action='append', default=[],
+                        help="Add the new files of a directory, for example an existing archive")
+    args = parser.parse_args()
+
+    catalog = TakeCatalog(args.db_path)
+    for directory, modality, source in args.scan:
+        start = time.perf_counter()
+        count = catalog.scan_directory(directory, modality, source)
+        print(f"Added {count} files from {directory} in {time.perf_counter() - start:.2f}s")
+    if args.gloss:
+        start = time.perf_counter()
+        files = catalog.files_for_gloss(args.gloss)
+        for f in files:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(f['recorded']))}  take {f['take']:2d}  "
+                  f"{f['modality']:<12} {f['source']:<12} {f['device'] or '-':<8} {f['path']}")
+        print(f"{len(files)} files in {1000 * (time.perf_counter() - start):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
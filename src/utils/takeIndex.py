@@ -0,0 +1,250 @@
+"""
+File: takeIndex.py
+
+Description:
+This file defines the timecode index of a blendshape take, and slice_take,
+which returns the frames of a take between two timecodes without reading the
+rest of it.
+
+The index of a CSV maps the timecode of every frame to the byte range of its
+line. It is stored next to the CSV (<name>.tcidx.npz), written by the file
+receiver for every received take and built on first use for older takes. A
+slice of a CSV then reads and parses only the bytes of the requested lines,
+and a slice of a binary take (see blendshapeBinary.py) only touches the
+requested rows of its memory map. The lookup itself is a binary search over
+the timecodes, and loaded indexes are cached. Timecodes that go backwards (a
+re-synced clock, a take over midnight) make a binary search unreliable; the
+frames of such a take are selected with a mask over all timecodes instead.
+
+Classes:
+- TimecodeIndex: Timecodes and line byte ranges of the frames of a CSV.
+
+Functions:
+- parse_timecode(timecode, fps): Convert "HH:MM:SS:FF.mmm" to seconds.
+- build_index(csv_path, timecodes, fps, spans, names): Build and save the index of a CSV.
+- frame_range(timecodes, start, end): The first and one past the last frame in a range, for increasing timecodes.
+- select_frames(timecodes, start, end): The frames in a range as a slice, or an index array.
+- load_index(csv_path): Load the index of a CSV, building it if needed.
+- slice_take(take, start_tc, end_tc, fps): The frames between two timecodes.
+"""
+import functools
+import os
+
+import numpy as np
+
+from src.utils.blendshapeLoader import (DEFAULT_FPS, LEADING_FIELDS, TIMECODE_FIELDS, BlendshapeTake,
+                                        line_spans, parse_rows, timecode_seconds)
+from src.utils.blendshapeBinary import BinaryTake, SUFFIX as BINARY_SUFFIX, sidecar_path
+
+INDEX_SUFFIX = ".tcidx.npz"
+
+
+def index_path(csv_path):
+    return os.path.splitext(csv_path)[0] + INDEX_SUFFIX
+
+
+def parse_timecode(timecode, fps=DEFAULT_FPS):
+    """
+    Convert a "HH:MM:SS:FF.mmm" timecode to seconds, numbers are taken as seconds.
+    """
+    if isinstance(timecode, str):
+        return float(timecode_seconds([[float(v) for v in timecode.split(":")]], fps)[0])
+    return float(timecode)
+
+
+class TimecodeIndex:
+    """
+    Class TimecodeIndex maps the timecodes of a CSV to the byte ranges of its lines.
+
+    Attributes:
+    - timecodes: float64 timecode of every frame in seconds.
+    - starts, ends: int64 byte offsets of the line of every frame.
+    - names: The channel names from the header of the CSV.
+    - fps: The frame rate the timecodes were converted with.
+    - increasing: Whether the timecodes never go backwards, so they can be binary searched.
+    """
+    def __init__(self, timecodes, starts, ends, names, fps=DEFAULT_FPS):
+        self.timecodes = timecodes
+        self.starts = starts
+        self.ends = ends
+        self.names = names
+        self.fps = fps
+        self.increasing = increasing(timecodes)
+
+    def __len__(self):
+        return len(self.timecodes)
+
+    def frame_range(self, start_tc, end_tc):
+        """
+        Return the first and one past the last frame between two timecodes, inclusive.
+        """
+        return frame_range(self.timecodes, parse_timecode(start_tc, self.fps), parse_timecode(end_tc, self.fps),
+                           self.increasing)
+
+    def save(self, path):
+        temp_path = path + ".part.npz"
+        np.savez(temp_path, timecodes=self.timecodes, starts=self.starts, ends=self.ends,
+                 names=np.array(self.names), fps=np.array(self.fps))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["timecodes"], data["starts"], data["ends"], data["names"].tolist(), float(data["fps"]))
+
+
+def increasing(timecodes):
+    return bool(np.all(timecodes[1:] >= timecodes[:-1]))
+
+
+def frame_range(timecodes, start, end, is_increasing=None):
+    """
+    Return the first and one past the last frame between two timecodes, by binary search.
+
+    Raises:
+    ValueError if the timecodes go backwards somewhere, use select_frames for those takes.
+    """
+    if not (increasing(timecodes) if is_increasing is None else is_increasing):
+        raise ValueError("The timecodes go backwards, a range of frames is not contiguous")
+    return int(np.searchsorted(timecodes, start, 'left')), int(np.searchsorted(timecodes, end, 'right'))
+
+
+def select_frames(timecodes, start, end, is_increasing=None):
+    """
+    Return the frames between two timecodes, inclusive.
+
+    Returns:
+    A slice when the timecodes never go backwards, otherwise an int64 array with
+    the index of every frame in the range, in the order of the take.
+    """
+    if increasing(timecodes) if is_increasing is None else is_increasing:
+        return slice(*frame_range(timecodes, start, end, True))
+    timecodes = np.asarray(timecodes)
+    return np.flatnonzero((timecodes >= start) & (timecodes <= end))
+
+
+def build_index(csv_path, timecodes=None, fps=DEFAULT_FPS, spans=None, names=None):
+    """
+    Build the timecode index of a CSV and save it next to the file.
+
+    Args:
+    - csv_path (str): The CSV file.
+    - timecodes: The timecodes of the frames when they are already parsed, for
+      example by the file receiver, so the lines do not need to be parsed again.
+    - fps (int): The frame rate of the take.
+    - spans: The start and end byte offsets of the line of every frame (see
+      StreamParser.spans), with names the channel names. With timecodes, the
+      CSV is then not read at all.
+
+    Returns:
+    The TimecodeIndex.
+    """
+    if timecodes is not None and spans is not None and names is not None and len(spans[0]) == len(timecodes):
+        index = TimecodeIndex(np.asarray(timecodes, dtype=np.float64), np.asarray(spans[0], dtype=np.int64),
+                              np.asarray(spans[1], dtype=np.int64), list(names), fps)
+        index.save(index_path(csv_path))
+        return index
+
+    with open(csv_path, 'rb') as f:
+        data = f.read()
+    header_end = data.find(b"\n") + 1
+    names = data[:header_end].decode("utf-8").strip().split(",")[2:]
+    starts, ends = line_spans(data, header_end) if header_end else (np.zeros(0, np.int64), np.zeros(0, np.int64))
+
+    if timecodes is None or len(timecodes) != len(starts):
+        rows = parse_rows(data[header_end:], len(names))
+        if len(rows) == len(starts):
+            timecodes = timecode_seconds(rows[:, :TIMECODE_FIELDS], fps)
+        else:
+            # Malformed lines are left out of the index
+            keep, parsed = [], []
+            for i, (start, end) in enumerate(zip(starts, ends)):
+                row = parse_rows(data[start:end], len(names))
+                if len(row):
+                    keep.append(i)
+                    parsed.append(row[0, :TIMECODE_FIELDS])
+            starts, ends = starts[keep], ends[keep]
+            timecodes = timecode_seconds(np.array(parsed).reshape(-1, TIMECODE_FIELDS), fps)
+
+    index = TimecodeIndex(np.asarray(timecodes, dtype=np.float64), starts.astype(np.int64), ends.astype(np.int64), names, fps)
+    index.save(index_path(csv_path))
+    return index
+
+
+@functools.lru_cache(maxsize=256)
+def cached_index(csv_path, mtime_ns):
+    path = index_path(csv_path)
+    if os.path.exists(path) and os.stat(path).st_mtime_ns >= mtime_ns:
+        return TimecodeIndex.load(path)
+    return build_index(csv_path)
+
+
+@functools.lru_cache(maxsize=256)
+def cached_binary(path, mtime_ns):
+    return BinaryTake(path)
+
+
+def load_index(csv_path):
+    """
+    Load the index of a CSV, building it when it is missing or older than the CSV.
+    """
+    return cached_index(os.path.abspath(csv_path), os.stat(csv_path).st_mtime_ns)
+
+
+def slice_take(take, start_tc, end_tc, fps=DEFAULT_FPS):
+    """
+    Return the frames of a take between two timecodes.
+
+    Args:
+    - take: A path to a CSV or binary (.bshp) take, a BinaryTake or a BlendshapeTake.
+    - start_tc, end_tc: The first and last timecode to include, as
+      "HH:MM:SS:FF.mmm" strings or seconds.
+    - fps (int): The frame rate of the take.
+
+    Description:
+    For a CSV path the binary sidecar is used when there is one, otherwise
+    only the lines in the range are read, through the timecode index.
+
+    Returns:
+    A BlendshapeTake with the frames in the range.
+    """
+    start, end = parse_timecode(start_tc, fps), parse_timecode(end_tc, fps)
+
+    if isinstance(take, str):
+        binary = take if take.endswith(BINARY_SUFFIX) else sidecar_path(take)
+        if os.path.exists(binary):
+            take = cached_binary(os.path.abspath(binary), os.stat(binary).st_mtime_ns)
+        else:
+            index = load_index(take)
+            frames = select_frames(index.timecodes, start, end, index.increasing)
+            first, last = frame_bounds(frames)
+            if first >= last:
+                return BlendshapeTake(index.names, np.zeros(0), np.zeros((0, len(index.names)), dtype=np.float32), fps)
+            with open(take, 'rb') as f:
+                f.seek(index.starts[first])
+                data = f.read(index.ends[last - 1] - index.starts[first])
+            if not isinstance(frames, slice):
+                # Only the selected lines of the span that was read
+                base = index.starts[first]
+                data = b"".join(data[s - base:e - base] for s, e in zip(index.starts[frames], index.ends[frames]))
+            rows = parse_rows(data, len(index.names))
+            return BlendshapeTake(index.names, timecode_seconds(rows[:, :TIMECODE_FIELDS], fps),
+                                  rows[:, LEADING_FIELDS:].astype(np.float32), fps)
+
+    frames = select_frames(take.timecodes, start, end)
+    if isinstance(take, BinaryTake):
+        first, last = frame_bounds(frames)
+        values = take.values(first, last)
+        if not isinstance(frames, slice):
+            values = values[frames - first]
+        return BlendshapeTake(take.names, np.array(take.timecodes[frames]), values, take.fps)
+    return BlendshapeTake(take.names, take.timecodes[frames], take.values[frames], take.fps)
+
+
+def frame_bounds(frames):
+    """
+    Return the first and one past the last frame of a selection of select_frames.
+    """
+    if isinstance(frames, slice):
+        return frames.start, frames.stop
+    return (int(frames[0]), int(frames[-1]) + 1) if len(frames) else (0, 0)
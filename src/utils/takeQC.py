@@ -0,0 +1,152 @@
+"""
+File: takeQC.py
+
+Description:
+Quality checks for Live Link Face blendshape takes. A take is checked for:
+- Timecode gaps: frames missing between consecutive timecodes.
+- Timecode jumps: timecodes that go backwards.
+- Duplicated frames: consecutive frames with the same timecode.
+- Frozen spans: runs of frames in which all channels repeat the previous
+  frame exactly, which is what ARKit sends when the face tracking freezes.
+
+All checks are NumPy operations over the whole take (differences between
+consecutive frames and run lengths of the resulting masks), so checking a take
+costs a few milliseconds. The file receiver checks every received CSV and
+writes the report next to it (<name>.qc.json). Existing takes are checked in
+batch, in parallel over all cores:
+
+    python -m src.utils.takeQC D:\\LiveLinkFace\\LiveLinkFaceCSV\\17-10-2026 --workers 8
+
+Functions:
+- check_take(take, freeze_frames): Run all checks on a BlendshapeTake.
+- check_file(csv_path, freeze_frames): Check a CSV and write its report.
+- check_directory(directory, workers, freeze_frames): Check all CSVs below a directory.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.utils.blendshapeLoader import find_takes, load_take
+from src.utils.blendshapeBinary import open_binary, sidecar_path
+
+QC_SUFFIX = ".qc.json"
+# Shortest run of repeated frames reported as frozen, 0.1s at 60 fps
+FREEZE_FRAMES = 6
+
+
+def qc_path(csv_path):
+    return os.path.splitext(csv_path)[0] + QC_SUFFIX
+
+
+def runs(mask):
+    """
+    Return the start and end (exclusive) of every run of True values in mask.
+    """
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def check_take(take, freeze_frames=FREEZE_FRAMES):
+    """
+    Run all quality checks on a take.
+
+    Args:
+    - take (BlendshapeTake): The take to check.
+    - freeze_frames (int): The shortest run of repeated frames reported as frozen.
+
+    Returns:
+    A dict with the findings, "ok" is False when anything was found.
+    """
+    timecodes, values = take.timecodes, take.values
+    steps = np.rint(np.diff(timecodes) * take.fps)
+
+    # Frame i + 1 follows a gap, a jump back or a duplicate of frame i
+    gaps = np.flatnonzero(steps > 1)
+    jumps = np.flatnonzero(steps < 0)
+    duplicates = np.flatnonzero(steps == 0)
+
+    # A frame is repeated when all of its channels equal those of the previous frame
+    repeated = np.all(values[1:] == values[:-1], axis=1) if len(values) > 1 else np.zeros(0, dtype=bool)
+    starts, ends = runs(repeated)
+    # A run of n repeats covers n + 1 identical frames, starting at the run start
+    long_enough = ends - starts + 1 >= freeze_frames
+    starts, ends = starts[long_enough], ends[long_enough] + 1
+
+    def timecode(frame):
+        return float(timecodes[frame])
+
+    report = {
+        "frames": int(len(timecodes)),
+        "duration": float(timecodes[-1] - timecodes[0]) if len(timecodes) else 0.0,
+        "fps": take.fps,
+        "dropped_frames": int((steps[gaps] - 1).sum()),
+        "gaps": [{"frame": int(i + 1), "timecode": timecode(i + 1), "missing": int(steps[i] - 1)} for i in gaps],
+        "timecode_jumps": [{"frame": int(i + 1), "timecode": timecode(i + 1), "from": timecode(i)} for i in jumps],
+        "duplicated_frames": [{"frame": int(i + 1), "timecode": timecode(i + 1)} for i in duplicates],
+        "frozen_frames": int((ends - starts).sum()),
+        "frozen_spans": [
+            {"start": int(s), "end": int(e), "frames": int(e - s), "start_timecode": timecode(s), "end_timecode": timecode(e - 1)}
+            for s, e in zip(starts, ends)
+        ],
+    }
+    report["ok"] = not (len(gaps) or len(jumps) or len(duplicates) or len(starts))
+    return report
+
+
+def write_report(csv_path, report):
+    path = qc_path(csv_path)
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def check_file(csv_path, freeze_frames=FREEZE_FRAMES):
+    """
+    Check a CSV take, from its binary sidecar when there is one, and write the report.
+
+    Returns:
+    The report, with the path of the take.
+    """
+    binary = sidecar_path(csv_path)
+    take = open_binary(binary).to_take() if os.path.exists(binary) else load_take(csv_path)
+    report = check_take(take, freeze_frames)
+    report["take"] = csv_path
+    write_report(csv_path, report)
+    return report
+
+
+def check_directory(directory, workers=None, freeze_frames=FREEZE_FRAMES):
+    """
+    Check all CSV takes below a directory in a process pool.
+
+    Returns:
+    The reports of all takes.
+    """
+    paths = find_takes(directory)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(check_file, paths, [freeze_frames] * len(paths), chunksize=16))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check Live Link Face takes for dropped, duplicated and frozen frames.")
+    parser.add_argument('directory', help="Directory with the CSV takes, searched recursively")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes, by default one per core")
+    parser.add_argument('--freeze-frames', type=int, default=FREEZE_FRAMES, help="Shortest run of repeated frames reported as frozen")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reports = check_directory(args.directory, args.workers, args.freeze_frames)
+    for report in reports:
+        if not report["ok"]:
+            print(f"{report['take']}: {report['dropped_frames']} dropped, {len(report['timecode_jumps'])} jumps, "
+                  f"{len(report['duplicated_frames'])} duplicated, {report['frozen_frames']} frozen frames")
+    print(f"Checked {len(reports)} takes in {time.perf_counter() - start:.2f}s, "
+          f"{sum(not r['ok'] for r in reports)} with problems")
+
+
+if __name__ == "__main__":
+    main()
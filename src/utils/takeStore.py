@@ -0,0 +1,292 @@
+"""
+File: takeStore.py
+
+Description:
+This file defines the TakeStore class, a content addressed store for the files
+written by the file receiver. When the iPhone sends the same take again, the
+receiver would write a second full copy under a "_rerecorded" name. The store
+recognises the content by its hash and links the new name to the existing file
+instead, so every distinct payload is stored once.
+
+The hash of every stored file is appended to an index file in the save
+directory (content_index.jsonl), which is loaded into a dict on start up, so
+deciding whether a payload is a duplicate is a single lookup.
+
+Classes:
+- HashingFile: File wrapper that hashes everything written through it.
+- TakeStore: Content addressed store of the files in one save directory.
+
+Functions:
+- find_store(path): The TakeStore of the save directory a file is in.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+INDEX_NAME = "content_index.jsonl"
+
+
+def new_hash():
+    return hashlib.sha256()
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """
+    Hash the content of a file that was not hashed while it was received.
+    """
+    h = new_hash()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def move_file(src, dst):
+    """
+    Move a file into place, also when src is on another drive.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.move(src, dst)
+
+
+def find_store(path):
+    """
+    Return the TakeStore of the save directory a file is in, or None if it has none.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        if os.path.exists(os.path.join(directory, INDEX_NAME)):
+            return TakeStore(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+class HashingFile:
+    """
+    Class HashingFile wraps a file and hashes all data written through it.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.hash = new_hash()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class TakeStore:
+    """
+    Class TakeStore keeps the files in a save directory unique by content.
+
+    Description:
+    A new file is moved into place and its hash recorded. A file whose hash is
+    already known is not stored again: its name becomes a hard link to the
+    existing file, or, where the file system does not support hard links, an
+    entry in the index that points to the existing file (see resolve).
+
+    When a file is replaced by other content, its old hash is forgotten, and
+    names that only point to it in the index get a copy of the old content
+    first. Before a name is linked to a stored file, the stored file is checked
+    to still hold that content: by its size and modification time, or by
+    hashing it again when those changed. A file deleted from the save
+    directory (for example after archiving) is forgotten with remove.
+
+    Attributes:
+    - root: The save directory the index file lives in.
+    - by_hash: Path of the stored file, by content hash.
+    - by_path: Content hash, by the path of every file holding stored content.
+    - mtimes: Modification time in nanoseconds of every file in by_path when it was stored.
+    - aliases: Path of the stored file, by the name of a duplicate without a link.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.by_hash = {}
+        self.by_path = {}
+        self.mtimes = {}
+        self.aliases = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Load the hash to path lookup table by replaying the index file.
+        """
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                path = entry["path"]
+                self.forget(path)
+                self.aliases.pop(path, None)
+                if entry.get("removed"):
+                    continue
+                if entry.get("link") == "manifest":
+                    self.aliases[path] = entry["duplicate_of"]
+                else:
+                    self.remember(entry["hash"], path, entry.get("mtime_ns"), replace=entry.get("link") is None)
+
+    def remember(self, digest, path, mtime_ns, replace=True):
+        """
+        Record that path holds the content with this digest.
+        """
+        self.by_path[path] = digest
+        self.mtimes[path] = mtime_ns
+        if replace:
+            self.by_hash[digest] = path
+        else:
+            self.by_hash.setdefault(digest, path)
+
+    def forget(self, path):
+        """
+        Forget the content of path, before other content is moved onto it.
+        """
+        digest = self.by_path.pop(path, None)
+        self.mtimes.pop(path, None)
+        if digest is not None and self.by_hash.get(digest) == path:
+            del self.by_hash[digest]
+
+    def lookup(self, digest, size):
+        """
+        Return the stored file with this content, after checking it was not changed since.
+        """
+        existing = self.by_hash.get(digest)
+        if existing is None:
+            return None
+        try:
+            stat = os.stat(existing)
+        except OSError:
+            self.forget(existing)
+            return None
+        if stat.st_size != size:
+            self.forget(existing)
+            return None
+        if self.mtimes.get(existing) != stat.st_mtime_ns:
+            # Changed, or stored before modification times were indexed: compare the content itself
+            if hash_file(existing) != digest:
+                self.forget(existing)
+                return None
+            self.mtimes[existing] = stat.st_mtime_ns
+        return existing
+
+    def release(self, file_path):
+        """
+        Prepare file_path to be replaced by other content; called with the lock held.
+
+        Description:
+        The old content of file_path is forgotten. Names that point to file_path in
+        the index (no hard links) would lose their content, so the first of them
+        gets a copy of it and the others are pointed to that copy.
+        """
+        digest = self.by_path.get(file_path)
+        self.forget(file_path)
+        self.aliases.pop(file_path, None)
+        dependents = [alias for alias, target in self.aliases.items() if target == file_path]
+        if not dependents or not os.path.exists(file_path):
+            return
+        holder = dependents[0]
+        shutil.copyfile(file_path, holder)
+        del self.aliases[holder]
+        size = os.path.getsize(holder)
+        mtime_ns = os.stat(holder).st_mtime_ns
+        self.remember(digest, holder, mtime_ns)
+        entries = [{"hash": digest, "path": holder, "size": size, "time": time.time(), "mtime_ns": mtime_ns}]
+        for alias in dependents[1:]:
+            self.aliases[alias] = holder
+            entries.append({"hash": digest, "path": alias, "size": size, "time": time.time(),
+                            "link": "manifest", "duplicate_of": holder})
+        self.append(entries)
+
+    def remove(self, file_path):
+        """
+        Forget a file that is deleted from the save directory; call it before the file is deleted.
+
+        Description:
+        Names that point to the file in the index get a copy of its content first, as in release.
+        """
+        with self.lock:
+            file_path = self.stored_path(file_path)
+            self.release(file_path)
+            self.append([{"path": file_path, "removed": True, "time": time.time()}])
+
+    def stored_path(self, file_path):
+        """
+        Return file_path as it is written in the index, which may be relative or differ in case.
+        """
+        if file_path in self.by_path or file_path in self.aliases:
+            return file_path
+        target = os.path.normcase(os.path.abspath(file_path))
+        for path in list(self.by_path) + list(self.aliases):
+            if os.path.normcase(os.path.abspath(path)) == target:
+                return path
+        return file_path
+
+    def append(self, entries):
+        with open(self.index_path, 'a', encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def store(self, temp_path, file_path, digest):
+        """
+        Move a completed file into place, or link it to an identical stored file.
+
+        Args:
+        - temp_path: The completed partial file.
+        - file_path: The final path of the file.
+        - digest: The hex digest of the content of the file.
+
+        Returns:
+        The path of the stored file with the same content, or None if the file is new.
+        """
+        with self.lock:
+            size = os.path.getsize(temp_path)
+            existing = self.lookup(digest, size)
+            same_file = existing is not None and os.path.abspath(existing) == os.path.abspath(file_path)
+            if not same_file:
+                self.release(file_path)
+
+            entry = {"hash": digest, "path": file_path, "size": size, "time": time.time()}
+            if existing is None or same_file:
+                move_file(temp_path, file_path)
+                entry["mtime_ns"] = os.stat(file_path).st_mtime_ns
+                self.remember(digest, file_path, entry["mtime_ns"])
+                existing = None
+            else:
+                os.remove(temp_path)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                try:
+                    os.link(existing, file_path)
+                    entry["link"] = "hardlink"
+                    entry["mtime_ns"] = os.stat(file_path).st_mtime_ns
+                    self.remember(digest, file_path, entry["mtime_ns"], replace=False)
+                except OSError:
+                    entry["link"] = "manifest"
+                    self.aliases[file_path] = existing
+                entry["duplicate_of"] = existing
+
+            self.append([entry])
+            return existing
+
+    def resolve(self, file_path):
+        """
+        Return the path holding the content of file_path.
+        """
+        return self.aliases.get(file_path, file_path)
@@ -0,0 +1,58 @@
+"""
+File: transferProtocol.py
+
+Description:
+This file defines the framing of the resumable, chunked transfer mode of the
+file receiver. The stock Live Link Face app sends a single blob: an int32 with
+the size of the file followed by the file itself. A chunked upload instead
+starts with CHUNKED_MAGIC in place of that size, which no legacy file can have,
+so both modes are served on the same port.
+
+Chunked upload:
+- Sender: CHUNKED_MAGIC, then the upload header (total size, chunk size, upload id).
+- Receiver: a status frame with STATUS_RESUME and the offset to continue from.
+- Sender: chunks starting at that offset, each with its offset, length and CRC32.
+- Receiver: a status frame with STATUS_DONE once the file is complete, or
+  STATUS_BAD_CHUNK with the last good offset after which it closes the connection.
+
+An interrupted upload is continued by reconnecting with the same upload id, the
+receiver answers with the offset of the last verified chunk.
+"""
+import struct
+import zlib
+
+# Sent in place of the int32 size of a legacy transfer
+CHUNKED_MAGIC = 0xFFFFFFFF
+# The receiver refuses chunks larger than this
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+UPLOAD_HEADER = struct.Struct('>QIH')  # total size, chunk size, length of the upload id
+CHUNK_HEADER = struct.Struct('>QII')  # offset, length, crc32
+STATUS = struct.Struct('>BQ')  # status, offset
+
+STATUS_RESUME = 0
+STATUS_DONE = 1
+STATUS_BAD_CHUNK = 2
+
+
+def pack_upload_header(total_size, chunk_size, upload_id):
+    """
+    Pack the header that opens a chunked upload, including the magic value.
+    """
+    upload_id = upload_id.encode("utf-8")
+    return struct.pack('>I', CHUNKED_MAGIC) + UPLOAD_HEADER.pack(total_size, chunk_size, len(upload_id)) + upload_id
+
+
+def pack_chunk_header(offset, chunk):
+    """
+    Pack the header that precedes a chunk of data.
+    """
+    return CHUNK_HEADER.pack(offset, len(chunk), zlib.crc32(chunk))
+
+
+def valid_upload_id(upload_id):
+    """
+    Check an upload id is safe to use as part of a file name.
+    """
+    return 0 < len(upload_id) <= 64 and all(c.isalnum() or c in "-_" for c in upload_id)
@@ -0,0 +1,213 @@
+"""
+File: transferTelemetry.py
+
+Description:
+This file defines the per-transfer instrumentation of the file receiver. Every
+received file gets a TransferRecord with the time to first byte, the time spent
+on the network, the time it waited for the writer thread, the time spent
+writing it and the resulting throughput. Comparing the network and write
+durations shows whether the network or the disk is the bottleneck.
+
+The records are kept in a rolling in-memory store, appended to a JSONL log and
+served as JSON by a small HTTP endpoint on localhost:
+- GET /metrics: percentiles per file type, and the state of the write queues.
+- GET /transfers: the most recent transfer records.
+
+Classes:
+- TransferRecord: The timings of a single transfer.
+- TransferTelemetry: Rolling store, JSONL log and metrics endpoint.
+- TimedFile: File wrapper that records the time spent writing.
+"""
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class TransferRecord:
+    """
+    Class TransferRecord holds the timings of a single transfer.
+
+    Description:
+    All timestamps are time.perf_counter() values, set by the receiver as the
+    transfer progresses. The write time is the time the writer thread spent on
+    this file's writes and on moving it into place.
+    """
+    def __init__(self, receiver, peer, started):
+        self.receiver = receiver
+        self.peer = peer
+        self.wall_time = time.time()
+        self.started = started
+        self.first_byte = None
+        self.last_byte = None
+        self.finish_started = None
+        self.finished = None
+        self.write_seconds = 0.0
+        self.mode = None
+        self.file_name = None
+        self.size = 0
+        self.received = 0
+        self.resumed_at = None
+        self.duplicate = False
+        self.qc = None
+        # Why the transfer did not produce a file, None if it did
+        self.error = None
+
+    def add_write_time(self, seconds):
+        self.write_seconds += seconds
+
+    def to_dict(self):
+        network = self.last_byte - self.first_byte
+        return {
+            "time": self.wall_time,
+            "receiver": self.receiver,
+            "peer": self.peer,
+            "mode": self.mode,
+            "file": self.file_name,
+            "size": self.size,
+            "received": self.received,
+            "complete": self.received >= self.size,
+            "resumed_at": self.resumed_at,
+            "duplicate": self.duplicate,
+            "qc": self.qc,
+            "error": self.error,
+            "ttfb_ms": 1000 * (self.first_byte - self.started),
+            "network_ms": 1000 * network,
+            "queue_wait_ms": 1000 * (self.finish_started - self.last_byte),
+            "write_ms": 1000 * self.write_seconds,
+            "total_ms": 1000 * (self.finished - self.started),
+            "network_mb_per_s": self.received / max(network, 1e-9) / 1e6,
+        }
+
+
+class TransferTelemetry:
+    """
+    Class TransferTelemetry collects the transfer records of the file receivers.
+
+    Attributes:
+    - records: The most recent transfer records, as dicts.
+    - log_path: Optional JSONL file every record is appended to.
+    - sources: Functions returning extra state for /metrics, by name.
+    """
+    def __init__(self, max_records=1000, log_path=None):
+        self.records = collections.deque(maxlen=max_records)
+        self.log_path = log_path
+        self.sources = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start_transfer(self, receiver, peer, started):
+        return TransferRecord(receiver, str(peer), started)
+
+    def add_source(self, name, func):
+        """
+        Add a function whose result is included in /metrics, such as the write queue stats.
+        """
+        self.sources[name] = func
+
+    def finish(self, record):
+        """
+        Store a completed transfer record and append it to the log.
+        """
+        record.finished = time.perf_counter()
+        entry = record.to_dict()
+        with self.lock:
+            self.records.append(entry)
+            if self.log_path is not None:
+                try:
+                    os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                    with open(self.log_path, 'a', encoding="utf-8") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except OSError as e:
+                    print(f"[telemetry] Error writing transfer log: {e}")
+        print(f"[{record.receiver}] {record.file_name}.{record.mode}: ttfb {entry['ttfb_ms']:.1f} ms, "
+              f"network {entry['network_ms']:.1f} ms, queue {entry['queue_wait_ms']:.1f} ms, "
+              f"write {entry['write_ms']:.1f} ms, {entry['network_mb_per_s']:.1f} MB/s"
+              + (f", failed: {record.error}" if record.error else ""))
+
+    def recent(self, count=100):
+        with self.lock:
+            return list(self.records)[-count:]
+
+    def summary(self):
+        """
+        Return the p50/p95/p99 of every timing per file type, and the sources.
+        """
+        with self.lock:
+            records = list(self.records)
+        metrics = {}
+        for mode in sorted({r["mode"] for r in records}):
+            of_mode = [r for r in records if r["mode"] == mode]
+            metrics[mode] = {"transfers": len(of_mode), "bytes": sum(r["received"] for r in of_mode)}
+            for key in ("ttfb_ms", "network_ms", "queue_wait_ms", "write_ms", "total_ms", "network_mb_per_s"):
+                values = [r[key] for r in of_mode]
+                metrics[mode][key] = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+        return {
+            "transfers": metrics,
+            "incomplete": sum(not r["complete"] for r in records),
+            **{name: func() for name, func in self.sources.items()},
+        }
+
+    def serve_metrics(self, host, port):
+        """
+        Serve /metrics and /transfers as JSON on a background thread.
+        """
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = telemetry.summary()
+                elif self.path.startswith("/transfers"):
+                    body = telemetry.recent()
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body, indent=2).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"[telemetry] Metrics on http://{host}:{port}/metrics")
+
+
+class TimedFile:
+    """
+    Class TimedFile wraps a file and adds the time spent writing it to a record.
+    """
+    def __init__(self, f, record):
+        self.f = f
+        self.record = record
+
+    def write(self, data):
+        start = time.perf_counter()
+        try:
+            return self.f.write(data)
+        finally:
+            self.record.add_write_time(time.perf_counter() - start)
+
+    def flush(self):
+        start = time.perf_counter()
+        self.f.flush()
+        self.record.add_write_time(time.perf_counter() - start)
+
+    def close(self):
+        start = time.perf_counter()
+        self.f.close()
+        self.record.add_write_time(time.perf_counter() - start)
@@ -0,0 +1,193 @@
+"""
+File: writePipeline.py
+
+Description:
+This file defines the WritePipeline class, a bounded queue of disk writes that
+is drained by a single writer thread. The memory held by the queued writes is
+limited by a budget in bytes. A coroutine that wants to queue more data than
+fits in the budget waits in acquire until the writer thread has caught up, so
+the receiving socket is no longer read and TCP flow control slows the sender.
+
+Classes:
+- WritePipeline: Bounded write queue with a memory budget and write statistics.
+"""
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+class WritePipeline:
+    """
+    Class WritePipeline runs disk writes on a writer thread within a memory budget.
+
+    Description:
+    Buffers are handed out by acquire, filled by the caller and passed back
+    with write. Once written they return to a free list and are reused, so a
+    steady stream of writes does not allocate new buffers. Any other work that
+    has to happen in order with the writes, such as closing and renaming a
+    file, is queued with call.
+
+    Attributes:
+    - name: The name used in log messages.
+    - memory_budget: The maximum number of bytes held by queued writes.
+    - bytes_in_flight: The number of bytes acquired and not yet written.
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, name="write"):
+        self.name = name
+        self.memory_budget = memory_budget
+        self.bytes_in_flight = 0
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.waiters = collections.deque()
+        self.free_buffers = collections.defaultdict(list)
+        self.free_bytes = 0
+        self.thread = None
+
+        # Write statistics
+        self.write_count = 0
+        self.bytes_written = 0
+        self.total_queue_wait = 0.0
+        self.total_write_time = 0.0
+        self.max_write_latency = 0.0
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Finish the queued work and stop the writer thread.
+        """
+        self.tasks.put(None)
+        self.thread.join()
+
+    async def acquire(self, size):
+        """
+        Wait until size bytes fit in the memory budget and return a buffer.
+
+        Description:
+        A single request larger than the budget is allowed once nothing else is
+        in flight, so it cannot wait forever.
+
+        Returns:
+        A bytearray of exactly size bytes.
+        """
+        with self.lock:
+            if not self.waiters and self.fits(size):
+                self.bytes_in_flight += size
+                return self.take_buffer(size)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.waiters.append((size, future, loop))
+        return await future
+
+    def fits(self, size):
+        return self.bytes_in_flight == 0 or self.bytes_in_flight + size <= self.memory_budget
+
+    def take_buffer(self, size):
+        """
+        Take a buffer from the free list, or allocate one. Must hold the lock.
+        """
+        if self.free_buffers[size]:
+            self.free_bytes -= size
+            return self.free_buffers[size].pop()
+
+        # Drop unused buffers of other sizes to stay within the budget
+        for free in self.free_buffers.values():
+            while free and self.free_bytes + self.bytes_in_flight > self.memory_budget:
+                self.free_bytes -= len(free.pop())
+        return bytearray(size)
+
+    def release(self, buffer):
+        """
+        Return an acquired buffer that is not going to be written.
+        """
+        with self.lock:
+            self.bytes_in_flight -= len(buffer)
+            self.free_buffers[len(buffer)].append(buffer)
+            self.free_bytes += len(buffer)
+
+            # Hand the freed budget to the coroutines waiting for it, in order
+            while self.waiters and self.fits(self.waiters[0][0]):
+                size, future, loop = self.waiters.popleft()
+                self.bytes_in_flight += size
+                loop.call_soon_threadsafe(self.wake, future, self.take_buffer(size))
+
+    def wake(self, future, buffer):
+        if future.cancelled():
+            self.release(buffer)
+        else:
+            future.set_result(buffer)
+
+    def write(self, f, buffer, size=None):
+        """
+        Queue a write of the first size bytes of an acquired buffer to f.
+        """
+        if size is None:
+            size = len(buffer)
+        self.tasks.put((time.perf_counter(), f.write, (memoryview(buffer)[:size],), buffer))
+
+    def call(self, func, *args):
+        """
+        Queue a call that runs on the writer thread, in order with the writes.
+        """
+        self.tasks.put((time.perf_counter(), func, args, None))
+
+    async def drain(self):
+        """
+        Wait until everything queued so far has been handled.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.call(loop.call_soon_threadsafe, lambda: future.done() or future.set_result(None))
+        await future
+
+    def run(self):
+        """
+        Worker function of the writer thread.
+        """
+        while True:
+            task = self.tasks.get()
+            if task is None:  # Sentinel to terminate the worker
+                break
+
+            enqueued, func, args, buffer = task
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"[{self.name}] Error writing file: {e}")
+            finally:
+                end = time.perf_counter()
+                if buffer is not None:
+                    self.write_count += 1
+                    self.bytes_written += len(args[0])
+                    self.total_queue_wait += start - enqueued
+                    self.total_write_time += end - start
+                    self.max_write_latency = max(self.max_write_latency, end - enqueued)
+                    args = None
+                    self.release(buffer)
+
+    def stats(self):
+        """
+        Return the current queue depth, bytes in flight and write latencies.
+        """
+        writes = max(self.write_count, 1)
+        return {
+            "queue_depth": self.tasks.qsize(),
+            "bytes_in_flight": self.bytes_in_flight,
+            "memory_budget": self.memory_budget,
+            "waiting": len(self.waiters),
+            "writes": self.write_count,
+            "bytes_written": self.bytes_written,
+            "mean_queue_wait_ms": 1000 * self.total_queue_wait / writes,
+            "mean_write_ms": 1000 * self.total_write_time / writes,
+            "max_write_latency_ms": 1000 * self.max_write_latency,
+        }
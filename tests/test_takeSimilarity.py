@@ -0,0 +1,19 @@
+import numpy as np
+
+from src.utils.blendshapeLoader import CHANNEL_COUNT, DEFAULT_FPS, BlendshapeTake
+from src.utils.takeSimilarity import DEFAULT_POINTS, SimilarityIndex, build_index
+
+
+def test_empty_corpus(tmp_path):
+    takes, index_dir = tmp_path / "takes", tmp_path / "index"
+    takes.mkdir()
+    index = build_index([str(takes)], str(index_dir), workers=1)
+    assert len(index) == 0
+
+    index = SimilarityIndex.load(str(index_dir))
+    assert len(index) == 0
+    assert index.features.shape == (0, (4 + DEFAULT_POINTS) * CHANNEL_COUNT)
+    take = BlendshapeTake([f"c{i}" for i in range(CHANNEL_COUNT)], np.arange(10) / DEFAULT_FPS,
+                          np.random.rand(10, CHANNEL_COUNT).astype(np.float32), DEFAULT_FPS)
+    assert index.query(take) == []
+    assert index.duplicates() == []
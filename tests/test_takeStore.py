@@ -0,0 +1,52 @@
+import os
+
+from src.utils.takeStore import TakeStore, new_hash
+
+
+def store_payload(store, tmp_path, name, payload):
+    temp_path = tmp_path / f"{name}.part"
+    temp_path.write_bytes(payload)
+    digest = new_hash()
+    digest.update(payload)
+    return store.store(str(temp_path), str(tmp_path / name), digest.hexdigest())
+
+
+def test_overwritten_file_is_not_linked_to(tmp_path):
+    store = TakeStore(str(tmp_path))
+    x, y = b"x" * 100, b"y" * 100
+    store_payload(store, tmp_path, "B.csv", x)
+    store_payload(store, tmp_path, "B.csv", y)
+    assert store_payload(store, tmp_path, "C.csv", x) is None
+    assert (tmp_path / "B.csv").read_bytes() == y
+    assert (tmp_path / "C.csv").read_bytes() == x
+
+    # The same holds after the index is loaded again
+    store = TakeStore(str(tmp_path))
+    assert store_payload(store, tmp_path, "D.csv", x) == str(tmp_path / "C.csv")
+    assert store_payload(store, tmp_path, "E.csv", y) == str(tmp_path / "B.csv")
+
+
+def test_changed_file_is_not_linked_to(tmp_path):
+    store = TakeStore(str(tmp_path))
+    store_payload(store, tmp_path, "A.csv", b"x" * 100)
+    # Changed in place, behind the back of the store
+    (tmp_path / "A.csv").write_bytes(b"z" * 100)
+    os.utime(tmp_path / "A.csv", ns=(0, 12345))
+    assert store_payload(store, tmp_path, "F.csv", b"x" * 100) is None
+    assert (tmp_path / "F.csv").read_bytes() == b"x" * 100
+
+
+def test_aliases_keep_their_content(tmp_path, monkeypatch):
+    store = TakeStore(str(tmp_path))
+
+    def no_links(src, dst):
+        raise OSError("no hard links")
+
+    monkeypatch.setattr(os, "link", no_links)
+    store_payload(store, tmp_path, "A.csv", b"x" * 100)
+    store_payload(store, tmp_path, "B.csv", b"x" * 100)
+    store_payload(store, tmp_path, "C.csv", b"x" * 100)
+    store_payload(store, tmp_path, "A.csv", b"y" * 100)
+    assert open(store.resolve(str(tmp_path / "B.csv")), "rb").read() == b"x" * 100
+    assert open(store.resolve(str(tmp_path / "C.csv")), "rb").read() == b"x" * 100
+    assert open(store.resolve(str(tmp_path / "A.csv")), "rb").read() == b"y" * 100